@@ -0,0 +1,122 @@
+import json
+import logging
+import re
+import time
+
+from cache import get_default_cache
+from clients import get_async_openai_client
+from telemetry import OPENAI, VALIDATION, get_telemetry, stage
+from vocabulary_worker import VocabularyWorker, has_definitions
+from vocard.model import Card
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DefinitionStreamParser:
+    # Incremental parser for {"definitions": [{...}, {...}]} completions: feed() takes the next chunk of
+    # text and returns the definition objects that were completed by it
+    ARRAY_START = re.compile(r'"definitions"\s*:\s*\[')
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.in_array = False
+        self.done = False
+
+    def feed(self, text: str):
+        self._buffer += text
+        results = []
+        if not self.in_array and not self.done:
+            match = DefinitionStreamParser.ARRAY_START.search(self._buffer, self._pos)
+            if match is None:
+                # Keep enough of the tail to match a key split across chunks
+                self._pos = max(self._pos, len(self._buffer) - 32)
+                return results
+            self._pos = match.end()
+            self.in_array = True
+        while self.in_array and self._pos < len(self._buffer):
+            ch = self._buffer[self._pos]
+            if self._start is None:
+                if ch == '{':
+                    self._start = self._pos
+                    self._depth = 1
+                elif ch == ']':
+                    self.in_array = False
+                    self.done = True
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                self._depth += 1
+            elif ch == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    results.append(json.loads(self._buffer[self._start:self._pos + 1]))
+                    self._start = None
+            self._pos += 1
+        if self._start is None:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        return results
+
+
+def _is_valid(entry, context):
+    try:
+        with stage(VALIDATION, operation="stream_word_definition"):
+            Card.validate({"topic": context or "", **entry})
+    except ValueError as e:
+        LOGGER.warning(f"Dropping malformed streamed definition {entry}: {e}")
+        return False
+    return True
+
+
+async def stream_word_definition(word, context=None, client=None, cache=None, model=None):
+    # Yields each validated definition of word as soon as the completion has produced it
+    model = VocabularyWorker.model_for("get_word_definition", model)
+    prompt, messages = VocabularyWorker.definition_messages(word, context, model=model)
+    cache = cache if cache is not None else get_default_cache()
+    cached = cache.get(word, context, prompt, model)
+    if has_definitions(cached):
+        for entry in cached["definitions"]:
+            yield entry
+        return
+    client = client if client is not None else get_async_openai_client()
+    telemetry = get_telemetry()
+    start = time.perf_counter()
+    stream = await client.chat.completions.create(
+        model=model,
+        response_format=prompt.response_format(model),
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    parser = DefinitionStreamParser()
+    definitions = []
+    first_token = True
+    async for chunk in stream:
+        # The last chunk carries the usage of the whole completion and no choices
+        if getattr(chunk, "usage", None) is not None:
+            telemetry.record_usage(chunk.usage, model=model, operation="stream_word_definition")
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        if first_token:
+            telemetry.record_duration(OPENAI, time.perf_counter() - start, operation="stream_first_token")
+            first_token = False
+        for entry in parser.feed(chunk.choices[0].delta.content):
+            if _is_valid(entry, context):
+                definitions.append(entry)
+                yield entry
+    telemetry.record_duration(OPENAI, time.perf_counter() - start, operation="stream_word_definition")
+    # An answer that was cut off or held no valid definition is not cached
+    if parser.done and definitions:
+        cache.set(word, context, prompt, model, {"definitions": definitions})
@@ -0,0 +1,121 @@
+# Asynchronous generation jobs: jobs/create fans a topic out into one queue message per word, the queue
+# trigger defines each word and writes its cards, and jobs/{jobId} reports the progress counters.
+# Locally the queue and tables are served by Azurite (StorageConnectionString=UseDevelopmentStorage=true).
+import json
+import logging
+import typing
+
+import azure.functions as func
+from azure.core.exceptions import ResourceNotFoundError
+
+from clients import get_table_client, get_table_service
+from vocabulary_worker import VocabularyWorker
+from vocard.aggregates import parts_of_speech, record_card_changes
+from vocard.bulk import bulk_import_cards, normalize_generated_card, summarize
+from vocard.media import localize_media
+from vocard.jobs import (JOB_ITEMS_TABLE, JOB_PARTITION, JOBS_TABLE, MAX_DEQUEUE_COUNT, MAX_JOB_WORDS, QUEUE_NAME,
+                         card_row_key, expand_item, fail_job, job_status, new_job, record_item, set_total, word_items)
+
+jobs = func.Blueprint()
+
+_tables_created = False
+
+
+def get_jobs_tables():
+    global _tables_created
+    if not _tables_created:
+        service = get_table_service()
+        service.create_table_if_not_exists(JOBS_TABLE)
+        service.create_table_if_not_exists(JOB_ITEMS_TABLE)
+        _tables_created = True
+    return get_table_client(JOBS_TABLE), get_table_client(JOB_ITEMS_TABLE)
+
+
+@jobs.function_name("CreateJob")
+@jobs.route(route="jobs/create", methods=[func.HttpMethod.POST], auth_level=func.AuthLevel.ANONYMOUS)
+@jobs.queue_output(arg_name="items", queue_name=QUEUE_NAME, connection="StorageConnectionString")
+def create_job(req: func.HttpRequest, items: func.Out[typing.List[str]]) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    try:
+        req_body = req.get_json()
+    except ValueError:
+        return func.HttpResponse("Please pass a JSON object in the request body", status_code=400)
+    topic = req_body.get('topic') if isinstance(req_body, dict) else None
+    words = req_body.get('words') if isinstance(req_body, dict) else None
+    if not isinstance(topic, str) or not topic.strip():
+        return func.HttpResponse("Bad Request: topic must be a non-empty string", status_code=400)
+    if words is not None and (not isinstance(words, list) or not all(isinstance(w, str) for w in words)):
+        return func.HttpResponse("Bad Request: words must be a list of strings", status_code=400)
+    if words is not None and len(words) > MAX_JOB_WORDS:
+        return func.HttpResponse(f"Bad Request: a job can have at most {MAX_JOB_WORDS} words", status_code=400)
+
+    job = new_job(topic, words)
+    jobs_client, _ = get_jobs_tables()
+    jobs_client.create_entity(entity=job)
+    items.set(word_items(job["RowKey"], topic, words) if words else [expand_item(job["RowKey"], topic)])
+    return func.HttpResponse(json.dumps(job_status(job)), status_code=202, mimetype="application/json",
+                             headers={"Location": f"/api/jobs/{job['RowKey']}"})
+
+
+@jobs.function_name("ProcessJobItem")
+@jobs.queue_trigger(arg_name="msg", queue_name=QUEUE_NAME, connection="StorageConnectionString")
+@jobs.queue_output(arg_name="items", queue_name=QUEUE_NAME, connection="StorageConnectionString")
+def process_job_item(msg: func.QueueMessage, items: func.Out[typing.List[str]]) -> None:
+    logging.info('Python queue trigger function processed a work item.')
+    item = msg.get_json()
+    job_id = item["jobId"]
+    topic = item["topic"]
+    jobs_client, items_client = get_jobs_tables()
+    if "word" not in item:
+        # Expand item: ask for the topic's word list and fan it out
+        try:
+            words = VocabularyWorker().get_vocabulary_list(topic)
+        except Exception as e:
+            if (msg.dequeue_count or 1) < MAX_DEQUEUE_COUNT:
+                logging.warning(f"Job {job_id} word list failed, attempt {msg.dequeue_count}: {e}")
+                raise
+            logging.error(f"Job {job_id} word list failed permanently: {e}")
+            fail_job(jobs_client, job_id, e)
+            return
+        set_total(jobs_client, job_id, len(words))
+        items.set(word_items(job_id, topic, words))
+        return
+
+    index = item["index"]
+    word = item["word"]
+    try:
+        definitions = VocabularyWorker().get_word_definition(word, topic)["definitions"]
+        cards = [dict(normalize_generated_card(definition, topic), rowKey=card_row_key(job_id, index, sense))
+                 for sense, definition in enumerate(definitions)]
+        localize_media(cards)
+        report = bulk_import_cards(get_table_client("Cards"), cards, upsert=True)
+        summary = summarize(report)
+        if summary["created"] == 0:
+            raise ValueError(f"No valid cards for {word}: {summary}")
+    except Exception as e:
+        if (msg.dequeue_count or 1) < MAX_DEQUEUE_COUNT:
+            # Let the queue redeliver the item after its visibility timeout
+            logging.warning(f"Job {job_id} item {index} ({word}) failed, attempt {msg.dequeue_count}: {e}")
+            raise
+        logging.error(f"Job {job_id} item {index} ({word}) failed permanently: {e}")
+        record_item(jobs_client, items_client, job_id, index, word, error=e)
+    else:
+        # Only the first record of an item counts its cards; a redelivered item overwrote the same cards
+        if record_item(jobs_client, items_client, job_id, index, word, cards=summary["created"]):
+            created = [item for item in report if item["status"] == "created"]
+            record_card_changes(created[0]["PartitionKey"], len(created),
+                                parts_of_speech(cards[item["index"]] for item in created))
+
+
+@jobs.function_name("GetJob")
+@jobs.route(route="jobs/{jobId}", methods=[func.HttpMethod.GET], auth_level=func.AuthLevel.ANONYMOUS)
+def get_job(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    job_id = req.route_params.get('jobId')
+    jobs_client, _ = get_jobs_tables()
+    try:
+        job = jobs_client.get_entity(JOB_PARTITION, job_id)
+    except ResourceNotFoundError:
+        return func.HttpResponse("Not Found", status_code=404)
+    return func.HttpResponse(json.dumps(job_status(job)), status_code=200, mimetype="application/json",
+                             headers={"Cache-Control": "no-cache"})
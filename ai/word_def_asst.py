@@ -7,6 +7,9 @@ import json
 
 import azure.functions as func
 import logging
+from azurefunctions.extensions.http.fastapi import Request, StreamingResponse
+
+from ai.definition_stream import stream_word_definition
 from vocabulary_worker import VocabularyWorker as worker
 
 assistant = func.Blueprint()
@@ -25,4 +28,30 @@ def generate_definitions(req: func.HttpRequest) -> func.HttpResponse:
     worker_instance = worker()
     response = worker_instance.get_word_definition(word, topic)
 
-    return func.HttpResponse(json.dumps(response), status_code=200)
\ No newline at end of file
+    return func.HttpResponse(json.dumps(response), status_code=200)
+
+
+@assistant.route(route="definitions/stream", methods=[func.HttpMethod.POST], auth_level=func.AuthLevel.ANONYMOUS)
+async def stream_definitions(req: Request) -> StreamingResponse:
+    # Same request as definitions/gen; responds with one NDJSON line per definition as soon as it is generated
+    logging.info('Python HTTP trigger function processed a request.')
+    try:
+        req_body = await req.json()
+    except ValueError:
+        req_body = None
+    if not isinstance(req_body, dict) or 'word' not in req_body:
+        async def bad_request():
+            yield json.dumps({"error": "Please provide a word in the request body"}) + "\n"
+        return StreamingResponse(bad_request(), status_code=400, media_type="application/x-ndjson")
+    word = req_body.get('word')
+    topic = req_body.get('topic')
+
+    async def definitions():
+        try:
+            async for definition in stream_word_definition(word, topic):
+                yield json.dumps(definition, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logging.error(f"Streaming definitions of {word} failed: {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(definitions(), media_type="application/x-ndjson")
@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import time
+
+from clients import load_settings
+from vocabulary_worker import VocabularyWorker, generation_metadata
+from vocard.media import localize_media
+
+LOGGER = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def get_batch_client():
+    # Azure OpenAI when AZURE_OPENAI_ENDPOINT is configured (the SDK reads AZURE_OPENAI_API_KEY and
+    # OPENAI_API_VERSION), the OpenAI platform otherwise
+    import openai
+    load_settings()
+    if os.environ.get("AZURE_OPENAI_ENDPOINT"):
+        return openai.AzureOpenAI()
+    return openai.OpenAI()
+
+
+def batch_endpoint(client):
+    return "/chat/completions" if type(client).__name__ == "AzureOpenAI" else "/v1/chat/completions"
+
+
+def batch_model():
+    return os.environ.get("OpenAIBatchModel") or VocabularyWorker.model_for("get_word_definition")
+
+
+def build_batch_input(words, path, endpoint="/v1/chat/completions", context=None, model=None):
+    # One chat completion request per word; custom_id carries the word's index to map results back
+    model = model or batch_model()
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, "w", encoding='utf-8') as f:
+        for index, word in enumerate(words):
+            prompt, messages = VocabularyWorker.definition_messages(word, context, model=model)
+            request = {
+                "custom_id": f"{index}:{word}",
+                "method": "POST",
+                "url": endpoint,
+                "body": {"model": model, "response_format": prompt.response_format(model), "messages": messages}
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return path
+
+
+def submit_batch(client, input_path, endpoint="/v1/chat/completions", metadata=None):
+    with open(input_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=endpoint,
+        completion_window="24h",
+        metadata=metadata
+    )
+    LOGGER.info(f"Submitted batch {batch.id} from {input_path}")
+    return batch
+
+
+def wait_for_batch(client, batch_id, poll_interval: float = 60):
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        counts = getattr(batch, "request_counts", None)
+        LOGGER.info(f"Batch {batch_id} is {batch.status}: {counts}")
+        time.sleep(poll_interval)
+
+
+def parse_batch_output(text):
+    # Returns ({word: definitions}, failed_words) from the batch output JSONL
+    results = {}
+    failed = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        word = record["custom_id"].split(":", 1)[1]
+        response = record.get("response") or {}
+        try:
+            if response.get("status_code") != 200:
+                raise ValueError(record.get("error") or f"status code {response.get('status_code')}")
+            content = response["body"]["choices"][0]["message"]["content"]
+            results[word] = json.loads(content)["definitions"]
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            LOGGER.warning(f"No definitions for word {word}: {e}")
+            failed.append(word)
+    return results, failed
+
+
+def collect_batch_results(client, batch):
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch.id} ended with status {batch.status}")
+    results, failed = {}, []
+    if batch.output_file_id:
+        results, failed = parse_batch_output(client.files.content(batch.output_file_id).text)
+    if getattr(batch, "error_file_id", None):
+        _, errors = parse_batch_output(client.files.content(batch.error_file_id).text)
+        failed.extend(errors)
+    return results, failed
+
+
+def generate_with_batch_api(filename: str, client=None, poll_interval: float = 60):
+    # Offline counterpart of generate_from_file: defines every word of input/<filename> through the Batch API
+    with open(f"input/{filename}", "r", encoding='utf-8') as f:
+        words = json.load(f)["words"]
+    title = filename.replace(".json", "").replace("_", " ").title()
+    client = client if client is not None else get_batch_client()
+    endpoint = batch_endpoint(client)
+    input_path = build_batch_input(words, f"output/{filename.replace('.json', '')}.batch_input.jsonl", endpoint)
+    batch = submit_batch(client, input_path, endpoint, metadata={"title": title})
+    batch = wait_for_batch(client, batch.id, poll_interval)
+    results, failed = collect_batch_results(client, batch)
+    if failed:
+        LOGGER.warning(f"Failed to define {len(failed)} words: {failed}")
+    vocabularies = [definition for word in words for definition in results.get(word, [])]
+    vocabularies.sort(key=lambda x: x["word"])
+    return {"title": title, "metadata": generation_metadata("get_word_definition", model=batch_model()),
+            "vocabularies": localize_media(vocabularies)}
@@ -0,0 +1,158 @@
+# Prompt cost report: tokens, latency and Card.validate pass rate of each definition prompt variant and model
+# over a fixed golden word set. --static only counts the tokens of the requests locally, without API calls;
+# --mock runs against the local chat completions stand-in instead of the configured OpenAI endpoint.
+# Run with: python -m benchmarks.prompts [--variants full compact] [--models gpt-3.5-turbo gpt-4o-mini]
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.run import percentiles
+from prompt_engineer import count_message_tokens
+from vocabulary_worker import DEFINITION_VARIANTS, VocabularyWorker
+from vocard.bulk import normalize_generated_card
+from vocard.model import Card
+
+# Fixed so that reports of different runs are comparable: common and rare words, several parts of speech,
+# homographs and words with many senses
+GOLDEN_WORDS = [
+    "contract", "run", "light", "bank", "present", "record", "fair", "bear", "close", "lead",
+    "apple", "environment", "negotiate", "reluctant", "thoroughly", "although", "beneath", "wind",
+    "content", "subject",
+]
+GOLDEN_TOPIC = "Golden set"
+# USD per million (prompt, completion) tokens; update when pricing changes
+PRICES = {
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4o": (2.5, 10.0),
+}
+
+
+def static_report(variants, model, words=GOLDEN_WORDS, context=None):
+    # Tokens of the requests as they would be sent to model, counted locally; a schema sent as the response
+    # format is billed as prompt tokens too, so it is included
+    rows = {}
+    for variant in variants:
+        counts = []
+        for word in words:
+            prompt, messages = VocabularyWorker.definition_messages(word, context, variant, model)
+            counts.append(count_message_tokens(messages, model) + prompt.format_tokens(model))
+        rows[variant] = {"prompt": prompt.name(), "templateTokens": prompt.tokens(model),
+                         "requestTokens": round(sum(counts) / len(counts), 1),
+                         "responseFormat": prompt.response_format(model)["type"]}
+    return rows
+
+
+def define(client, word, variant, model, context=None):
+    # One uncached completion; returns (latency, usage, definitions or None when the answer is not JSON)
+    prompt, messages = VocabularyWorker.definition_messages(word, context, variant, model)
+    start = time.perf_counter()
+    completion = client.chat.completions.create(model=model, response_format=prompt.response_format(model),
+                                                messages=messages)
+    latency = time.perf_counter() - start
+    try:
+        definitions = json.loads(completion.choices[0].message.content)["definitions"]
+        if not isinstance(definitions, list):
+            raise TypeError("definitions is not a list")
+    except (TypeError, KeyError, ValueError):
+        definitions = None
+    return latency, completion.usage, definitions
+
+
+def evaluate(client, variant, model, words=GOLDEN_WORDS, context=None, concurrency: int = 4):
+    def define_or_fail(word):
+        # A failed request (e.g. a response format the model rejects) is counted, not fatal to the report
+        try:
+            return define(client, word, variant, model, context)
+        except Exception as e:
+            logging.warning(f"Defining {word} with {variant}/{model} failed: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(define_or_fail, words))
+    results = [outcome for outcome in outcomes if outcome is not None]
+    prompt_tokens = sum(getattr(usage, "prompt_tokens", 0) or 0 for _, usage, _ in results)
+    completion_tokens = sum(getattr(usage, "completion_tokens", 0) or 0 for _, usage, _ in results)
+    definitions = [d for _, _, entries in results if entries for d in entries]
+    valid = sum(1 for d in definitions
+                if isinstance(d, dict) and not Card.errors(normalize_generated_card(d, context or GOLDEN_TOPIC)))
+    row = dict(
+        words=len(words),
+        errors=len(outcomes) - len(results),
+        unparsed=sum(1 for _, _, entries in results if entries is None),
+        definitions=len(definitions),
+        validRate=round(valid / len(definitions), 4) if definitions else 0.0,
+        promptTokensPerWord=round(prompt_tokens / max(1, len(results)), 1),
+        completionTokensPerWord=round(completion_tokens / max(1, len(results)), 1),
+        tokensPerDefinition=round((prompt_tokens + completion_tokens) / valid, 1) if valid else None,
+        **percentiles([latency for latency, _, _ in results])
+    )
+    if model in PRICES and valid:
+        prompt_price, completion_price = PRICES[model]
+        cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+        row["costPerDefinition"] = round(cost / valid, 7)
+    return row
+
+
+def format_table(rows):
+    columns = sorted({column for row in rows.values() for column in row}, key=lambda c: (c != "prompt", c))
+    lines = ["\t".join(["variant/model"] + columns)]
+    for name, row in rows.items():
+        lines.append("\t".join([name] + [str(row.get(column, "")) for column in columns]))
+    return "\n".join(lines)
+
+
+def run(args, client=None):
+    report = {"static": {}, "measured": {}}
+    for model in args.models:
+        for variant, row in static_report(args.variants, model, context=args.context).items():
+            report["static"][f"{variant}/{model}"] = row
+    if args.static:
+        return report
+    server = None
+    if client is None:
+        if args.mock:
+            from openai import OpenAI
+            from mocks.openai_server import MockOpenAIServer
+            server = MockOpenAIServer(latency=args.latency).start()
+            client = OpenAI(base_url=server.base_url, api_key="benchmark")
+        else:
+            from clients import get_openai_client
+            client = get_openai_client()
+    try:
+        for model in args.models:
+            for variant in args.variants:
+                report["measured"][f"{variant}/{model}"] = evaluate(client, variant, model, context=args.context,
+                                                                    concurrency=args.concurrency)
+    finally:
+        if server is not None:
+            server.stop()
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Token cost, latency and validity of definition prompt variants")
+    parser.add_argument("--variants", nargs="+", default=list(DEFINITION_VARIANTS), choices=list(DEFINITION_VARIANTS))
+    parser.add_argument("--models", nargs="+", default=[VocabularyWorker.model_for("get_word_definition")])
+    parser.add_argument("--context", help="define the golden words in this context")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--static", action="store_true", help="only count request tokens locally")
+    parser.add_argument("--mock", action="store_true", help="use the local chat completions stand-in")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock completion latency in seconds")
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    args = parse_args()
+    report = run(args)
+    print(format_table(report["static"]))
+    if report["measured"]:
+        print()
+        print(format_table(report["measured"]))
+    if args.output:
+        with open(args.output, "w", encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,273 @@
+# Offline load benchmark for generation and the HTTP handlers, against a local mock of the chat completions
+# endpoint and an in-memory Table (or Azurite, with --storage env and StorageConnectionString set).
+# Run with: python -m benchmarks.run [--words N] [--output results.json] [--baseline baseline.json]
+# Results are written as JSON; with --baseline the run fails when a metric regressed by more than --tolerance.
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from mocks.functions import handler
+from mocks.openai_server import MockOpenAIServer
+from mocks.table import InMemoryTableClient
+from vocard.model import keyify
+
+# Metrics where a larger value is better; every other compared metric is better when smaller
+HIGHER_IS_BETTER = {"wordsPerSecond", "opsPerSecond"}
+COMPARED_METRICS = ("wordsPerSecond", "opsPerSecond", "p50", "p95", "p99", "tokensPerWord")
+
+
+def percentiles(samples):
+    # Nearest-rank percentiles in milliseconds
+    ordered = sorted(samples)
+    if not ordered:
+        return {"p50": None, "p95": None, "p99": None}
+    return {f"p{p}": round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] * 1000, 3) for p in (50, 95, 99)}
+
+
+def configure_environment(server):
+    # Must run before the first client is created: clients.py builds them lazily from the environment
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["DefinitionCacheBackend"] = "memory"
+    # Measure the pipeline rather than the client-side limiter
+    os.environ.setdefault("OpenAIRequestsPerMinute", "1000000")
+    os.environ.setdefault("OpenAITokensPerMinute", "1000000000")
+
+
+def generation_result(server, words, elapsed, latencies):
+    stats = server.stats.as_dict()
+    return dict(
+        stats,
+        words=words,
+        seconds=round(elapsed, 3),
+        wordsPerSecond=round(words / elapsed, 2),
+        tokensPerWord=round((stats["promptTokens"] + stats["completionTokens"]) / words, 1),
+        **percentiles(latencies)
+    )
+
+
+def timed_completions(latencies):
+    # Patches GenerationEngine._complete to record the client-side latency of every completion, including
+    # rate limiter waits, retries and backoff, which the mock server's own service times leave out
+    from generation_engine import GenerationEngine
+    complete = GenerationEngine._complete
+
+    async def timed(engine, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await complete(engine, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    return mock.patch.object(GenerationEngine, "_complete", timed)
+
+
+def bench_generate_from_file(server, words, batched=False):
+    # End-to-end generate_from_file over a generated input file; latencies are per chat completion, as
+    # seen by the client
+    from vocabulary_worker import generate_from_file
+    server.stats.reset()
+    latencies = []
+    prefix = "batched" if batched else "single"
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, "input"))
+        with open(os.path.join(directory, "input", "benchmark.json"), "w", encoding='utf-8') as f:
+            json.dump({"words": [f"{prefix}word{i}" for i in range(words)]}, f)
+        os.chdir(directory)
+        try:
+            with timed_completions(latencies):
+                start = time.perf_counter()
+                data = generate_from_file("benchmark.json", batched=batched)
+                elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    defined = len({definition["word"] for definition in data["vocabularies"]})
+    if defined != words:
+        raise RuntimeError(f"generate_from_file defined {defined} of {words} words")
+    return generation_result(server, words, elapsed, latencies)
+
+
+def run_concurrently(calls, concurrency):
+    # Runs the (name, callable) pairs on a thread pool; returns (elapsed, {name: [latency, ...]})
+    latencies = {}
+
+    def timed(name, call):
+        start = time.perf_counter()
+        call()
+        return name, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for name, latency in executor.map(lambda item: timed(*item), calls):
+            latencies.setdefault(name, []).append(latency)
+    return time.perf_counter() - start, latencies
+
+
+def bench_definitions_route(server, words, concurrency):
+    # The definitions/gen handler under concurrent load; latencies are per HTTP request
+    import azure.functions as func
+    from ai.word_def_asst import generate_definitions
+    route = handler(generate_definitions)
+    server.stats.reset()
+
+    def call(word):
+        body = json.dumps({"word": word, "topic": "Benchmark"}).encode('utf-8')
+        response = route(func.HttpRequest("POST", "/api/definitions/gen", body=body))
+        if response.status_code != 200:
+            raise RuntimeError(f"definitions/gen returned {response.status_code}")
+
+    elapsed, latencies = run_concurrently(
+        [("gen", lambda word=f"routeword{i}": call(word)) for i in range(words)], concurrency)
+    return generation_result(server, words, elapsed, latencies["gen"])
+
+
+def bench_crud(cards, concurrency, storage="memory", latency=0.0):
+    # Create, read, list, patch and delete cards through the function handlers
+    import azure.functions as func
+    import function_app
+    from vocard import aggregates
+
+    tables = {}
+
+    def get_table_client(table_name):
+        if storage == "env":
+            from clients import get_table_client as get_storage_table_client
+            return get_storage_table_client(table_name)
+        return tables.setdefault(table_name, InMemoryTableClient(table_name, latency=latency))
+
+    def request(method, url, route_params=None, body=None, params=None):
+        return func.HttpRequest(method, url, route_params=route_params or {}, params=params or {},
+                                body=json.dumps(body).encode('utf-8') if body is not None else b"")
+
+    created = []
+
+    def create(i):
+        body = {"topic": f"Benchmark {'abcdefghij'[i % 10]}", "word": f"crudword{i}", "partOfSpeech": "n.",
+                "definition": f"Definition {i}.", "meaningVi": "từ"}
+        response = handler(function_app.create_new_card)(request("POST", "/api/cards/create", body=body))
+        entity = json.loads(response.get_body())
+        created.append((body["topic"], entity))
+
+    def check(response, *status_codes):
+        if response.status_code not in status_codes:
+            raise RuntimeError(f"Unexpected status {response.status_code}: {response.get_body()[:200]}")
+
+    # Card writes also update the topic stats table, which must come from the same storage
+    get_stats_table = aggregates.get_stats_table
+    stats_patch = mock.patch.object(aggregates, "get_stats_table", side_effect=lambda: get_stats_table()
+                                    if storage == "env" else get_table_client(aggregates.STATS_TABLE))
+    with mock.patch.object(function_app, "get_table_client", side_effect=get_table_client), stats_patch:
+        elapsed, latencies = run_concurrently([("create", lambda i=i: create(i)) for i in range(cards)],
+                                              concurrency)
+        # create_entity returns metadata only, so the keys are looked up through the list endpoint
+        keys = []
+        for partition_key in sorted({keyify(topic) for topic, _ in created}):
+            response = handler(function_app.get_cards_by_topic)(
+                request("GET", f"/api/cards/{partition_key}", {"topicKey": partition_key}, params={"$top": "1000"}))
+            keys += [(card["PartitionKey"], card["RowKey"]) for card in json.loads(response.get_body())["cards"]]
+
+        def route(pk, rk):
+            return {"topicKey": pk, "cardKey": rk}
+
+        calls = []
+        for pk, rk in keys:
+            calls.append(("get", lambda pk=pk, rk=rk: check(handler(function_app.get_card)(
+                request("GET", f"/api/cards/{pk}/{rk}", route(pk, rk))), 200)))
+            calls.append(("list", lambda pk=pk: check(handler(function_app.get_cards_by_topic)(
+                request("GET", f"/api/cards/{pk}", {"topicKey": pk}, params={"$top": "20"})), 200)))
+            calls.append(("patch", lambda pk=pk, rk=rk: check(handler(function_app.update_card)(
+                request("PATCH", f"/api/cards/{pk}/{rk}/change", route(pk, rk), body={"meaningVi": "đã sửa"})),
+                200)))
+        more_elapsed, more_latencies = run_concurrently(calls, concurrency)
+        elapsed += more_elapsed
+        latencies.update(more_latencies)
+        delete_elapsed, delete_latencies = run_concurrently(
+            [("delete", lambda pk=pk, rk=rk: check(handler(function_app.delete_card)(
+                request("DELETE", f"/api/cards/{pk}/{rk}/delete", route(pk, rk))), 200)) for pk, rk in keys],
+            concurrency)
+        elapsed += delete_elapsed
+        latencies.update(delete_latencies)
+
+    operations = sum(len(samples) for samples in latencies.values())
+    return dict(
+        operations=operations,
+        seconds=round(elapsed, 3),
+        opsPerSecond=round(operations / elapsed, 2),
+        byOperation={name: percentiles(samples) for name, samples in sorted(latencies.items())},
+        **percentiles([latency for samples in latencies.values() for latency in samples])
+    )
+
+
+def compare(results, baseline, tolerance):
+    # Returns a description of every metric that is worse than the baseline by more than tolerance
+    regressions = []
+    for scenario, metrics in baseline.get("scenarios", {}).items():
+        current = results["scenarios"].get(scenario)
+        if current is None:
+            continue
+        for name in COMPARED_METRICS:
+            if metrics.get(name) is None or current.get(name) is None:
+                continue
+            before, after = metrics[name], current[name]
+            if name in HIGHER_IS_BETTER:
+                worse = after < before * (1 - tolerance)
+            else:
+                worse = after > before * (1 + tolerance)
+            if worse:
+                regressions.append(f"{scenario}.{name}: {before} -> {after}")
+    return regressions
+
+
+def run(args):
+    server = MockOpenAIServer(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                              seed=args.seed).start()
+    try:
+        configure_environment(server)
+        scenarios = {
+            "generate_from_file": bench_generate_from_file(server, args.words),
+            "generate_from_file_batched": bench_generate_from_file(server, args.words, batched=True),
+            "definitions_gen": bench_definitions_route(server, args.requests, args.concurrency),
+            "crud": bench_crud(args.cards, args.concurrency, args.storage, args.table_latency),
+        }
+    finally:
+        server.stop()
+    return {"config": vars(args), "scenarios": scenarios}
+
+
+if __name__ == "__main__":
+    # Injected 429s are logged as warnings by the engine; keep the report readable
+    logging.basicConfig(level=logging.ERROR)
+    parser = argparse.ArgumentParser(description="Offline throughput and latency benchmark")
+    parser.add_argument("--words", type=int, default=500, help="words for generate_from_file")
+    parser.add_argument("--requests", type=int, default=200, help="definitions/gen requests")
+    parser.add_argument("--cards", type=int, default=500, help="cards for the CRUD scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock completion latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="mock completion latency jitter in seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.02, help="fraction of completions answered 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--storage", choices=["memory", "env"], default="memory",
+                        help="env uses StorageConnectionString, e.g. Azurite")
+    parser.add_argument("--table-latency", type=float, default=0.0, help="in-memory table latency in seconds")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+    results = run(args)
+    with open(args.output, "w", encoding='utf-8') as f:
+        json.dump(results, f, indent=4)
+    print(json.dumps(results["scenarios"], indent=4))
+    if args.baseline:
+        with open(args.baseline, "r", encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,78 @@
+# Batch validation throughput of the compiled Card validator against the previous isinstance chain.
+# Run with: python -m benchmarks.validation [records]
+import sys
+import time
+
+from vocard.model import Card
+
+
+def legacy_validate(data):
+    # Card.validate as it was before the compiled schema
+    required_keys = {'topic', 'word', 'partOfSpeech', 'definition'}
+    if not required_keys.issubset(data.keys()):
+        raise ValueError(f"Missing required keys: {required_keys - set(data.keys())}")
+    if not isinstance(data['word'], str):
+        raise ValueError(f"word must be a string")
+    if not isinstance(data['partOfSpeech'], str):
+        raise ValueError(f"partOfSpeech must be a string")
+    if not isinstance(data['definition'], str):
+        raise ValueError(f"definition must be a string")
+    if 'partitionKey' in data and not isinstance(data['partitionKey'], str):
+        raise ValueError(f"partitionKey must be a string")
+    if 'rowKey' in data and not isinstance(data['rowKey'], str):
+        raise ValueError(f"rowKey must be a string")
+    if 'ipaUk' in data and not isinstance(data['ipaUk'], str):
+        raise ValueError(f"ipaUk must be a string")
+    if 'ipaUs' in data and not isinstance(data['ipaUs'], str):
+        raise ValueError(f"ipaUs must be a string")
+    if 'pronUk' in data and not isinstance(data['pronUk'], str):
+        raise ValueError(f"pronUk must be a string")
+    if 'pronUs' in data and not isinstance(data['pronUs'], str):
+        raise ValueError(f"pronUs must be a string")
+    if 'meaningVi' in data and not isinstance(data['meaningVi'], str):
+        raise ValueError(f"meaningVi must be a string")
+    if 'exampleSentence' in data and not isinstance(data['exampleSentence'], str):
+        raise ValueError(f"exampleSentence must be a string")
+
+
+def make_records(count):
+    records = []
+    for i in range(count):
+        record = {
+            "topic": "Oxford 3000", "word": f"word{i}", "partOfSpeech": "n.", "definition": "A definition.",
+            "ipaUk": "/wɜːd/", "ipaUs": "/wɜːrd/", "pronUk": "https://example.com/uk.mp3",
+            "pronUs": "https://example.com/us.mp3", "meaningVi": "từ", "exampleSentence": "A word."
+        }
+        if i % 50 == 0:
+            record["definition"] = None
+        records.append(record)
+    return records
+
+
+def legacy_validate_many(records):
+    invalid = []
+    for index, record in enumerate(records):
+        try:
+            legacy_validate(record)
+        except ValueError as e:
+            invalid.append((index, [str(e)]))
+    return invalid
+
+
+def measure(function, records, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(records)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(records) / best
+
+
+if __name__ == "__main__":
+    records = make_records(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+    assert [i for i, _ in legacy_validate_many(records)] == [i for i, _ in Card.validate_many(records)]
+    legacy = measure(legacy_validate_many, records)
+    compiled = measure(Card.validate_many, records)
+    print(f"legacy:   {legacy:,.0f} records/s")
+    print(f"compiled: {compiled:,.0f} records/s ({compiled / legacy:.2f}x)")
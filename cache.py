@@ -0,0 +1,383 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from telemetry import TABLE_IO, stage
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.store_hits = 0
+        self.store_errors = 0
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "storeHits": self.store_hits,
+                "storeErrors": self.store_errors,
+            }
+
+
+class LRUCache:
+    # In-process LRU with an optional per-entry time to live (seconds)
+    def __init__(self, max_size: int = 1024, ttl: float = None, stats: CacheStats = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = stats or CacheStats()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.stats.incr("expirations")
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.stats.incr("evictions")
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteStore:
+    # Persistent key/value store on a local SQLite file, shared by all threads of the process
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value: str, ttl: float = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                                        (time.time(),))
+        return cursor.rowcount
+
+
+class TableStore:
+    # Persistent key/value store on an Azure Table; keys are spread over 256 partitions by their first hex byte
+    def __init__(self, table_client):
+        self.table_client = table_client
+
+    @staticmethod
+    def _keys(key):
+        return key[:2], key
+
+    def get(self, key):
+        from azure.core.exceptions import ResourceNotFoundError
+        partition_key, row_key = TableStore._keys(key)
+        try:
+            entity = self.table_client.get_entity(partition_key, row_key)
+        except ResourceNotFoundError:
+            return None
+        expires_at = entity.get("expiresAt")
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return entity["value"]
+
+    def set(self, key, value: str, ttl: float = None):
+        partition_key, row_key = TableStore._keys(key)
+        entity = {"PartitionKey": partition_key, "RowKey": row_key, "value": value}
+        if ttl:
+            entity["expiresAt"] = time.time() + ttl
+        self.table_client.upsert_entity(entity=entity)
+
+    def delete(self, key):
+        partition_key, row_key = TableStore._keys(key)
+        self.table_client.delete_entity(partition_key, row_key)
+
+
+class RedisStore:
+    # Shared key/value store for caches that must be visible to every instance (requires the redis package)
+    def __init__(self, url: str, prefix: str = "vocard:"):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value: str, ttl: float = None):
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def normalize_word(word):
+    if word is None:
+        return ""
+    return " ".join(word.split()).lower()
+
+
+class DefinitionCache:
+    # Two-tier cache for generated definitions: in-process LRU in front of an optional persistent store.
+    # Entries are keyed on the prompt content hash, so editing a prompt file invalidates its entries.
+    def __init__(self, store=None, max_size: int = 4096, ttl: float = None):
+        self.stats = CacheStats()
+        self.memory = LRUCache(max_size=max_size, ttl=ttl, stats=self.stats)
+        self.store = store
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(word, context, prompt, model):
+        material = json.dumps([normalize_word(word), normalize_word(context), prompt.name(), prompt.hash(), model])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, word, context, prompt, model):
+        key = DefinitionCache.make_key(word, context, prompt, model)
+        value = self.memory.get(key)
+        if value is None and self.store is not None:
+            try:
+                value = self.store.get(key)
+            except Exception as e:
+                self.stats.incr("store_errors")
+                LOGGER.warning(f"Definition cache store read failed: {e}")
+            if value is not None:
+                self.stats.incr("store_hits")
+                self.memory.set(key, value)
+        if value is None:
+            self.stats.incr("misses")
+            return None
+        self.stats.incr("hits")
+        return json.loads(value)
+
+    def set(self, word, context, prompt, model, data):
+        key = DefinitionCache.make_key(word, context, prompt, model)
+        value = json.dumps(data, ensure_ascii=False)
+        self.memory.set(key, value)
+        if self.store is not None:
+            try:
+                self.store.set(key, value, self.ttl)
+            except Exception as e:
+                self.stats.incr("store_errors")
+                LOGGER.warning(f"Definition cache store write failed: {e}")
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def entity_etag(entity):
+    return entity.metadata.get("etag") if hasattr(entity, "metadata") else None
+
+
+def listing_etag(items):
+    # Changes whenever an item of the listing is added, removed or modified
+    digest = hashlib.sha1()
+    for item in items:
+        digest.update(f"{item['PartitionKey']}/{item['RowKey']}/{item.get('_etag')};".encode('utf-8'))
+    return f'"{digest.hexdigest()}"'
+
+
+class EntityCache:
+    # Read-through cache for Table entities and whole-partition listings. Entries are invalidated by the
+    # writes that go through function_app and otherwise expire after ttl seconds, which bounds how stale
+    # other instances can be.
+    def __init__(self, store=None, max_size: int = 2048, ttl: float = 30):
+        self.stats = CacheStats()
+        self.memory = LRUCache(max_size=max_size, ttl=ttl, stats=self.stats)
+        self.store = store
+        self.ttl = ttl
+
+    @staticmethod
+    def entity_key(table_name, partition_key, row_key):
+        return f"entity:{table_name}:{partition_key}:{row_key}"
+
+    @staticmethod
+    def partition_key(table_name, partition_key):
+        return f"partition:{table_name}:{partition_key}"
+
+    def _get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.store is not None:
+            try:
+                value = self.store.get(key)
+            except Exception as e:
+                self.stats.incr("store_errors")
+                LOGGER.warning(f"Entity cache store read failed: {e}")
+            if value is not None:
+                self.stats.incr("store_hits")
+                self.memory.set(key, value)
+        self.stats.incr("misses" if value is None else "hits")
+        return json.loads(value) if value is not None else None
+
+    def _set(self, key, data):
+        value = json.dumps(data, ensure_ascii=False, default=_json_default)
+        self.memory.set(key, value)
+        if self.store is not None:
+            try:
+                self.store.set(key, value, self.ttl)
+            except Exception as e:
+                self.stats.incr("store_errors")
+                LOGGER.warning(f"Entity cache store write failed: {e}")
+
+    def _delete(self, key):
+        self.memory.delete(key)
+        if self.store is not None:
+            try:
+                self.store.delete(key)
+            except Exception as e:
+                self.stats.incr("store_errors")
+                LOGGER.warning(f"Entity cache store delete failed: {e}")
+
+    def get_entity(self, table_client, partition_key, row_key):
+        # Returns (entity, etag); raises ResourceNotFoundError like TableClient.get_entity
+        key = EntityCache.entity_key(table_client.table_name, partition_key, row_key)
+        cached = self._get(key)
+        if cached is not None:
+            return cached["entity"], cached["etag"]
+        with stage(TABLE_IO, table=table_client.table_name, operation="get_entity"):
+            entity = table_client.get_entity(partition_key, row_key)
+        etag = entity_etag(entity)
+        self._set(key, {"entity": dict(entity), "etag": etag})
+        return dict(entity), etag
+
+    def list_partition(self, table_client, partition_key):
+        # Returns (entities, etag) for every entity of the partition
+        key = EntityCache.partition_key(table_client.table_name, partition_key)
+        cached = self._get(key)
+        if cached is not None:
+            return cached["items"], cached["etag"]
+        items = []
+        with stage(TABLE_IO, table=table_client.table_name, operation="query_entities"):
+            for entity in table_client.query_entities(query_filter="PartitionKey eq @partition_key",
+                                                      parameters={"partition_key": partition_key}):
+                items.append(dict(entity, _etag=entity_etag(entity)))
+        etag = listing_etag(items)
+        for item in items:
+            del item["_etag"]
+        self._set(key, {"items": items, "etag": etag})
+        return items, etag
+
+    def invalidate(self, table_name, partition_key, row_key=None):
+        if row_key is not None:
+            self._delete(EntityCache.entity_key(table_name, partition_key, row_key))
+        self._delete(EntityCache.partition_key(table_name, partition_key))
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+_entity_cache = None
+
+
+def _create_store(backend):
+    if backend == "memory":
+        return None
+    if backend == "table":
+        from clients import get_table_client, get_table_service
+        table_name = os.environ.get("DefinitionCacheTable", "DefinitionCache")
+        get_table_service().create_table_if_not_exists(table_name)
+        return TableStore(get_table_client(table_name))
+    if backend == "sqlite":
+        path = os.environ.get("DefinitionCachePath",
+                              os.path.join(tempfile.gettempdir(), "vocard", "definitions.sqlite3"))
+        return SqliteStore(path)
+    raise ValueError(f"Unknown definition cache backend: {backend}")
+
+
+def get_default_cache():
+    # Process-level cache configured from the environment:
+    # DefinitionCacheBackend (sqlite | table | memory), DefinitionCachePath, DefinitionCacheTable,
+    # DefinitionCacheSize and DefinitionCacheTtl (seconds, 0 for no expiry)
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            backend = os.environ.get("DefinitionCacheBackend", "sqlite").lower()
+            ttl = float(os.environ.get("DefinitionCacheTtl", 30 * 24 * 3600)) or None
+            max_size = int(os.environ.get("DefinitionCacheSize", 4096))
+            _default_cache = DefinitionCache(store=_create_store(backend), max_size=max_size, ttl=ttl)
+        return _default_cache
+
+
+def get_entity_cache():
+    # Process-level entity cache configured from the environment: EntityCacheSize, EntityCacheTtl (seconds)
+    # and, for a cache shared by all instances, EntityCacheRedisUrl
+    global _entity_cache
+    with _default_cache_lock:
+        if _entity_cache is None:
+            redis_url = os.environ.get("EntityCacheRedisUrl")
+            _entity_cache = EntityCache(
+                store=RedisStore(redis_url) if redis_url else None,
+                max_size=int(os.environ.get("EntityCacheSize", 2048)),
+                ttl=float(os.environ.get("EntityCacheTtl", 30))
+            )
+        return _entity_cache
@@ -0,0 +1,120 @@
+import heapq
+import json
+import logging
+import os
+import tempfile
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _read_jsonl(path):
+    with open(path, "r", encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A crash can leave a partially written last line behind; that word is simply redone
+                LOGGER.warning(f"Skipping malformed checkpoint line in {path}")
+
+
+def _truncate_partial_line(path, chunk_size=65536):
+    # Cuts a partially written last line (no trailing newline) off the file, so that the next append
+    # starts on a line of its own instead of being merged into the broken one
+    with open(path, "r+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - chunk_size)
+            f.seek(start)
+            chunk = f.read(position - start)
+            index = chunk.rfind(b"\n")
+            if index >= 0:
+                position = start + index + 1
+                break
+            position = start
+        if position < end:
+            LOGGER.warning(f"Dropping partially written last line of {path}")
+            f.truncate(position)
+
+
+class JsonlCheckpoint:
+    # Append-only JSONL checkpoint with one {"word", "definitions"} record per completed word
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            _truncate_partial_line(path)
+
+    def records(self):
+        if not os.path.exists(self.path):
+            return iter(())
+        return _read_jsonl(self.path)
+
+    def completed_words(self):
+        return {record["word"] for record in self.records()}
+
+    def append(self, word, definitions):
+        line = json.dumps({"word": word, "definitions": definitions}, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding='utf-8') as f:
+                f.write(line + "\n")
+                f.flush()
+
+    def _definitions(self):
+        # Yields every definition once, ignoring words checkpointed twice by overlapping runs
+        seen = set()
+        for record in _read_jsonl(self.path):
+            if record["word"] in seen:
+                continue
+            seen.add(record["word"])
+            yield from record["definitions"]
+
+    def _write_runs(self, directory, run_size, transform=None):
+        runs = []
+        buffer = []
+        for definition in self._definitions():
+            buffer.append(definition)
+            if len(buffer) >= run_size:
+                runs.append(JsonlCheckpoint._write_run(directory, len(runs), buffer, transform))
+                buffer = []
+        if buffer:
+            runs.append(JsonlCheckpoint._write_run(directory, len(runs), buffer, transform))
+        return runs
+
+    @staticmethod
+    def _write_run(directory, index, buffer, transform=None):
+        if transform is not None:
+            buffer = transform(buffer)
+        buffer.sort(key=lambda x: x["word"])
+        path = os.path.join(directory, f"run_{index}.jsonl")
+        with open(path, "w", encoding='utf-8') as f:
+            for definition in buffer:
+                f.write(json.dumps(definition, ensure_ascii=False) + "\n")
+        return path
+
+    def compact(self, output_path: str, title: str, run_size: int = 1000, metadata: dict = None, transform=None):
+        # Sorted runs of at most run_size definitions are k-way merged straight into the output file,
+        # so memory is bounded by run_size rather than by the size of the checkpoint. transform(definitions)
+        # is applied to each run before it is written.
+        count = 0
+        with tempfile.TemporaryDirectory() as directory:
+            runs = self._write_runs(directory, run_size, transform)
+            merged = heapq.merge(*[_read_jsonl(run) for run in runs], key=lambda x: x["word"])
+            with open(output_path, "w", encoding='utf-8') as f:
+                f.write('{"title": ' + json.dumps(title, ensure_ascii=False))
+                if metadata is not None:
+                    f.write(', "metadata": ' + json.dumps(metadata, ensure_ascii=False))
+                f.write(', "vocabularies": [')
+                for definition in merged:
+                    f.write(",\n    " if count else "\n    ")
+                    f.write(json.dumps(definition, ensure_ascii=False))
+                    count += 1
+                f.write("\n]}\n" if count else "]}\n")
+        return count
@@ -0,0 +1,120 @@
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+
+LOGGER = logging.getLogger(__name__)
+
+# Process-level registry of storage and OpenAI clients. Everything is created on first use, so importing
+# function_app stays cheap, and reused by every invocation on a warm instance so that connections
+# (and their TLS sessions) are kept alive between requests.
+_lock = threading.Lock()
+_table_service = None
+_table_clients = {}
+_blob_service = None
+_openai_client = None
+_async_openai_client = None
+_dotenv_loaded = False
+
+
+def _setting(name, default):
+    return type(default)(os.environ.get(name, default))
+
+
+def load_settings():
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        load_dotenv()
+        _dotenv_loaded = True
+
+
+def _storage_transport():
+    import requests
+    from azure.core.pipeline.transport import RequestsTransport
+    pool_size = _setting("StoragePoolSize", 32)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return RequestsTransport(
+        session=session,
+        session_owner=False,
+        connection_timeout=_setting("StorageConnectionTimeout", 5.0),
+        read_timeout=_setting("StorageReadTimeout", 30.0)
+    )
+
+
+def get_table_service():
+    global _table_service
+    if _table_service is None:
+        with _lock:
+            if _table_service is None:
+                import azure.data.tables as tbls
+                load_settings()
+                _table_service = tbls.TableServiceClient.from_connection_string(
+                    os.environ['StorageConnectionString'],
+                    transport=_storage_transport()
+                )
+    return _table_service
+
+
+def get_table_client(table_name: str):
+    table_client = _table_clients.get(table_name)
+    if table_client is None:
+        service = get_table_service()
+        with _lock:
+            table_client = _table_clients.get(table_name)
+            if table_client is None:
+                table_client = service.get_table_client(table_name)
+                _table_clients[table_name] = table_client
+    return table_client
+
+
+def get_blob_service():
+    global _blob_service
+    if _blob_service is None:
+        with _lock:
+            if _blob_service is None:
+                from azure.storage.blob import BlobServiceClient
+                load_settings()
+                _blob_service = BlobServiceClient.from_connection_string(
+                    os.environ['StorageConnectionString'],
+                    transport=_storage_transport()
+                )
+    return _blob_service
+
+
+def _openai_timeout():
+    # The SDK's own pooled http client is kept (its keep-alive pool already covers the worker's concurrency);
+    # only the timeouts are tightened, through the SDK's options rather than its transport
+    import openai
+    return openai.Timeout(_setting("OpenAIReadTimeout", 120.0), connect=_setting("OpenAIConnectionTimeout", 5.0))
+
+
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                import openai
+                load_settings()
+                _openai_client = openai.OpenAI(timeout=_openai_timeout())
+    return _openai_client
+
+
+def create_async_openai_client(max_retries: int = 0):
+    # Async clients are bound to the event loop they are used on, so callers own one per loop
+    import openai
+    load_settings()
+    return openai.AsyncOpenAI(max_retries=max_retries, timeout=_openai_timeout())
+
+
+def get_async_openai_client():
+    # Shared async client for async function handlers, which all run on the worker's long-lived event loop
+    global _async_openai_client
+    if _async_openai_client is None:
+        with _lock:
+            if _async_openai_client is None:
+                _async_openai_client = create_async_openai_client(max_retries=2)
+    return _async_openai_client
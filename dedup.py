@@ -0,0 +1,159 @@
+import hashlib
+import re
+
+# Shared with the definition cache, so that dedup keys and cache keys never drift apart
+from cache import normalize_word
+
+STOPWORDS = {
+    "a", "an", "the", "of", "to", "or", "and", "in", "on", "for", "with", "by", "at", "from", "that", "which",
+    "who", "is", "are", "be", "been", "being", "as", "it", "its", "something", "someone", "somebody", "sth", "sb",
+    "you", "your", "that", "this", "into", "about", "very", "used", "especially",
+}
+
+PARTS_OF_SPEECH = {
+    "n": "noun", "noun": "noun",
+    "v": "verb", "verb": "verb",
+    "adj": "adjective", "adjective": "adjective",
+    "adv": "adverb", "adverb": "adverb",
+    "prep": "preposition", "preposition": "preposition",
+    "pron": "pronoun", "pronoun": "pronoun",
+    "conj": "conjunction", "conjunction": "conjunction",
+    "det": "determiner", "determiner": "determiner",
+    "exclam": "exclamation", "exclamation": "exclamation",
+}
+
+IRREGULAR_PLURALS = {
+    "children": "child", "men": "man", "women": "woman", "people": "person", "feet": "foot", "teeth": "tooth",
+    "mice": "mouse",
+}
+
+IRREGULAR_FORMS = dict(IRREGULAR_PLURALS, **{
+    "went": "go", "gone": "go", "was": "be", "were": "be", "been": "be", "had": "have", "did": "do",
+    "done": "do", "made": "make", "took": "take", "taken": "take", "gave": "give", "given": "give",
+    "bought": "buy", "brought": "bring", "thought": "think", "found": "find",
+    "better": "good", "best": "good", "worse": "bad", "worst": "bad",
+})
+
+# Words that look inflected but are dictionary entries of their own
+NOT_INFLECTED = {
+    "news", "series", "species", "means", "glasses", "physics", "economics", "politics", "mathematics",
+    "athletics", "clothes", "goods", "jeans", "trousers", "scissors", "headquarters", "thanks", "always",
+    "perhaps", "various", "during", "evening", "morning", "ceiling", "interest",
+}
+
+# Suffix rules as (suffix, replacement); every rule that applies yields a candidate lemma
+PLURAL_RULES = [("ies", "y"), ("ves", "f"), ("ves", "fe"), ("es", ""), ("s", "")]
+INFLECTION_RULES = PLURAL_RULES + [
+    ("ied", "y"), ("ed", ""), ("ed", "e"),
+    ("ing", ""), ("ing", "e"),
+    ("ier", "y"), ("iest", "y"), ("er", ""), ("est", ""),
+]
+
+
+def normalize_part_of_speech(part_of_speech):
+    key = (part_of_speech or "").strip().lower().rstrip(".")
+    return PARTS_OF_SPEECH.get(key, key)
+
+
+def lemma_candidates(word, plurals_only: bool = False):
+    # Possible base forms of an inflected word, most specific first; the word itself is always the last one.
+    # Without a dictionary these are only guesses, so callers match them against words they already know.
+    # plurals_only restricts the guesses to noun plurals, which never name a different dictionary entry
+    # (unlike building/build or teacher/teach).
+    word = normalize_word(word)
+    irregular = IRREGULAR_PLURALS if plurals_only else IRREGULAR_FORMS
+    if word in irregular:
+        return [irregular[word], word]
+    if " " in word or word in NOT_INFLECTED:
+        return [word]
+    candidates = []
+    for suffix, replacement in (PLURAL_RULES if plurals_only else INFLECTION_RULES):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith("ss"):
+            stem = word[:-len(suffix)]
+            candidates.append(stem + replacement)
+            # Doubled final consonant: stopped -> stop, running -> run, bigger -> big
+            if not replacement and len(stem) > 3 and stem[-1] == stem[-2] and stem[-1] not in "aeiouls":
+                candidates.append(stem[:-1])
+    return candidates + [word]
+
+
+def definition_tokens(definition):
+    tokens = re.findall(r"[a-z]+", (definition or "").lower())
+    return frozenset(token for token in tokens if token not in STOPWORDS)
+
+
+def fingerprint(definition):
+    return hashlib.sha1(" ".join(sorted(definition_tokens(definition))).encode('utf-8')).hexdigest()[:16]
+
+
+def similarity(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class VocabularyIndex:
+    # In-memory index of generated senses keyed by (lemma, part of speech, definition fingerprint).
+    # filter_words() runs before dispatch so that known lemmas (and plurals of them) are not requested
+    # again, add() runs after generation and rejects senses that repeat, or nearly repeat (Jaccard
+    # similarity of the definition's content words), a sense already indexed for the same lemma and
+    # part of speech.
+    def __init__(self, threshold: float = 0.8):
+        self.threshold = threshold
+        self._lemmas = set()
+        self._fingerprints = set()
+        self._senses = {}
+
+    def lemma_of(self, word):
+        candidates = lemma_candidates(word)
+        for candidate in candidates:
+            if candidate in self._lemmas:
+                return candidate
+        return candidates[0] if normalize_word(word) in IRREGULAR_FORMS else candidates[-1]
+
+    def knows(self, word):
+        return any(candidate in self._lemmas for candidate in lemma_candidates(word, plurals_only=True))
+
+    def filter_words(self, words):
+        # Returns (words_to_request, skipped_words); also collapses inflected forms within the list itself
+        requested = set()
+        to_request = []
+        skipped = []
+        for word in words:
+            candidates = lemma_candidates(word, plurals_only=True)
+            if any(c in self._lemmas or c in requested for c in candidates):
+                skipped.append(word)
+                continue
+            requested.add(candidates[-1])
+            to_request.append(word)
+        # An inflected form listed before its base form ("apples" then "apple") is caught in a second pass
+        bases = {normalize_word(word) for word in to_request}
+        kept = []
+        for word in to_request:
+            if any(c in bases for c in lemma_candidates(word, plurals_only=True)[:-1]):
+                skipped.append(word)
+            else:
+                kept.append(word)
+        return kept, skipped
+
+    def add(self, definition):
+        # Returns False when the sense duplicates one already in the index
+        lemma = self.lemma_of(definition.get("word", ""))
+        part_of_speech = normalize_part_of_speech(definition.get("partOfSpeech"))
+        tokens = definition_tokens(definition.get("definition"))
+        key = (lemma, part_of_speech, fingerprint(definition.get("definition")))
+        if key in self._fingerprints:
+            return False
+        senses = self._senses.setdefault((lemma, part_of_speech), [])
+        if any(similarity(tokens, other) >= self.threshold for other in senses):
+            return False
+        self._fingerprints.add(key)
+        senses.append(tokens)
+        self._lemmas.add(lemma)
+        return True
+
+    def add_all(self, definitions):
+        return [definition for definition in definitions if self.add(definition)]
+
+    def __len__(self):
+        return len(self._fingerprints)
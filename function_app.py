@@ -1,30 +1,31 @@
+import hashlib
 import json
-import re
 import uuid
 from datetime import datetime
 
 import azure.functions as func
-import azure.data.tables as tbls
 import logging
-import os
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import UpdateMode
 
+from ai.generation_jobs import jobs
 from ai.word_def_asst import assistant
-from vocard.model import Card, Topic, Module
+from cache import get_entity_cache
+from clients import get_table_client
+from telemetry import SERIALIZATION, TABLE_IO, VALIDATION, stage
+from vocard.aggregates import (current_topic_stats, get_stats_table, module_aggregate, parts_of_speech,
+                               record_card_changes, topic_aggregate)
+from vocard.bulk import bulk_import_cards, summarize
+from vocard.export import (DECK_FORMATS, DECK_SCOPES, deck_version, get_deck_store, has_deletions, parse_since,
+                           prune_decks, publish_deck, quantize_since)
+from vocard.model import Card, Topic, Module, keyify, CARD_FIELDS
+from vocard.paging import decode_continuation_token, encode_continuation_token, parse_page_size, parse_select
+from vocard.search import build_search_index, get_search_index, peek_search_index, replace_search_index, save_search_index
 
 app = func.FunctionApp()
 app.register_functions(assistant)
-
-tbl_service = tbls.TableServiceClient.from_connection_string(os.environ['StorageConnectionString'])
-
-
-def keyify(s):
-    # Convert to lowercase
-    s = s.lower()
-    # Replace spaces with underscores
-    s = s.replace(' ', '_')
-    # Remove all characters that are not lowercase letters or underscores
-    s = re.sub(r'[^a-z_]', '', s)
-    return s
+app.register_functions(jobs)
 
 
 class CustomJSONEncoder(json.JSONEncoder):
@@ -34,13 +35,102 @@ class CustomJSONEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+def conditional_response(req: func.HttpRequest, payload, etag, compact: bool = False) -> func.HttpResponse:
+    # Answers 304 Not Modified when the client already holds the current version (If-None-Match)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+    if_none_match = [tag.strip() for tag in req.headers.get('If-None-Match', '').split(',')]
+    if etag and (etag in if_none_match or '*' in if_none_match):
+        return func.HttpResponse(status_code=304, headers=headers)
+    with stage(SERIALIZATION):
+        body = json.dumps(payload, cls=CustomJSONEncoder, ensure_ascii=False,
+                          separators=(",", ":") if compact else None)
+    return func.HttpResponse(body, status_code=200, headers=headers, mimetype="application/json", charset="utf-8")
+
+
+def write_conditions(req: func.HttpRequest):
+    # With If-Match the write only applies to that version of the entity. Without it the write is sent
+    # with If-Match: *, which still requires the entity to exist, so no separate existence check is needed.
+    etag = req.headers.get('If-Match')
+    if etag and etag != '*':
+        return {"etag": etag, "match_condition": MatchConditions.IfNotModified}
+    return {"match_condition": MatchConditions.Unconditionally}
+
+
+def apply_update(req: func.HttpRequest, table_name, partition_key, row_key, entity,
+                 conditions=None) -> func.HttpResponse:
+    # PUT replaces the entity, PATCH merges the given fields into it
+    mode = UpdateMode.MERGE if req.method == "PATCH" else UpdateMode.REPLACE
+    entity.update(
+        {
+            "PartitionKey": partition_key,
+            "RowKey": row_key
+        }
+    )
+    try:
+        with stage(TABLE_IO, table=table_name, operation="update_entity"):
+            result = get_table_client(table_name).update_entity(entity=entity, mode=mode,
+                                                                **(conditions or write_conditions(req)))
+    except ResourceNotFoundError:
+        return func.HttpResponse("Not Found", status_code=404)
+    except ResourceModifiedError:
+        return func.HttpResponse("Precondition Failed", status_code=412)
+    except Exception as e:
+        return func.HttpResponse(f"Internal Server Error: {str(e)}", status_code=500)
+    else:
+        get_entity_cache().invalidate(table_name, partition_key, row_key)
+        return func.HttpResponse(json.dumps(result, cls=CustomJSONEncoder), status_code=200,
+                                 headers={"ETag": result.get("etag")})
+
+
+def apply_delete(req: func.HttpRequest, table_name, partition_key, row_key, conditions=None) -> func.HttpResponse:
+    # TableClient.delete_entity swallows 404, so the status code is read from the raw response instead
+    status_codes = []
+    try:
+        with stage(TABLE_IO, table=table_name, operation="delete_entity"):
+            get_table_client(table_name).delete_entity(
+                partition_key,
+                row_key,
+                raw_response_hook=lambda response: status_codes.append(response.http_response.status_code),
+                **(conditions or write_conditions(req))
+            )
+    except ResourceModifiedError:
+        return func.HttpResponse("Precondition Failed", status_code=412)
+    except Exception as e:
+        return func.HttpResponse(f"Internal Server Error: {str(e)}", status_code=500)
+    else:
+        get_entity_cache().invalidate(table_name, partition_key, row_key)
+        if status_codes and status_codes[-1] == 404:
+            return func.HttpResponse("Not Found", status_code=404)
+        return func.HttpResponse(status_code=200)
+
+
+def pinned_card_write(req: func.HttpRequest, partition_key, row_key, write):
+    # Reads the card's part of speech and runs write(conditions) pinned to that version, so that the
+    # topic histogram can be moved by an exact delta. Returns (response, previous part of speech), the
+    # latter None when it is not known: the card is missing, is not the version the client's If-Match
+    # names, or changed between the read and the write. The write is then sent with the client's own
+    # conditions, which report 404 and 412 as before.
+    try:
+        with stage(TABLE_IO, table="Cards", operation="get_entity"):
+            current = get_table_client("Cards").get_entity(partition_key, row_key, select=["partOfSpeech"])
+    except ResourceNotFoundError:
+        current = None
+    if_match = req.headers.get('If-Match')
+    if current is not None and if_match in (None, '*', current.metadata["etag"]):
+        response = write({"etag": current.metadata["etag"], "match_condition": MatchConditions.IfNotModified})
+        if response.status_code != 412 or if_match not in (None, '*'):
+            return response, current.get("partOfSpeech") or "unknown"
+    return write(None), None
+
+
 @app.function_name("CreateCard")
 @app.route(route="cards/create", methods=[func.HttpMethod.POST], auth_level=func.AuthLevel.ANONYMOUS)
 def create_new_card(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
     req_body = req.get_json()
     try:
-        Card.validate(req_body)
+        with stage(VALIDATION, model="Card"):
+            Card.validate(req_body)
     except ValueError as e:
         return func.HttpResponse(f"Bad Request: {str(e)}", status_code=400)
     else:
@@ -50,42 +140,81 @@ def create_new_card(req: func.HttpRequest) -> func.HttpResponse:
                 "RowKey": str(uuid.uuid4())
             }
         )
-        table_client = tbl_service.get_table_client("Cards")
-        result = table_client.create_entity(entity=req_body)
+        table_client = get_table_client("Cards")
+        with stage(TABLE_IO, table="Cards", operation="create_entity"):
+            result = table_client.create_entity(entity=req_body)
+        get_entity_cache().invalidate("Cards", req_body["PartitionKey"], req_body["RowKey"])
+        record_card_changes(req_body["PartitionKey"], 1, parts_of_speech([req_body]))
+        search_index = peek_search_index()
+        if search_index is not None:
+            search_index.add(req_body)
         return func.HttpResponse(json.dumps(result, cls=CustomJSONEncoder), status_code=200)
 
 
+@app.function_name("CreateCards")
+@app.route(route="cards/bulk", methods=[func.HttpMethod.POST], auth_level=func.AuthLevel.ANONYMOUS)
+def create_cards_in_bulk(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    try:
+        req_body = req.get_json()
+    except ValueError:
+        return func.HttpResponse("Please pass a JSON object in the request body", status_code=400)
+    cards = req_body.get('cards') if isinstance(req_body, dict) else req_body
+    if not isinstance(cards, list):
+        return func.HttpResponse("Bad Request: cards must be a list", status_code=400)
+    table_client = get_table_client("Cards")
+    report = bulk_import_cards(table_client, cards)
+    created = {}
+    for item in report:
+        if item["status"] == "created":
+            created.setdefault(item["PartitionKey"], []).append(
+                dict(cards[item["index"]], PartitionKey=item["PartitionKey"], RowKey=item["RowKey"]))
+    for partition_key, topic_cards in created.items():
+        record_card_changes(partition_key, len(topic_cards), parts_of_speech(topic_cards))
+    search_index = peek_search_index()
+    if search_index is not None:
+        for topic_cards in created.values():
+            for card in topic_cards:
+                search_index.add(card)
+    response = dict(summarize(report), results=report)
+    status_code = 200 if response['created'] == len(report) else 207
+    return func.HttpResponse(json.dumps(response), status_code=status_code)
+
+
 @app.function_name("UpdateCard")
-@app.route(route="cards/{topicKey}/{cardKey}/change", methods=[func.HttpMethod.PUT], auth_level=func.AuthLevel.ANONYMOUS)
+@app.route(route="cards/{topicKey}/{cardKey}/change", methods=[func.HttpMethod.PUT, func.HttpMethod.PATCH],
+           auth_level=func.AuthLevel.ANONYMOUS)
 def update_card(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
     partition_key = req.route_params.get('topicKey')
     row_key = req.route_params.get('cardKey')
-    table_client = tbl_service.get_table_client("Cards")
-    # Check if the card exists
-    card = table_client.get_entity(partition_key, row_key)
-    if not card:
-        return func.HttpResponse("Not Found", status_code=404)
-    # Log existing card
-    logging.info(f"Existing card: {card}")
     req_body = req.get_json()
     try:
-        Card.validate(req_body)
+        with stage(VALIDATION, model="Card"):
+            Card.validate(req_body, partial=req.method == "PATCH")
     except ValueError as e:
         return func.HttpResponse(f"Bad Request: {str(e)}", status_code=400)
+    if req.method == "PATCH" and 'partOfSpeech' not in req_body:
+        # The histogram cannot change, so the update stays a single storage call
+        response = apply_update(req, "Cards", partition_key, row_key, req_body)
     else:
-        req_body.update(
-            {
-                "PartitionKey": partition_key,
-                "RowKey": row_key
-            }
-        )
-        try:
-            result = table_client.update_entity(entity=req_body)
-        except Exception as e:
-            return func.HttpResponse(f"Internal Server Error: {str(e)}", status_code=500)
+        response, previous = pinned_card_write(
+            req, partition_key, row_key,
+            lambda conditions: apply_update(req, "Cards", partition_key, row_key, req_body, conditions))
+        if response.status_code == 200:
+            if previous is None:
+                # The replaced part of speech is unknown, so the histogram is recounted on the next read
+                record_card_changes(partition_key, stale=True)
+            elif previous != (req_body.get('partOfSpeech') or "unknown"):
+                record_card_changes(partition_key, histogram={req_body.get('partOfSpeech') or "unknown": 1,
+                                                              previous: -1})
+    search_index = peek_search_index()
+    if search_index is not None and response.status_code == 200:
+        if req.method == "PATCH":
+            search_index.merge(partition_key, row_key, req_body)
         else:
-            return func.HttpResponse(json.dumps(result, cls=CustomJSONEncoder), status_code=200)
+            search_index.add(req_body)
+    return response
 
 
 @app.function_name("DeleteCard")
@@ -95,17 +224,58 @@ def delete_card(req: func.HttpRequest) -> func.HttpResponse:
 
     partition_key = req.route_params.get('topicKey')
     row_key = req.route_params.get('cardKey')
-    table_client = tbl_service.get_table_client("Cards")
-    # Check if the card exists
-    card = table_client.get_entity(partition_key, row_key)
-    if not card:
-        return func.HttpResponse("Not Found", status_code=404)
+    response, previous = pinned_card_write(
+        req, partition_key, row_key,
+        lambda conditions: apply_delete(req, "Cards", partition_key, row_key, conditions))
+    if response.status_code == 200:
+        record_card_changes(partition_key, -1, {previous: -1} if previous else None, stale=previous is None)
+    search_index = peek_search_index()
+    if search_index is not None and response.status_code == 200:
+        search_index.remove(partition_key, row_key)
+    return response
+
+
+@app.function_name("SearchCards")
+@app.route(route="cards/search", methods=[func.HttpMethod.GET], auth_level=func.AuthLevel.ANONYMOUS)
+def search_cards(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    query = req.params.get('q', '')
+    topic = req.params.get('topic')
     try:
-        table_client.delete_entity(partition_key, row_key)
-    except Exception as e:
-        return func.HttpResponse(f"Internal Server Error: {str(e)}", status_code=500)
-    else:
-        return func.HttpResponse(status_code=200)
+        limit = parse_page_size(req.params.get('limit'))
+    except ValueError as e:
+        return func.HttpResponse(f"Bad Request: {str(e)}", status_code=400)
+    if not query.strip():
+        return func.HttpResponse("Bad Request: q must be a non-empty string", status_code=400)
+    cards = get_search_index(get_table_client("Cards")).search(query, limit=limit,
+                                                                topic_key=keyify(topic) if topic else None)
+    with stage(SERIALIZATION):
+        body = json.dumps({"query": query, "cards": cards}, ensure_ascii=False)
+    return func.HttpResponse(body, status_code=200, mimetype="application/json", charset="utf-8")
+
+
+@app.function_name("SuggestCards")
+@app.route(route="cards/suggest", methods=[func.HttpMethod.GET], auth_level=func.AuthLevel.ANONYMOUS)
+def suggest_cards(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    try:
+        limit = parse_page_size(req.params.get('limit'))
+    except ValueError as e:
+        return func.HttpResponse(f"Bad Request: {str(e)}", status_code=400)
+    words = get_search_index(get_table_client("Cards")).suggest(req.params.get('q', ''), limit=limit)
+    return func.HttpResponse(json.dumps({"words": words}, ensure_ascii=False), status_code=200,
+                             mimetype="application/json", charset="utf-8")
+
+
+@app.function_name("RebuildSearchIndex")
+@app.timer_trigger(arg_name="timer", schedule="0 */30 * * * *", run_on_startup=False)
+def rebuild_search_index(timer: func.TimerRequest) -> None:
+    # Full rebuild from the table, which also drops cards deleted through other instances, and a fresh
+    # snapshot for the next cold start
+    logging.info('Python timer trigger function rebuilt the search index.')
+    index = build_search_index(get_table_client("Cards"))
+    save_search_index(index)
+    replace_search_index(index)
 
 
 @app.function_name("GetCards")
@@ -113,44 +283,46 @@ def delete_card(req: func.HttpRequest) -> func.HttpResponse:
 def get_cards_by_topic(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
     partition_key = req.route_params.get('topicKey')
-    page_size = int(req.params.get('pageSize', 10))
-    continuation_token = req.params.get('continuationToken', None)
-    table_client = tbl_service.get_table_client("Cards")
-    query = f"PartitionKey eq '{partition_key}'"
-
-    # Query the table with pagination
-    cards = []
     try:
+        page_size = parse_page_size(req.params.get('$top', req.params.get('pageSize')))
+        select = parse_select(req.params.get('select'), CARD_FIELDS)
+        continuation_token = decode_continuation_token(req.params.get('continuationToken'))
+    except ValueError as e:
+        return func.HttpResponse(f"Bad Request: {str(e)}", status_code=400)
+    table_client = get_table_client("Cards")
 
-        pages = table_client.query_entities(
-            query_filter=query,
-            results_per_page=page_size
-        ).by_page(continuation_token=continuation_token)
-
+    # Query a single page of the topic partition, resuming from the client's cursor
+    try:
+        with stage(TABLE_IO, table="Cards", operation="query_entities"):
+            pages = table_client.query_entities(
+                query_filter="PartitionKey eq @partition_key",
+                parameters={"partition_key": partition_key},
+                results_per_page=page_size,
+                select=select
+            ).by_page(continuation_token=continuation_token)
+            cards = list(next(pages, []))
     except Exception as e:
         return func.HttpResponse(f"Internal Server Error: {str(e)}", status_code=500)
-    except StopIteration:
-        next_continuation_token = None
-    else:
-        first_page = next(pages)
-        cards.extend(list(first_page))
-        # Extract the continuation token for the next page, if it exists
-        if 'x-ms-continuation-NextPartitionKey' in first_page.additional_properties:
-            next_partition_key = first_page.additional_properties['x-ms-continuation-NextPartitionKey']
-        if 'x-ms-continuation-NextRowKey' in first_page.additional_properties:
-            next_row_key = first_page.additional_properties['x-ms-continuation-NextRowKey']
-        if next_partition_key or next_row_key:
-            next_continuation_token = {
-                'PartitionKey': next_partition_key,
-                'RowKey': next_row_key
-            }
-        else:
-            next_continuation_token = None
-        response = {
-            'cards': cards,
-            'continuationToken': next_continuation_token
-        }
-        return func.HttpResponse(json.dumps(response), status_code=200)
+    response = {
+        'cards': cards,
+        'continuationToken': encode_continuation_token(pages.continuation_token)
+    }
+    with stage(SERIALIZATION):
+        body = "".join(CustomJSONEncoder(ensure_ascii=False).iterencode(response))
+    return func.HttpResponse(body, status_code=200, mimetype="application/json", charset="utf-8")
+
+
+@app.function_name("GetCard")
+@app.route(route="cards/{topicKey}/{cardKey}", methods=[func.HttpMethod.GET], auth_level=func.AuthLevel.ANONYMOUS)
+def get_card(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    partition_key = req.route_params.get('topicKey')
+    row_key = req.route_params.get('cardKey')
+    try:
+        card, etag = get_entity_cache().get_entity(get_table_client("Cards"), partition_key, row_key)
+    except ResourceNotFoundError:
+        return func.HttpResponse("Not Found", status_code=404)
+    return conditional_response(req, card, etag)
 
 
 @app.function_name("CreateTopic")
@@ -160,7 +332,8 @@ def create_new_topic(req: func.HttpRequest) -> func.HttpResponse:
 
     req_body = req.get_json()
     try:
-        Topic.validate(req_body)
+        with stage(VALIDATION, model="Topic"):
+            Topic.validate(req_body)
     except ValueError as e:
         return func.HttpResponse(f"Bad Request: {str(e)}", status_code=400)
     else:
@@ -170,42 +343,30 @@ def create_new_topic(req: func.HttpRequest) -> func.HttpResponse:
                 "RowKey": keyify(req_body['title'])
             }
         )
-        table_client = tbl_service.get_table_client("Topics")
-        result = table_client.create_entity(entity=req_body)['content']
+        table_client = get_table_client("Topics")
+        with stage(TABLE_IO, table="Topics", operation="create_entity"):
+            result = table_client.create_entity(entity=req_body)['content']
+        get_entity_cache().invalidate("Topics", req_body["PartitionKey"], req_body["RowKey"])
         return func.HttpResponse(json.dumps(result), status_code=200)
 
 
 @app.function_name("UpdateTopic")
-@app.route(route="topics/{moduleKey}/{topicKey}/change", methods=[func.HttpMethod.PUT], auth_level=func.AuthLevel.ANONYMOUS)
+@app.route(route="topics/{moduleKey}/{topicKey}/change", methods=[func.HttpMethod.PUT, func.HttpMethod.PATCH],
+           auth_level=func.AuthLevel.ANONYMOUS)
 def update_topic(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
     partition_key = req.route_params.get('moduleKey')
     row_key = req.route_params.get('topicKey')
-    table_client = tbl_service.get_table_client("Topics")
-    # Check if the topic exists
-    topic = table_client.get_entity(partition_key, row_key)
-    if not topic:
-        return func.HttpResponse("Not Found", status_code=404)
     req_body = req.get_json()
     try:
-        Topic.validate(req_body)
-        if req_body['title'] != row_key:
+        with stage(VALIDATION, model="Topic"):
+            Topic.validate(req_body, partial=req.method == "PATCH")
+        if 'title' in req_body and keyify(req_body['title']) != row_key:
             raise ValueError("Changing topic title is not allowed.")
     except ValueError as e:
         return func.HttpResponse(f"Bad Request: {str(e)}", status_code=400)
     else:
-        req_body.update(
-            {
-                "PartitionKey": partition_key,
-                "RowKey": row_key
-            }
-        )
-        try:
-            result = table_client.update_entity(entity=req_body)
-        except Exception as e:
-            return func.HttpResponse(f"Internal Server Error: {str(e)}", status_code=500)
-        else:
-            return func.HttpResponse(json.dumps(result, cls=CustomJSONEncoder), status_code=200)
+        return apply_update(req, "Topics", partition_key, row_key, req_body)
 
 
 @app.function_name("DeleteTopic")
@@ -215,17 +376,29 @@ def delete_topic(req: func.HttpRequest) -> func.HttpResponse:
 
     partition_key = req.route_params.get('moduleKey')
     row_key = req.route_params.get('topicKey')
-    table_client = tbl_service.get_table_client("Topics")
-    # Check if the topic exists
-    topic = table_client.get_entity(partition_key, row_key)
-    if not topic:
-        return func.HttpResponse("Not Found", status_code=404)
+    return apply_delete(req, "Topics", partition_key, row_key)
+
+
+@app.function_name("GetTopics")
+@app.route(route="topics/{moduleKey}", methods=[func.HttpMethod.GET], auth_level=func.AuthLevel.ANONYMOUS)
+def get_topics_by_module(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    partition_key = req.route_params.get('moduleKey')
+    topics, etag = get_entity_cache().list_partition(get_table_client("Topics"), partition_key)
+    return conditional_response(req, {'topics': topics}, etag)
+
+
+@app.function_name("GetTopic")
+@app.route(route="topics/{moduleKey}/{topicKey}", methods=[func.HttpMethod.GET], auth_level=func.AuthLevel.ANONYMOUS)
+def get_topic(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    partition_key = req.route_params.get('moduleKey')
+    row_key = req.route_params.get('topicKey')
     try:
-        table_client.delete_entity(partition_key, row_key)
-    except Exception as e:
-        return func.HttpResponse(f"Internal Server Error: {str(e)}", status_code=500)
-    else:
-        return func.HttpResponse(status_code=200)
+        topic, etag = get_entity_cache().get_entity(get_table_client("Topics"), partition_key, row_key)
+    except ResourceNotFoundError:
+        return func.HttpResponse("Not Found", status_code=404)
+    return conditional_response(req, topic, etag)
 
 
 @app.function_name("CreateModule")
@@ -235,7 +408,8 @@ def create_new_module(req: func.HttpRequest) -> func.HttpResponse:
 
     req_body = req.get_json()
     try:
-        Module.validate(req_body)
+        with stage(VALIDATION, model="Module"):
+            Module.validate(req_body)
     except ValueError as e:
         return func.HttpResponse(f"Bad Request: {str(e)}", status_code=400)
     else:
@@ -245,41 +419,27 @@ def create_new_module(req: func.HttpRequest) -> func.HttpResponse:
                 "RowKey": keyify(req_body['title'])
             }
         )
-        table_client = tbl_service.get_table_client("Modules")
-        result = table_client.create_entity(entity=req_body)['content']
+        table_client = get_table_client("Modules")
+        with stage(TABLE_IO, table="Modules", operation="create_entity"):
+            result = table_client.create_entity(entity=req_body)['content']
+        get_entity_cache().invalidate("Modules", 'default', req_body["RowKey"])
         return func.HttpResponse(json.dumps(result), status_code=200)
 
 
 @app.function_name("UpdateModule")
-@app.route(route="modules/{moduleKey}/change", methods=[func.HttpMethod.PUT], auth_level=func.AuthLevel.ANONYMOUS)
+@app.route(route="modules/{moduleKey}/change", methods=[func.HttpMethod.PUT, func.HttpMethod.PATCH],
+           auth_level=func.AuthLevel.ANONYMOUS)
 def update_module(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
     row_key = req.route_params.get('moduleKey')
-    table_client = tbl_service.get_table_client("Modules")
-    # Check if the module exists
-    module = table_client.get_entity('default', row_key)
-    if not module:
-        return func.HttpResponse("Not Found", status_code=404)
-    # Log existing module
-    logging.info(f"Existing module: {module}")
     req_body = req.get_json()
     try:
-        Module.validate(req_body)
+        with stage(VALIDATION, model="Module"):
+            Module.validate(req_body, partial=req.method == "PATCH")
     except ValueError as e:
         return func.HttpResponse(f"Bad Request: {str(e)}", status_code=400)
     else:
-        req_body.update(
-            {
-                "PartitionKey": 'default',
-                "RowKey": row_key
-            }
-        )
-        try:
-            result = table_client.update_entity(entity=req_body)
-        except Exception as e:
-            return func.HttpResponse(f"Internal Server Error: {str(e)}", status_code=500)
-        else:
-            return func.HttpResponse(json.dumps(result, cls=CustomJSONEncoder), status_code=200)
+        return apply_update(req, "Modules", 'default', row_key, req_body)
 
 
 @app.function_name("DeleteModule")
@@ -288,14 +448,87 @@ def delete_module(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
     row_key = req.route_params.get('moduleKey')
-    table_client = tbl_service.get_table_client("Modules")
-    # Check if the module exists
-    module = table_client.get_entity('default', row_key)
-    if not module:
+    return apply_delete(req, "Modules", 'default', row_key)
+
+
+@app.function_name("GetModuleBundle")
+@app.route(route="modules/{moduleKey}/bundle", methods=[func.HttpMethod.GET], auth_level=func.AuthLevel.ANONYMOUS)
+def get_module_bundle(req: func.HttpRequest) -> func.HttpResponse:
+    # The module, its topics and their card aggregates in one response, instead of a GetCards call per topic
+    logging.info('Python HTTP trigger function processed a request.')
+    row_key = req.route_params.get('moduleKey')
+    try:
+        module, module_etag = get_entity_cache().get_entity(get_table_client("Modules"), 'default', row_key)
+    except ResourceNotFoundError:
         return func.HttpResponse("Not Found", status_code=404)
+    topics, topics_etag = get_entity_cache().list_partition(get_table_client("Topics"), row_key)
+    stats = current_topic_stats(get_table_client("Cards"), get_stats_table(), [topic["RowKey"] for topic in topics])
+    topics = [dict(topic, stats=topic_aggregate(stats[topic["RowKey"]])) for topic in topics]
+    aggregates = [topic["stats"] for topic in topics]
+    digest = hashlib.sha1(f"{module_etag}/{topics_etag}/".encode('utf-8'))
+    digest.update(json.dumps(aggregates, sort_keys=True).encode('utf-8'))
+    payload = {"module": module, "stats": module_aggregate(aggregates), "topics": topics}
+    return conditional_response(req, payload, f'"{digest.hexdigest()}"', compact=True)
+
+
+@app.function_name("ExportDeck")
+@app.route(route="decks/{scope}/{key}", methods=[func.HttpMethod.GET], auth_level=func.AuthLevel.ANONYMOUS)
+def export_deck(req: func.HttpRequest) -> func.HttpResponse:
+    # Redirects to an offline deck of the cards of a topic or module; with since, to a delta of the cards
+    # written after it. A deck is built once per version of its topics' stats and then served from storage.
+    logging.info('Python HTTP trigger function processed a request.')
+    scope = req.route_params.get('scope')
+    key = req.route_params.get('key')
+    fmt = req.params.get('format', 'jsonl')
     try:
-        table_client.delete_entity('default', row_key)
-    except Exception as e:
-        return func.HttpResponse(f"Internal Server Error: {str(e)}", status_code=500)
+        if scope not in DECK_SCOPES:
+            raise ValueError(f"scope must be one of {', '.join(DECK_SCOPES)}")
+        if fmt not in DECK_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(DECK_FORMATS)}")
+        since = quantize_since(parse_since(req.params.get('since')))
+    except ValueError as e:
+        return func.HttpResponse(f"Bad Request: {str(e)}", status_code=400)
+    if scope == "module":
+        try:
+            get_entity_cache().get_entity(get_table_client("Modules"), 'default', key)
+        except ResourceNotFoundError:
+            return func.HttpResponse("Not Found", status_code=404)
+        topics, _ = get_entity_cache().list_partition(get_table_client("Topics"), key)
+        topic_keys = [topic["RowKey"] for topic in topics]
     else:
-        return func.HttpResponse(status_code=200)
+        topic_keys = [key]
+    cards_client = get_table_client("Cards")
+    stats = current_topic_stats(cards_client, get_stats_table(), topic_keys)
+    version = deck_version(stats, topic_keys)
+    with_ids = since is not None and has_deletions(stats, topic_keys, since)
+    url = publish_deck(get_deck_store(), cards_client, scope, key, topic_keys, version, fmt, since, with_ids)
+    return func.HttpResponse(status_code=302, headers={"Location": url, "Cache-Control": "no-cache"})
+
+
+@app.function_name("PruneDecks")
+@app.timer_trigger(arg_name="timer", schedule="0 0 3 * * *", run_on_startup=False)
+def prune_deck_store(timer: func.TimerRequest) -> None:
+    # Deck blobs accumulate with every version and delta; superseded versions are kept for DeckRetentionHours
+    logging.info('Python timer trigger function pruned the deck store.')
+    deleted = prune_decks(get_deck_store())
+    logging.info(f"Deleted {deleted} superseded deck blobs")
+
+
+@app.function_name("GetModules")
+@app.route(route="modules", methods=[func.HttpMethod.GET], auth_level=func.AuthLevel.ANONYMOUS)
+def get_modules(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    modules, etag = get_entity_cache().list_partition(get_table_client("Modules"), 'default')
+    return conditional_response(req, {'modules': modules}, etag)
+
+
+@app.function_name("GetModule")
+@app.route(route="modules/{moduleKey}", methods=[func.HttpMethod.GET], auth_level=func.AuthLevel.ANONYMOUS)
+def get_module(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+    row_key = req.route_params.get('moduleKey')
+    try:
+        module, etag = get_entity_cache().get_entity(get_table_client("Modules"), 'default', row_key)
+    except ResourceNotFoundError:
+        return func.HttpResponse("Not Found", status_code=404)
+    return conditional_response(req, module, etag)
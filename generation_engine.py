@@ -0,0 +1,334 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+import openai
+
+from cache import get_default_cache, normalize_word
+from clients import create_async_openai_client
+from prompt_engineer import count_message_tokens
+from telemetry import JSON_PARSE, OPENAI, QUEUE_WAIT, VALIDATION, get_telemetry, stage
+from vocabulary_worker import VocabularyWorker, has_definitions, parse_definitions
+from vocard.model import Card
+
+LOGGER = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+def is_retryable(error: Exception):
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and (status_code in RETRYABLE_STATUS_CODES or status_code >= 500)
+
+
+def retry_after(error: Exception):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount: float):
+        # Charge (positive) or refund (negative) the difference between the estimate and the actual usage
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, estimated_tokens: int):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+
+    def record_usage(self, estimated_tokens: int, usage):
+        if usage is not None and getattr(usage, "total_tokens", None) is not None:
+            self.tokens.adjust(usage.total_tokens - estimated_tokens)
+
+
+def split_batch_definitions(payload, words, context=None):
+    # Split a batched response into per-word definitions; returns (definitions_by_word, words_to_retry)
+    grouped = payload.get("definitions") if isinstance(payload, dict) else None
+    if not isinstance(grouped, dict):
+        return {}, list(words)
+    grouped = {normalize_word(key): value for key, value in grouped.items()}
+    result = {}
+    retry = []
+    for word in words:
+        entries = grouped.get(normalize_word(word))
+        if not isinstance(entries, list) or not entries:
+            retry.append(word)
+            continue
+        try:
+            for entry in entries:
+                if not isinstance(entry, dict):
+                    raise ValueError("definition must be an object")
+                # Generated definitions carry no topic; validate them as cards of the requested context
+                Card.validate({"topic": context or "", **entry})
+        except ValueError as e:
+            LOGGER.warning(f"Malformed definitions for word {word}: {e}")
+            retry.append(word)
+        else:
+            result[word] = entries
+    return result, retry
+
+
+class AdaptiveBatchSizer:
+    # Picks the number of words per batched completion from the observed completion tokens per word,
+    # keeping responses under the completion budget and halving the batch after a truncated response
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 40, completion_budget: int = 4096,
+                 headroom: float = 0.7):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.completion_budget = completion_budget
+        self.headroom = headroom
+        self.tokens_per_word = None
+
+    def next_size(self):
+        return self.size
+
+    def record(self, words_requested: int, words_defined: int, completion_tokens: int = None,
+               truncated: bool = False):
+        if truncated or words_defined == 0:
+            self.size = max(self.minimum, words_requested // 2)
+            return
+        if completion_tokens:
+            observed = completion_tokens / words_defined
+            self.tokens_per_word = observed if self.tokens_per_word is None else \
+                0.7 * self.tokens_per_word + 0.3 * observed
+            target = int(self.completion_budget * self.headroom / self.tokens_per_word)
+            self.size = max(self.minimum, min(self.maximum, target))
+
+
+class GenerationEngine:
+    # Asyncio engine that defines many words over one shared AsyncOpenAI client with bounded
+    # concurrency, a requests/tokens per minute limiter and exponential backoff on 429/5xx.
+    def __init__(self, client=None, cache=None, concurrency: int = None, requests_per_minute: float = None,
+                 tokens_per_minute: float = None, max_retries: int = 6, expected_completion_tokens: int = 600,
+                 max_batch_completion_tokens: int = 4096, model: str = None, variant: str = None):
+        self.client = client if client is not None else create_async_openai_client()
+        self.cache = cache if cache is not None else get_default_cache()
+        self.concurrency = concurrency or int(os.environ.get("OpenAIConcurrency", 16))
+        self.limiter = RateLimiter(
+            requests_per_minute or float(os.environ.get("OpenAIRequestsPerMinute", 3500)),
+            tokens_per_minute or float(os.environ.get("OpenAITokensPerMinute", 90000))
+        )
+        self.max_retries = max_retries
+        self.expected_completion_tokens = expected_completion_tokens
+        self.max_batch_completion_tokens = max_batch_completion_tokens
+        # Model and definition prompt variant for this run; None follows the environment settings
+        self.model = model
+        self.variant = variant
+
+    async def _complete(self, **kwargs):
+        estimated_tokens = count_message_tokens(kwargs["messages"], kwargs["model"]) + \
+            kwargs.get("max_tokens", self.expected_completion_tokens)
+        telemetry = get_telemetry()
+        operation = "get_word_definitions" if "max_tokens" in kwargs else "get_word_definition"
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            await self.limiter.acquire(estimated_tokens)
+            telemetry.record_duration(QUEUE_WAIT, time.perf_counter() - queued_at, operation=operation)
+            try:
+                with telemetry.stage(OPENAI, model=kwargs["model"], operation=operation):
+                    completion = await self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = retry_after(e) or min(60.0, 2 ** attempt) * (0.5 + random.random())
+                LOGGER.warning(f"OpenAI request failed ({e}), retrying in {delay:.1f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+            else:
+                self.limiter.record_usage(estimated_tokens, getattr(completion, "usage", None))
+                telemetry.record_usage(getattr(completion, "usage", None), model=kwargs["model"], operation=operation)
+                return completion
+
+    async def get_word_definition(self, word, context=None):
+        model = VocabularyWorker.model_for("get_word_definition", self.model)
+        prompt, messages = VocabularyWorker.definition_messages(word, context, self.variant, model)
+        cached = self.cache.get(word, context, prompt, model)
+        if has_definitions(cached):
+            return cached
+        completion = await self._complete(
+            model=model,
+            response_format=prompt.response_format(model),
+            messages=messages
+        )
+        with stage(JSON_PARSE):
+            result = parse_definitions(completion.choices[0].message.content)
+        self.cache.set(word, context, prompt, model, result)
+        return result
+
+    async def define(self, word, context=None):
+        # The definitions of word; raises for an answer without any, which the run loops record as a failed
+        # word instead of ending the run
+        result = await self.get_word_definition(word, context)
+        if not has_definitions(result):
+            raise ValueError(f"No definitions for {word}")
+        return result["definitions"]
+
+    async def get_word_definitions(self, words, context=None):
+        # One completion for several words; returns (definitions_by_word, words_to_retry, completion)
+        model = VocabularyWorker.model_for("get_word_definitions", self.model)
+        prompt, messages = VocabularyWorker.batch_definition_messages(words, context, model)
+        completion = await self._complete(
+            model=model,
+            response_format=prompt.response_format(model),
+            max_tokens=self.max_batch_completion_tokens,
+            messages=messages
+        )
+        try:
+            with stage(JSON_PARSE):
+                payload = json.loads(completion.choices[0].message.content)
+        except (TypeError, ValueError):
+            return {}, list(words), completion
+        with stage(VALIDATION, operation="get_word_definitions"):
+            result, retry = split_batch_definitions(payload, words, context)
+        for word, entries in result.items():
+            self.cache.set(word, context, prompt, model, {"definitions": entries})
+        return result, retry, completion
+
+    async def run_batched(self, words, context=None, sizer: AdaptiveBatchSizer = None, max_batch_attempts: int = 3,
+                          on_result=None):
+        # Batched counterpart of run(): words missing or malformed in a response are re-queued on their own,
+        # and fall back to single-word requests after max_batch_attempts
+        sizer = sizer or AdaptiveBatchSizer(completion_budget=self.max_batch_completion_tokens)
+        prompt, _ = VocabularyWorker.batch_definition_messages([], context)
+        model = VocabularyWorker.model_for("get_word_definitions", self.model)
+        definitions = []
+        failed = []
+        # (word, attempt) items; retries are queued before the batch they came from is marked done, so
+        # join() returns only once every word has been defined or given up on
+        pending = asyncio.Queue()
+
+        def emit(word, entries):
+            if on_result is not None:
+                on_result(word, entries)
+            else:
+                definitions.extend(entries)
+
+        for word in words:
+            cached = self.cache.get(word, context, prompt, model)
+            if has_definitions(cached):
+                emit(word, cached["definitions"])
+            else:
+                pending.put_nowait((word, 0))
+
+        async def define_single(word):
+            try:
+                entries = await self.define(word, context)
+            except Exception as e:
+                LOGGER.error(f"Failed to define word {word}: {e}")
+                failed.append(word)
+            else:
+                emit(word, entries)
+
+        async def define_batch(batch):
+            attempts = dict(batch)
+            try:
+                result, retry, completion = await self.get_word_definitions(list(attempts), context)
+            except Exception as e:
+                LOGGER.error(f"Batch of {len(batch)} words failed: {e}")
+                result, retry, completion = {}, list(attempts), None
+            usage = getattr(completion, "usage", None)
+            finish_reason = completion.choices[0].finish_reason if completion is not None else None
+            sizer.record(len(batch), len(result), getattr(usage, "completion_tokens", None),
+                         truncated=finish_reason == "length")
+            for word, entries in result.items():
+                emit(word, entries)
+            for word in retry:
+                if attempts[word] + 1 >= max_batch_attempts:
+                    await define_single(word)
+                else:
+                    pending.put_nowait((word, attempts[word] + 1))
+            LOGGER.info(f"Batch of {len(batch)} words done, {len(retry)} to retry, {pending.qsize()} pending")
+
+        async def worker():
+            while True:
+                batch = [await pending.get()]
+                while len(batch) < sizer.next_size() and not pending.empty():
+                    batch.append(pending.get_nowait())
+                try:
+                    await define_batch(batch)
+                finally:
+                    for _ in batch:
+                        pending.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        joined = asyncio.create_task(pending.join())
+        try:
+            # Workers only return by raising, e.g. from on_result; that error ends the run
+            await asyncio.wait([joined, *workers], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in [joined, *workers]:
+                task.cancel()
+            results = await asyncio.gather(joined, *workers, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception) and not isinstance(r, asyncio.CancelledError)]
+        if errors:
+            raise errors[0]
+        definitions.sort(key=lambda x: x["word"])
+        return definitions, failed
+
+    async def run(self, words, context=None, on_result=None):
+        # Returns (definitions, failed_words); definitions are sorted by word once, at the end.
+        # With on_result(word, definitions) every result is handed over as soon as it is ready instead,
+        # and nothing is accumulated, so words may be any (lazy) iterable.
+        definitions = []
+        failed = []
+        iterator = iter(words)
+        done = 0
+
+        async def worker():
+            nonlocal done
+            for word in iterator:
+                try:
+                    entries = await self.define(word, context)
+                except Exception as e:
+                    LOGGER.error(f"Failed to define word {word}: {e}")
+                    failed.append(word)
+                else:
+                    if on_result is not None:
+                        on_result(word, entries)
+                    else:
+                        definitions.extend(entries)
+                done += 1
+                LOGGER.info(f"Defined {done} words ({word})")
+
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+        definitions.sort(key=lambda x: x["word"])
+        return definitions, failed
@@ -0,0 +1,84 @@
+import itertools
+import json
+from types import SimpleNamespace
+
+
+def default_responder(body):
+    # Defines the requested word with a single placeholder sense
+    word = body["messages"][-1]["content"].replace("Word: ", "").split(", Context: ")[0]
+    return {"definitions": [{"word": word, "partOfSpeech": "n.", "definition": f"Definition of {word}."}]}
+
+
+class LocalFiles:
+    def __init__(self):
+        self._files = {}
+        self._ids = itertools.count(1)
+
+    def create(self, file, purpose):
+        content = file.read()
+        file_id = f"file-{next(self._ids)}"
+        self._files[file_id] = content.decode('utf-8') if isinstance(content, bytes) else content
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    def put(self, text):
+        file_id = f"file-{next(self._ids)}"
+        self._files[file_id] = text
+        return file_id
+
+    def content(self, file_id):
+        return SimpleNamespace(text=self._files[file_id])
+
+
+class LocalBatches:
+    # Batches complete on the n-th retrieve() so that polling loops are exercised
+    def __init__(self, files, responder, polls_until_complete):
+        self._files = files
+        self._responder = responder
+        self._polls_until_complete = polls_until_complete
+        self._batches = {}
+        self._ids = itertools.count(1)
+
+    def create(self, input_file_id, endpoint, completion_window, metadata=None):
+        batch = SimpleNamespace(
+            id=f"batch-{next(self._ids)}", status="validating", input_file_id=input_file_id, endpoint=endpoint,
+            completion_window=completion_window, metadata=metadata, output_file_id=None, error_file_id=None,
+            request_counts=SimpleNamespace(total=0, completed=0, failed=0), polls=0
+        )
+        self._batches[batch.id] = batch
+        return batch
+
+    def retrieve(self, batch_id):
+        batch = self._batches[batch_id]
+        batch.polls += 1
+        if batch.status != "completed" and batch.polls >= self._polls_until_complete:
+            self._run(batch)
+        elif batch.status == "validating":
+            batch.status = "in_progress"
+        return batch
+
+    def _run(self, batch):
+        outputs, errors = [], []
+        for line in self._files.content(batch.input_file_id).text.splitlines():
+            request = json.loads(line)
+            try:
+                content = json.dumps(self._responder(request["body"]), ensure_ascii=False)
+            except Exception as e:
+                errors.append({"custom_id": request["custom_id"], "response": None,
+                               "error": {"code": "server_error", "message": str(e)}})
+                continue
+            outputs.append({"custom_id": request["custom_id"], "response": {"status_code": 200, "body": {
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]
+            }}, "error": None})
+        batch.output_file_id = self._files.put("\n".join(json.dumps(o, ensure_ascii=False) for o in outputs))
+        if errors:
+            batch.error_file_id = self._files.put("\n".join(json.dumps(e, ensure_ascii=False) for e in errors))
+        batch.request_counts = SimpleNamespace(total=len(outputs) + len(errors), completed=len(outputs),
+                                               failed=len(errors))
+        batch.status = "completed"
+
+
+class LocalBatchClient:
+    # In-memory stand-in for the files and batches endpoints used by batch_job
+    def __init__(self, responder=default_responder, polls_until_complete: int = 2):
+        self.files = LocalFiles()
+        self.batches = LocalBatches(self.files, responder, polls_until_complete)
@@ -0,0 +1,15 @@
+# Helpers for calling the app's Azure Functions handlers directly in tests
+
+
+def handler(function_builder):
+    # The user function behind a decorated handler (function_app.create_new_card etc.)
+    return function_builder._function.get_user_function()
+
+
+class Out:
+    # Stand-in for func.Out bindings (queue outputs); keeps the last value that was set
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
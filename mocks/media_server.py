@@ -0,0 +1,104 @@
+import datetime
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockMediaServer:
+    # Local HTTP stand-in for the dictionary site serving pronunciation audio. files maps a path to
+    # (content_type, data); other paths answer 404, and paths in failures answer 503 that many times first.
+    def __init__(self, files=None, failures=None, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.files = dict(files or {})
+        self.failures = Counter(failures or {})
+        self.latency = latency
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def respond(self, path):
+        # Returns (status_code, content_type, data)
+        with self._lock:
+            self.requests[path] += 1
+            if self.failures[path] > 0:
+                self.failures[path] -= 1
+                return 503, "text/plain", b"Service Unavailable"
+        time.sleep(self.latency)
+        if path not in self.files:
+            return 404, "text/html", b"<html>Not Found</html>"
+        content_type, data = self.files[path]
+        return 200, content_type, data
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status_code, content_type, data = server.respond(self.path)
+                self.send_response(status_code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class InMemoryMediaStore:
+    # Media store kept in a dict, with the interface of vocard.media.BlobMediaStore
+    def __init__(self, base_url: str = "https://cdn.example.com/media"):
+        self.base_url = base_url
+        self.blobs = {}
+        self.modified = {}
+        self.puts = 0
+
+    def exists(self, name):
+        return name in self.blobs
+
+    def put(self, name, data, content_type):
+        self.puts += 1
+        self.blobs[name] = (content_type, data)
+        self.modified[name] = datetime.datetime.now(datetime.timezone.utc)
+
+    def url(self, name):
+        return f"{self.base_url}/{name}"
+
+    def owns(self, url):
+        return url.startswith(self.base_url)
+
+    def list(self):
+        return list(self.modified.items())
+
+    def delete(self, name):
+        self.blobs.pop(name, None)
+        self.modified.pop(name, None)
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def count_tokens(text):
+    # Same rough accounting as the generation engine's estimate: one token per four characters
+    return len(text) // 4 + 1
+
+
+def define(word):
+    return [
+        {"word": word, "partOfSpeech": "n.", "definition": f"The first sense of the word {word}.",
+         "ipaUk": f"/{word}/", "ipaUs": f"/{word}/", "pronUk": f"https://example.com/uk/{word}.mp3",
+         "pronUs": f"https://example.com/us/{word}.mp3", "meaningVi": word,
+         "exampleSentence": f"This sentence uses {word} as a noun."},
+        {"word": word, "partOfSpeech": "v.", "definition": f"The second sense of the word {word}.",
+         "ipaUk": f"/{word}/", "ipaUs": f"/{word}/", "pronUk": f"https://example.com/uk/{word}.mp3",
+         "pronUs": f"https://example.com/us/{word}.mp3", "meaningVi": word,
+         "exampleSentence": f"They {word} every day."},
+    ]
+
+
+def chat_responder(body):
+    # Answers the single-word, batched and vocabulary list prompts with well-formed placeholder content
+    content = body["messages"][-1]["content"]
+    if content.startswith("Words: "):
+        words, _ = json.JSONDecoder().raw_decode(content[len("Words: "):])
+        return {"definitions": {word: define(word) for word in words}}
+    if content.startswith("Theme: "):
+        theme = content[len("Theme: "):].strip().lower().replace(" ", "")
+        return {"vocabularies": [f"{theme}{i}" for i in range(20)]}
+    return {"definitions": define(content.replace("Word: ", "").split(", Context: ")[0])}
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.throttled = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.latencies = []
+
+    def record(self, latency, prompt_tokens=0, completion_tokens=0, throttled=False):
+        with self._lock:
+            self.requests += 1
+            self.throttled += throttled
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.latencies.append(latency)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "promptTokens": self.prompt_tokens,
+                "completionTokens": self.completion_tokens,
+            }
+
+
+class MockOpenAIServer:
+    # Local HTTP stand-in for POST /v1/chat/completions, so the real openai clients (connection pool,
+    # retries, response parsing) are part of what is measured. Point them at it with OPENAI_BASE_URL.
+    # Latency, jitter and injected 429s are drawn from a generator seeded by the request content and how
+    # often that request was seen, so a run is reproducible regardless of thread scheduling.
+    def __init__(self, responder=chat_responder, latency: float = 0.05, jitter: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: float = 0.05, seed: int = 0, host: str = "127.0.0.1",
+                 port: int = 0):
+        self.responder = responder
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.stats = MockStats()
+        self._attempts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _random(self, body):
+        key = hashlib.sha256(json.dumps(body["messages"], sort_keys=True).encode('utf-8')).hexdigest()
+        with self._lock:
+            attempt = self._attempts[key]
+            self._attempts[key] += 1
+        return random.Random(f"{self.seed}:{key}:{attempt}")
+
+    def complete(self, body):
+        # Returns (status_code, headers, payload) after sleeping for the simulated service time
+        start = time.perf_counter()
+        rng = self._random(body)
+        time.sleep(max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter)))
+        if rng.random() < self.throttle_rate:
+            self.stats.record(time.perf_counter() - start, throttled=True)
+            return 429, {"retry-after": str(self.retry_after)}, {"error": {
+                "message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+        content = json.dumps(self.responder(body), ensure_ascii=False)
+        prompt_tokens = sum(count_tokens(m["content"]) for m in body["messages"])
+        completion_tokens = count_tokens(content)
+        self.stats.record(time.perf_counter() - start, prompt_tokens, completion_tokens)
+        return 200, {}, {
+            "id": f"chatcmpl-{self.stats.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {}, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                status_code, headers, payload = server.complete(body)
+                if status_code == 200 and body.get("stream"):
+                    self._send_stream(payload)
+                else:
+                    self._send(status_code, headers, payload)
+
+            def _send(self, status_code, headers, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, payload):
+                # Server-sent events with the content split into small deltas, as chat completions stream
+                content = payload["choices"][0]["message"]["content"]
+                events = []
+                for i in range(0, len(content), 16):
+                    events.append({"id": payload["id"], "object": "chat.completion.chunk",
+                                   "created": payload["created"], "model": payload["model"],
+                                   "choices": [{"index": 0, "delta": {"content": content[i:i + 16]},
+                                                "finish_reason": None}]})
+                data = "".join(f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in events)
+                data = (data + "data: [DONE]\n\n").encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,189 @@
+import datetime
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import TableEntity, TableTransactionError, UpdateMode
+
+FILTER_CLAUSE = re.compile(r"^\s*(\w+)\s+(eq|ne|gt|ge|lt|le)\s+(@\w+|'(?:[^']|'')*')\s*$")
+OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "ne": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "ge": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "le": lambda a, b: a is not None and a <= b,
+}
+
+
+def _parse_filter(query_filter, parameters):
+    # Only the "<Field> <comparison> @param [and ...]" filters used by this app are supported
+    conditions = []
+    if not query_filter:
+        return conditions
+    for clause in re.split(r"\s+and\s+", query_filter):
+        match = FILTER_CLAUSE.match(clause)
+        if match is None:
+            raise ValueError(f"Unsupported filter: {query_filter}")
+        name, operator, value = match.groups()
+        value = parameters[value[1:]] if value.startswith("@") else value[1:-1].replace("''", "'")
+        conditions.append((name, OPERATORS[operator], value))
+    return conditions
+
+
+class Pages:
+    # Mirrors ItemPaged.by_page(): iterates pages and exposes the continuation token of the last page read
+    def __init__(self, entities, results_per_page, continuation_token):
+        self._entities = entities
+        self._results_per_page = results_per_page or 1000
+        self._start = 0
+        if continuation_token:
+            position = (continuation_token["PartitionKey"], continuation_token["RowKey"])
+            self._start = next((i for i, e in enumerate(entities)
+                                if (e["PartitionKey"], e["RowKey"]) >= position), len(entities))
+        self.continuation_token = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._start >= len(self._entities):
+            raise StopIteration
+        end = self._start + self._results_per_page
+        page = self._entities[self._start:end]
+        self.continuation_token = None
+        if end < len(self._entities):
+            self.continuation_token = {"PartitionKey": self._entities[end]["PartitionKey"],
+                                       "RowKey": self._entities[end]["RowKey"]}
+        self._start = end
+        return iter(page)
+
+
+class ItemPaged:
+    def __init__(self, entities, results_per_page):
+        self._entities = entities
+        self._results_per_page = results_per_page
+
+    def __iter__(self):
+        return iter(self._entities)
+
+    def by_page(self, continuation_token=None):
+        return Pages(self._entities, self._results_per_page, continuation_token)
+
+
+class InMemoryTableClient:
+    # Thread-safe in-memory stand-in for azure.data.tables.TableClient, for offline tests and benchmarks.
+    # Follows the service's ordering (PartitionKey, RowKey), ETag/If-Match semantics and all-or-nothing
+    # transactions; latency (seconds) is added to every call to approximate a remote table.
+    def __init__(self, table_name: str = "Cards", latency: float = 0.0):
+        self.table_name = table_name
+        self.latency = latency
+        self.calls = 0
+        self._entities = {}
+        self._version = 0
+        self._lock = threading.RLock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _entity(self, key, select=None):
+        data, etag, timestamp = self._entities[key]
+        entity = TableEntity({k: v for k, v in data.items() if select is None or k in select})
+        entity._metadata = {"etag": etag, "timestamp": timestamp}
+        return entity
+
+    def _put(self, entity):
+        self._version += 1
+        etag = f'W/"datetime\'{self._version}\'"'
+        timestamp = datetime.datetime.now(datetime.timezone.utc)
+        data = {k: v for k, v in entity.items() if k != "Timestamp"}
+        data["Timestamp"] = timestamp
+        self._entities[(entity["PartitionKey"], entity["RowKey"])] = (data, etag, timestamp)
+        return {"etag": etag, "date": timestamp}
+
+    def _check(self, key, etag, match_condition):
+        if key not in self._entities:
+            raise ResourceNotFoundError("Not Found")
+        if match_condition == MatchConditions.IfNotModified and self._entities[key][1] != etag:
+            raise ResourceModifiedError("Precondition Failed")
+
+    def create_entity(self, entity, **kwargs):
+        self._call()
+        with self._lock:
+            if (entity["PartitionKey"], entity["RowKey"]) in self._entities:
+                raise ResourceExistsError("The specified entity already exists.")
+            return self._put(entity)
+
+    def upsert_entity(self, entity, mode=UpdateMode.MERGE, **kwargs):
+        self._call()
+        with self._lock:
+            key = (entity["PartitionKey"], entity["RowKey"])
+            if mode == UpdateMode.MERGE and key in self._entities:
+                entity = dict(self._entities[key][0], **entity)
+            return self._put(entity)
+
+    def update_entity(self, entity, mode=UpdateMode.MERGE, etag=None, match_condition=None, **kwargs):
+        self._call()
+        with self._lock:
+            key = (entity["PartitionKey"], entity["RowKey"])
+            self._check(key, etag, match_condition)
+            if mode == UpdateMode.MERGE:
+                entity = dict(self._entities[key][0], **entity)
+            return self._put(entity)
+
+    def delete_entity(self, partition_key, row_key, etag=None, match_condition=None, raw_response_hook=None,
+                      **kwargs):
+        # Like the SDK, a missing entity is not an error; the 404 is only visible to raw_response_hook
+        self._call()
+        with self._lock:
+            try:
+                self._check((partition_key, row_key), etag, match_condition)
+            except ResourceNotFoundError:
+                status_code = 404
+            else:
+                del self._entities[(partition_key, row_key)]
+                status_code = 204
+        if raw_response_hook is not None:
+            raw_response_hook(SimpleNamespace(http_response=SimpleNamespace(status_code=status_code)))
+
+    def get_entity(self, partition_key, row_key, select=None, **kwargs):
+        self._call()
+        with self._lock:
+            if (partition_key, row_key) not in self._entities:
+                raise ResourceNotFoundError("Not Found")
+            return self._entity((partition_key, row_key), select)
+
+    def query_entities(self, query_filter, parameters=None, results_per_page=None, select=None, **kwargs):
+        self._call()
+        conditions = _parse_filter(query_filter, parameters or {})
+        with self._lock:
+            entities = [self._entity(key, select) for key in sorted(self._entities)
+                        if all(compare(self._entities[key][0].get(name), value)
+                               for name, compare, value in conditions)]
+        return ItemPaged(entities, results_per_page)
+
+    def list_entities(self, results_per_page=None, select=None, **kwargs):
+        return self.query_entities(None, results_per_page=results_per_page, select=select)
+
+    def submit_transaction(self, operations, **kwargs):
+        self._call()
+        with self._lock:
+            if len(operations) > 100 or len({entity["PartitionKey"] for _, entity in operations}) > 1:
+                raise TableTransactionError(message="0:The batch request operation exceeds the maximum limit.")
+            keys = set()
+            for index, (operation, entity) in enumerate(operations):
+                key = (entity["PartitionKey"], entity["RowKey"])
+                if operation == "create" and (key in self._entities or key in keys):
+                    raise TableTransactionError(message=f"{index}:The specified entity already exists.")
+                keys.add(key)
+            return [dict(self._put(entity)) for _, entity in operations]
+
+    def __len__(self):
+        return len(self._entities)
+
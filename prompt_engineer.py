@@ -1,7 +1,74 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from telemetry import PROMPT_LOAD, stage
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+# Tokens added by the chat format around each message and before the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _encoding(model):
+    # tiktoken is optional; without it token counts are estimated
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                import tiktoken
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encodings[model] = tiktoken.get_encoding("cl100k_base")
+            except ImportError:
+                _encodings[model] = None
+        return _encodings[model]
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo"):
+    encoding = _encoding(model)
+    if encoding is None:
+        # Same rough estimate as the generation engine: one token per four characters
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages, model: str = "gpt-3.5-turbo"):
+    return sum(count_tokens(m["content"], model) + TOKENS_PER_MESSAGE for m in messages) + TOKENS_PER_REPLY
+
+
+# Models that accept a json_schema response format (structured outputs); gpt-4o-2024-05-13 predates them
+STRUCTURED_OUTPUT_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+STRUCTURED_OUTPUT_EXCLUDED = {"gpt-4o-2024-05-13"}
+
+
+def supports_structured_outputs(model: str):
+    model = (model or "").lower()
+    if model.startswith("ft:"):
+        model = model[len("ft:"):].split(":")[0]
+    return model.startswith(STRUCTURED_OUTPUT_PREFIXES) and model not in STRUCTURED_OUTPUT_EXCLUDED
+
+
 class Prompt:
-    def __init__(self, name: str):
+    # A template, optionally with the JSON schema its answers must follow (prompts/<name>.schema.json).
+    # The hash covers both, so cached answers are keyed by the exact instructions the model was given.
+    def __init__(self, name: str, content: str = None, schema: dict = None):
         self._name = name
-        self._content = Prompt._load_content(name)
+        if content is None:
+            template = get_prompt(name)
+            self._content = template.content()
+            self._schema = template.schema()
+            self._hash = template.hash()
+        else:
+            self._content = content
+            self._schema = schema
+            hashed = content if schema is None else content + json.dumps(schema, sort_keys=True)
+            self._hash = hashlib.sha256(hashed.encode('utf-8')).hexdigest()
 
     def content(self):
         return self._content
@@ -9,9 +76,116 @@ class Prompt:
     def name(self):
         return self._name
 
-    @staticmethod
-    def _load_content(name: str):
-        content = ""
-        with open(f"prompts/{name.lower()}.txt", encoding='utf-8') as f:
+    def hash(self):
+        return self._hash
+
+    def schema(self):
+        return self._schema
+
+    def _structured(self, model):
+        return self._schema is not None and (model is None or supports_structured_outputs(model))
+
+    def response_format(self, model: str = None):
+        # With a schema the answer is constrained by structured outputs, so the template needs no example.
+        # Models without structured outputs get JSON mode and the schema in the instructions instead.
+        if not self._structured(model):
+            return {"type": "json_object"}
+        return {"type": "json_schema", "json_schema": {"name": self._name, "strict": True, "schema": self._schema}}
+
+    def instructions(self, model: str = None):
+        # The system message for model: the template, followed by the schema when model cannot take it as
+        # the response format
+        if self._schema is None or self._structured(model):
+            return self._content
+        return f"{self._content}\n\nAnswer with a JSON object that follows this JSON schema:\n" + \
+            json.dumps(self._schema, separators=(",", ":"))
+
+    def format_tokens(self, model: str = "gpt-3.5-turbo"):
+        # Tokens of the schema sent as the response format, which are billed as prompt tokens
+        if not self._structured(model):
+            return 0
+        return count_tokens(json.dumps(self._schema, separators=(",", ":")), model)
+
+    def tokens(self, model: str = "gpt-3.5-turbo"):
+        # Prompt tokens the template costs with model, including its schema however that is sent
+        return count_tokens(self.instructions(model), model) + self.format_tokens(model)
+
+
+class PromptRegistry:
+    # Loads every prompts/<name>.txt template once and serves them from memory. Template files are checked
+    # for changes (by mtime) at most once per reload_interval seconds, and changed files are reloaded.
+    def __init__(self, directory: str = PROMPTS_DIR, reload_interval: float = 2.0):
+        self._directory = directory
+        self._reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._prompts = {}
+        self._mtimes = {}
+        self._checked_at = time.monotonic()
+        for filename in os.listdir(directory):
+            if filename.endswith(".txt"):
+                self._load(filename[:-len(".txt")])
+
+    def _path(self, name: str, extension: str = ".txt"):
+        return os.path.join(self._directory, f"{name.lower()}{extension}")
+
+    def _mtime(self, name: str):
+        schema_path = self._path(name, ".schema.json")
+        return os.stat(self._path(name)).st_mtime_ns, \
+            os.stat(schema_path).st_mtime_ns if os.path.exists(schema_path) else None
+
+    def _load(self, name: str):
+        mtime = self._mtime(name)
+        with open(self._path(name), encoding='utf-8') as f:
             content = f.read()
-        return content
+        schema = None
+        if mtime[1] is not None:
+            with open(self._path(name, ".schema.json"), encoding='utf-8') as f:
+                schema = json.load(f)
+        self._prompts[name.lower()] = Prompt(name.lower(), content, schema)
+        self._mtimes[name.lower()] = mtime
+
+    def _reload_changed(self):
+        now = time.monotonic()
+        if now - self._checked_at < self._reload_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            for name, mtime in list(self._mtimes.items()):
+                try:
+                    if self._mtime(name) != mtime:
+                        self._load(name)
+                except FileNotFoundError:
+                    del self._prompts[name]
+                    del self._mtimes[name]
+
+    def get(self, name: str):
+        self._reload_changed()
+        prompt = self._prompts.get(name.lower())
+        if prompt is None:
+            # Templates added after start-up are picked up on first use
+            with self._lock:
+                self._load(name)
+            prompt = self._prompts[name.lower()]
+        return prompt
+
+    def hashes(self):
+        self._reload_changed()
+        return {name: prompt.hash() for name, prompt in self._prompts.items()}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PromptRegistry()
+    return _registry
+
+
+def get_prompt(name: str):
+    with stage(PROMPT_LOAD, prompt=name):
+        return get_registry().get(name)
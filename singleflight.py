@@ -0,0 +1,170 @@
+import logging
+import os
+import threading
+import time
+import uuid
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Coalesces concurrent calls with the same key: the first caller runs the function, callers arriving
+    # while it is in flight wait for it and get the same result (or exception) instead of running it again.
+    # Nothing is remembered once the call finishes; caching results is the caller's job.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        # Returns (result, shared); shared is True when the result came from another caller's call
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class TableLease:
+    # Cross-instance counterpart of SingleFlight: one row per key in a Table, held by whoever created it
+    # (or took it over after it expired). Instances that do not get the lease poll for the holder's result,
+    # for at most max_wait seconds before running the function themselves.
+    def __init__(self, table_client, duration: float = 60.0, owner: str = None, max_wait: float = 30.0):
+        self.table_client = table_client
+        self.duration = duration
+        self.max_wait = max_wait
+        self.owner = owner or os.environ.get("WEBSITE_INSTANCE_ID") or uuid.uuid4().hex
+        self._etags = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keys(key):
+        return key[:2], key
+
+    def acquire(self, key):
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+        from azure.data.tables import UpdateMode
+        partition_key, row_key = TableLease._keys(key)
+        now = time.time()
+        entity = {"PartitionKey": partition_key, "RowKey": row_key, "owner": self.owner,
+                  "expiresAt": now + self.duration}
+        try:
+            result = self.table_client.create_entity(entity=entity)
+        except ResourceExistsError:
+            try:
+                current = self.table_client.get_entity(partition_key, row_key)
+            except ResourceNotFoundError:
+                # Released in the meantime; the next attempt can create it
+                return False
+            if current.get("expiresAt", 0) > now:
+                return False
+            try:
+                result = self.table_client.update_entity(entity=entity, mode=UpdateMode.REPLACE,
+                                                         etag=current.metadata["etag"],
+                                                         match_condition=MatchConditions.IfNotModified)
+            except (ResourceModifiedError, ResourceNotFoundError):
+                return False
+            LOGGER.info(f"Took over expired lease {key} from {current.get('owner')}")
+        with self._lock:
+            self._etags[key] = result.get("etag")
+        return True
+
+    def release(self, key):
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceModifiedError
+        with self._lock:
+            etag = self._etags.pop(key, None)
+        partition_key, row_key = TableLease._keys(key)
+        try:
+            # Only delete the row we wrote; after an expiry another instance may hold it now
+            self.table_client.delete_entity(partition_key, row_key, etag=etag,
+                                            match_condition=MatchConditions.IfNotModified)
+        except ResourceModifiedError:
+            pass
+        except Exception as e:
+            LOGGER.warning(f"Failed to release lease {key}: {e}")
+
+    def run(self, key, fn, lookup, poll_interval: float = 0.5):
+        # Runs fn under the lease, or returns lookup()'s result once the lease holder has produced it.
+        # lookup() returns None until the result is available (typically a read of a shared cache).
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            if self.acquire(key):
+                try:
+                    result = lookup()
+                    return result if result is not None else fn()
+                finally:
+                    self.release(key)
+            result = lookup()
+            if result is not None:
+                return result
+            if time.monotonic() >= deadline:
+                # A holder that is slow or gone must not stall the request beyond max_wait
+                LOGGER.warning(f"No result for lease {key} after {self.max_wait}s, running without the lease")
+                return fn()
+            time.sleep(poll_interval)
+
+
+# Definition cache backends that every instance reads, see cache.get_default_cache
+SHARED_CACHE_BACKENDS = {"table"}
+_definition_lease = None
+_definition_lease_lock = threading.Lock()
+_unshared_warned = False
+
+
+def get_definition_lease():
+    # Cross-instance lease for definition generation, enabled by setting DefinitionLeaseTable (duration in
+    # DefinitionLeaseDuration seconds, waiters give up after DefinitionLeaseMaxWait seconds). Waiting
+    # instances find the holder's result in the definition cache, so without a shared cache backend the
+    # lease would only make them wait for nothing and it stays disabled.
+    global _definition_lease, _unshared_warned
+    table_name = os.environ.get("DefinitionLeaseTable")
+    if not table_name:
+        return None
+    backend = os.environ.get("DefinitionCacheBackend", "sqlite").lower()
+    if backend not in SHARED_CACHE_BACKENDS:
+        if not _unshared_warned:
+            LOGGER.warning(f"DefinitionLeaseTable is ignored: DefinitionCacheBackend {backend} is not shared "
+                           f"between instances")
+            _unshared_warned = True
+        return None
+    if _definition_lease is None:
+        with _definition_lease_lock:
+            if _definition_lease is None:
+                from clients import get_table_client, get_table_service
+                get_table_service().create_table_if_not_exists(table_name)
+                _definition_lease = TableLease(get_table_client(table_name),
+                                               duration=float(os.environ.get("DefinitionLeaseDuration", 60)),
+                                               max_wait=float(os.environ.get("DefinitionLeaseMaxWait", 30)))
+    return _definition_lease
@@ -0,0 +1,181 @@
+import logging
+import os
+import random
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# Stages recorded by the worker and the HTTP handlers
+PROMPT_LOAD = "prompt_load"
+QUEUE_WAIT = "queue_wait"
+OPENAI = "openai"
+JSON_PARSE = "json_parse"
+VALIDATION = "validation"
+TABLE_IO = "table_io"
+SERIALIZATION = "serialization"
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP_TIMER = _NoopTimer()
+
+
+class _Timer:
+    __slots__ = ("_telemetry", "_name", "_attributes", "_start")
+
+    def __init__(self, telemetry, name, attributes):
+        self._telemetry = telemetry
+        self._name = name
+        self._attributes = attributes
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        attributes = self._attributes
+        if exc_type is not None:
+            attributes = dict(attributes, error=exc_type.__name__)
+        self._telemetry.record_duration(self._name, time.perf_counter() - self._start, sampled=True, **attributes)
+        return False
+
+
+def _configure_meter_provider():
+    # opentelemetry-api alone hands out a no-op meter. Unless the host already set an SDK MeterProvider,
+    # export to Application Insights with the Azure Monitor distro (azure-monitor-opentelemetry, which also
+    # needs APPLICATIONINSIGHTS_CONNECTION_STRING); raises RuntimeError when metrics would go nowhere
+    from opentelemetry import metrics
+    try:
+        from opentelemetry.sdk.metrics import MeterProvider
+    except ImportError:
+        MeterProvider = None
+    if MeterProvider is not None and isinstance(metrics.get_meter_provider(), MeterProvider):
+        return
+    if not os.environ.get("APPLICATIONINSIGHTS_CONNECTION_STRING"):
+        raise RuntimeError("no MeterProvider is configured and APPLICATIONINSIGHTS_CONNECTION_STRING is not set")
+    try:
+        from azure.monitor.opentelemetry import configure_azure_monitor
+    except ImportError:
+        raise RuntimeError("no MeterProvider is configured and azure-monitor-opentelemetry is not installed")
+    configure_azure_monitor()
+
+
+class OpenTelemetryRecorder:
+    # Stage durations go to the vocard.stage.duration histogram (ms, "stage" attribute) and token usage to
+    # the vocard.openai.tokens counter ("kind" is prompt or completion)
+    def __init__(self):
+        from opentelemetry import metrics
+        _configure_meter_provider()
+        meter = metrics.get_meter("vocard")
+        self.durations = meter.create_histogram(
+            "vocard.stage.duration", unit="ms", description="Time spent in each stage of a request")
+        self.tokens = meter.create_counter(
+            "vocard.openai.tokens", unit="{token}", description="Tokens used by OpenAI completions")
+
+    def duration(self, stage, milliseconds, attributes):
+        self.durations.record(milliseconds, dict(attributes, stage=stage))
+
+    def token_usage(self, kind, amount, attributes):
+        self.tokens.add(amount, dict(attributes, kind=kind))
+
+
+class LogRecorder:
+    # Fallback for local runs: one debug line per measurement
+    def duration(self, stage, milliseconds, attributes):
+        LOGGER.debug(f"stage={stage} ms={milliseconds:.3f} {attributes}")
+
+    def token_usage(self, kind, amount, attributes):
+        LOGGER.debug(f"tokens={kind} count={amount} {attributes}")
+
+
+class Telemetry:
+    # Times the stages of a request and records OpenAI token usage. With no recorder everything is a no-op;
+    # sample_rate is the fraction of stage timings that are recorded (token counts are always recorded,
+    # so totals stay exact).
+    def __init__(self, recorder=None, sample_rate: float = 1.0):
+        self.recorder = recorder
+        self.sample_rate = sample_rate
+
+    @property
+    def enabled(self):
+        return self.recorder is not None
+
+    def _sampled(self):
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def stage(self, name, **attributes):
+        # Context manager timing the enclosed block as one occurrence of the stage
+        if self.recorder is None or not self._sampled():
+            return NOOP_TIMER
+        return _Timer(self, name, attributes)
+
+    def record_duration(self, name, seconds, sampled: bool = False, **attributes):
+        # For durations measured elsewhere, such as time spent waiting in a queue
+        if self.recorder is None or not (sampled or self._sampled()):
+            return
+        try:
+            self.recorder.duration(name, seconds * 1000, attributes)
+        except Exception as e:
+            LOGGER.warning(f"Failed to record {name} duration: {e}")
+
+    def record_usage(self, usage, **attributes):
+        if self.recorder is None or usage is None:
+            return
+        try:
+            for kind in ("prompt", "completion"):
+                amount = getattr(usage, f"{kind}_tokens", None)
+                if amount:
+                    self.recorder.token_usage(kind, amount, attributes)
+        except Exception as e:
+            LOGGER.warning(f"Failed to record token usage: {e}")
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def _create_recorder(mode):
+    if mode == "off":
+        return None
+    if mode == "log":
+        return LogRecorder()
+    if mode == "otel":
+        try:
+            return OpenTelemetryRecorder()
+        except ImportError:
+            LOGGER.warning("opentelemetry-api is not installed, logging telemetry instead")
+        except RuntimeError as e:
+            LOGGER.warning(f"OpenTelemetry metrics are not exported ({e}), logging telemetry instead")
+        return LogRecorder()
+    raise ValueError(f"Unknown telemetry mode: {mode}")
+
+
+def get_telemetry():
+    # Process-level telemetry configured from the environment: TelemetryMode (log | otel | off) and
+    # TelemetrySampleRate (0 to 1). otel exports to Application Insights, see _configure_meter_provider
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = Telemetry(
+                    recorder=_create_recorder(os.environ.get("TelemetryMode", "log").lower()),
+                    sample_rate=float(os.environ.get("TelemetrySampleRate", 1.0))
+                )
+    return _telemetry
+
+
+def stage(name, **attributes):
+    return get_telemetry().stage(name, **attributes)
+
+
+def record_usage(usage, **attributes):
+    get_telemetry().record_usage(usage, **attributes)
@@ -0,0 +1,123 @@
+import json
+import unittest
+from unittest import mock
+
+import azure.functions as func
+
+import function_app
+from mocks.functions import handler
+from mocks.table import InMemoryTableClient
+from vocard import aggregates
+from vocard.aggregates import (module_aggregate, parts_of_speech, read_topic_stats, rebuild_topic_stats,
+                               topic_aggregate, update_topic_stats)
+
+
+class TestTopicStats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = InMemoryTableClient("TopicStats")
+        self.cards = InMemoryTableClient("Cards")
+
+    def test_incremental_updates(self):
+        update_topic_stats(self.stats, "fruits", 2, parts_of_speech([{"partOfSpeech": "n."}, {"partOfSpeech": "v."}]))
+        self.assertTrue(self.stats.get_entity("topic", "fruits")["stale"])
+        update_topic_stats(self.stats, "fruits", 1, parts_of_speech([{"partOfSpeech": "n."}]))
+        update_topic_stats(self.stats, "fruits", -1, parts_of_speech([{"partOfSpeech": "v."}], -1))
+        aggregate = topic_aggregate(self.stats.get_entity("topic", "fruits"))
+        self.assertEqual(aggregate["cardCount"], 2)
+        self.assertEqual(aggregate["partsOfSpeech"], {"n.": 2})
+        self.assertIsNotNone(aggregate["lastModified"])
+
+    def test_rebuild_recounts_stale_rows(self):
+        for row_key, pos in [("1", "n."), ("2", "adj."), ("3", "n.")]:
+            self.cards.create_entity(entity={"PartitionKey": "fruits", "RowKey": row_key, "partOfSpeech": pos})
+        update_topic_stats(self.stats, "fruits", 1, stale=True)
+        current = self.stats.get_entity("topic", "fruits")
+        self.assertTrue(current["stale"])
+        stats = rebuild_topic_stats(self.cards, self.stats, "fruits", current)
+        self.assertEqual(topic_aggregate(stats)["partsOfSpeech"], {"adj.": 1, "n.": 2})
+        stored = self.stats.get_entity("topic", "fruits")
+        self.assertEqual((stored["cardCount"], stored["stale"]), (3, False))
+
+    def test_rebuild_does_not_overwrite_concurrent_writes(self):
+        update_topic_stats(self.stats, "fruits", 1, stale=True)
+        current = self.stats.get_entity("topic", "fruits")
+        update_topic_stats(self.stats, "fruits", 1)
+        rebuild_topic_stats(self.cards, self.stats, "fruits", current)
+        self.assertEqual(self.stats.get_entity("topic", "fruits")["cardCount"], 2)
+
+    def test_read_topic_stats_returns_only_requested_topics(self):
+        for topic_key in ["apples", "bananas", "cherries"]:
+            update_topic_stats(self.stats, topic_key, 1)
+        self.assertEqual(sorted(read_topic_stats(self.stats, ["apples", "cherries"])), ["apples", "cherries"])
+        self.assertEqual(read_topic_stats(self.stats, []), {})
+
+    def test_module_aggregate(self):
+        aggregate = module_aggregate([
+            {"cardCount": 2, "partsOfSpeech": {"n.": 2}, "lastModified": "2024-01-01T00:00:00+00:00"},
+            {"cardCount": 3, "partsOfSpeech": {"n.": 1, "v.": 2}, "lastModified": "2024-02-01T00:00:00+00:00"},
+        ])
+        self.assertEqual(aggregate, {"topicCount": 2, "cardCount": 5, "partsOfSpeech": {"n.": 3, "v.": 2},
+                                     "lastModified": "2024-02-01T00:00:00+00:00"})
+
+
+class TestModuleBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.tables = {name: InMemoryTableClient(name) for name in ["Cards", "Topics", "Modules", "TopicStats"]}
+        for patcher in [
+            mock.patch.object(function_app, "get_table_client", side_effect=self.tables.__getitem__),
+            mock.patch.object(function_app, "get_stats_table", return_value=self.tables["TopicStats"]),
+            mock.patch.object(aggregates, "get_stats_table", return_value=self.tables["TopicStats"]),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.tables["Modules"].create_entity(entity={"PartitionKey": "default", "RowKey": "bundle_basics",
+                                                     "title": "Bundle Basics"})
+        for title in ["Fruits", "Tools"]:
+            self.tables["Topics"].create_entity(entity={"PartitionKey": "bundle_basics", "RowKey": title.lower(),
+                                                        "module": "Bundle Basics", "title": title})
+
+    def post(self, function, body):
+        request = func.HttpRequest("POST", "/api/cards", body=json.dumps(body).encode('utf-8'))
+        return handler(function)(request)
+
+    def bundle(self, headers=None):
+        request = func.HttpRequest("GET", "/api/modules/bundle_basics/bundle", body=b"", headers=headers or {},
+                                   route_params={"moduleKey": "bundle_basics"})
+        return handler(function_app.get_module_bundle)(request)
+
+    def test_bundle_reflects_card_writes(self):
+        # A card written before stats were kept is counted by the first bundle read
+        self.tables["Cards"].create_entity(entity={"PartitionKey": "tools", "RowKey": "0", "topic": "Tools",
+                                                   "word": "saw", "partOfSpeech": "n.", "definition": "A tool."})
+        self.post(function_app.create_new_card,
+                  {"topic": "Fruits", "word": "apple", "partOfSpeech": "n.", "definition": "A fruit."})
+        self.post(function_app.create_cards_in_bulk, {"cards": [
+            {"topic": "Fruits", "word": "peel", "partOfSpeech": "v.", "definition": "To remove the skin."},
+            {"topic": "Tools", "word": "hammer", "partOfSpeech": "n.", "definition": "A tool."},
+        ]})
+        response = self.bundle()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b", ", response.get_body())
+        bundle = json.loads(response.get_body())
+        self.assertEqual(bundle["module"]["title"], "Bundle Basics")
+        self.assertEqual({t["RowKey"]: t["stats"]["cardCount"] for t in bundle["topics"]}, {"fruits": 2, "tools": 2})
+        self.assertEqual(bundle["stats"]["partsOfSpeech"], {"n.": 3, "v.": 1})
+        self.assertEqual(self.bundle(headers={"If-None-Match": response.headers["ETag"]}).status_code, 304)
+
+        card = next(iter(self.tables["Cards"].query_entities("PartitionKey eq @pk", parameters={"pk": "fruits"})))
+        request = func.HttpRequest("DELETE", "/api/cards/fruits/x/delete", body=b"",
+                                   route_params={"topicKey": "fruits", "cardKey": card["RowKey"]})
+        self.assertEqual(handler(function_app.delete_card)(request).status_code, 200)
+        bundle = json.loads(self.bundle().get_body())
+        self.assertEqual(bundle["stats"]["cardCount"], 3)
+        self.assertEqual(sum(bundle["stats"]["partsOfSpeech"].values()), 3)
+
+    def test_missing_module(self):
+        request = func.HttpRequest("GET", "/api/modules/nope/bundle", body=b"", route_params={"moduleKey": "nope"})
+        self.assertEqual(handler(function_app.get_module_bundle)(request).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
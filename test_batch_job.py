@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import unittest
+
+import batch_job
+from mocks.batch import LocalBatchClient, default_responder
+
+
+class TestBatchJob(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.tmp.name, "input.jsonl")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip_through_local_batch_endpoint(self):
+        client = LocalBatchClient()
+        batch_job.build_batch_input(["pear", "apple"], self.input_path)
+        batch = batch_job.submit_batch(client, self.input_path)
+        batch = batch_job.wait_for_batch(client, batch.id, poll_interval=0)
+        self.assertEqual(batch.status, "completed")
+        results, failed = batch_job.collect_batch_results(client, batch)
+        self.assertEqual(results["apple"][0]["word"], "apple")
+        self.assertEqual(sorted(results), ["apple", "pear"])
+        self.assertEqual(failed, [])
+
+    def test_failed_requests_are_reported(self):
+        def responder(body):
+            if "kiwi" in body["messages"][-1]["content"]:
+                raise RuntimeError("boom")
+            return default_responder(body)
+
+        client = LocalBatchClient(responder=responder)
+        path = batch_job.build_batch_input(["apple", "kiwi"], self.input_path)
+        batch = batch_job.submit_batch(client, path)
+        batch = batch_job.wait_for_batch(client, batch.id, poll_interval=0)
+        results, failed = batch_job.collect_batch_results(client, batch)
+        self.assertEqual(list(results), ["apple"])
+        self.assertEqual(failed, ["kiwi"])
+
+    def test_generate_with_batch_api_merges_output(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            os.makedirs("input")
+            with open("input/fruits.json", "w", encoding='utf-8') as f:
+                json.dump({"words": ["pear", "apple"]}, f)
+            data = batch_job.generate_with_batch_api("fruits.json", client=LocalBatchClient(), poll_interval=0)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(data["title"], "Fruits")
+        self.assertIn("get_word_definition", data["metadata"]["prompts"])
+        self.assertEqual([d["word"] for d in data["vocabularies"]], ["apple", "pear"])
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import unittest
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError
+from azure.data.tables import UpdateMode
+
+from benchmarks.prompts import evaluate
+from benchmarks.run import compare, percentiles, timed_completions
+from cache import DefinitionCache
+from generation_engine import GenerationEngine
+from mocks.openai_server import MockOpenAIServer, chat_responder
+from mocks.table import InMemoryTableClient
+
+
+def post(server, content):
+    body = json.dumps({"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": content}]})
+    request = urllib.request.Request(f"{server.base_url}/chat/completions", data=body.encode('utf-8'),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+class TestMockOpenAIServer(unittest.TestCase):
+
+    def test_completions_and_token_accounting(self):
+        with MockOpenAIServer(latency=0) as server:
+            status, payload = post(server, 'Words: ["apple", "pear"], Context: Food')
+            self.assertEqual(status, 200)
+            self.assertEqual(sorted(json.loads(payload["choices"][0]["message"]["content"])["definitions"]),
+                             ["apple", "pear"])
+            self.assertEqual(server.stats.completion_tokens, payload["usage"]["completion_tokens"])
+
+    def test_throttling_is_deterministic(self):
+        def statuses(seed):
+            with MockOpenAIServer(latency=0, throttle_rate=0.5, seed=seed) as server:
+                return [post(server, f"Word: word{i % 5}")[0] for i in range(20)]
+
+        first = statuses(7)
+        self.assertEqual(first, statuses(7))
+        self.assertIn(429, first)
+        self.assertIn(200, first)
+
+
+class TestTimedCompletions(unittest.TestCase):
+
+    def test_records_client_side_latency(self):
+        class SlowCompletions:
+            async def create(self, **kwargs):
+                await asyncio.sleep(0.02)
+                content = json.dumps({"definitions": [{"word": "apple", "partOfSpeech": "n.", "definition": "x"}]})
+                return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                                       usage=None)
+
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SlowCompletions()))
+        engine = GenerationEngine(client=client, cache=DefinitionCache(), concurrency=2)
+        latencies = []
+        with timed_completions(latencies):
+            asyncio.run(engine.run(["apple", "pear"]))
+        self.assertEqual(len(latencies), 2)
+        self.assertTrue(all(latency >= 0.02 for latency in latencies))
+
+
+class TestInMemoryTableClient(unittest.TestCase):
+
+    def test_paging_and_conditional_update(self):
+        table_client = InMemoryTableClient()
+        for i in range(5):
+            table_client.create_entity({"PartitionKey": "food", "RowKey": str(i), "word": f"w{i}"})
+        table_client.create_entity({"PartitionKey": "travel", "RowKey": "0", "word": "trip"})
+        pages = table_client.query_entities("PartitionKey eq @pk", parameters={"pk": "food"},
+                                            results_per_page=2).by_page()
+        self.assertEqual([e["RowKey"] for e in next(pages)], ["0", "1"])
+        pages = table_client.query_entities("PartitionKey eq @pk", parameters={"pk": "food"},
+                                            results_per_page=2).by_page(pages.continuation_token)
+        self.assertEqual([e["RowKey"] for e in next(pages)], ["2", "3"])
+
+        entity = table_client.get_entity("food", "0")
+        table_client.update_entity({"PartitionKey": "food", "RowKey": "0", "meaningVi": "x"}, mode=UpdateMode.MERGE)
+        with self.assertRaises(ResourceModifiedError):
+            table_client.update_entity(entity, etag=entity.metadata["etag"],
+                                       match_condition=MatchConditions.IfNotModified)
+        self.assertEqual(table_client.get_entity("food", "0")["word"], "w0")
+
+
+class TestReport(unittest.TestCase):
+
+    def test_percentiles(self):
+        self.assertEqual(percentiles([i / 1000 for i in range(1, 101)]), {"p50": 50.0, "p95": 95.0, "p99": 99.0})
+
+    def test_compare_flags_regressions(self):
+        baseline = {"scenarios": {"gen": {"wordsPerSecond": 100, "p95": 50, "tokensPerWord": 300}}}
+        results = {"scenarios": {"gen": {"wordsPerSecond": 70, "p95": 55, "tokensPerWord": 400}}}
+        self.assertEqual(compare(results, baseline, 0.2),
+                         ["gen.wordsPerSecond: 100 -> 70", "gen.tokensPerWord: 300 -> 400"])
+
+
+class FakeCompletions:
+    # Answers like the mock server, but with a definition missing its required fields for every other word
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, model, response_format, messages):
+        self.calls += 1
+        content = chat_responder({"messages": messages})
+        if self.calls % 2 == 0:
+            content["definitions"][1] = {"word": content["definitions"][1]["word"]}
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=50)
+        message = SimpleNamespace(content=json.dumps(content))
+        return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=message)])
+
+
+class TestPromptReport(unittest.TestCase):
+
+    def test_evaluate(self):
+        client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+        row = evaluate(client, "compact", "gpt-4o-mini", words=["apple", "pear", "plum", "fig"], concurrency=1)
+        self.assertEqual((row["words"], row["definitions"], row["unparsed"]), (4, 8, 0))
+        self.assertEqual(row["validRate"], 0.75)
+        self.assertEqual(row["promptTokensPerWord"], 100)
+        self.assertEqual(row["tokensPerDefinition"], 100)
+        self.assertAlmostEqual(row["costPerDefinition"], (400 * 0.15 + 200 * 0.6) / 1e6 / 6, places=7)
+
+    def test_evaluate_counts_failed_requests(self):
+        class FailingCompletions(FakeCompletions):
+            def create(self, model, response_format, messages):
+                if "pear" in messages[1]["content"]:
+                    raise ValueError("Error code: 400")
+                return super().create(model, response_format, messages)
+
+        client = SimpleNamespace(chat=SimpleNamespace(completions=FailingCompletions()))
+        row = evaluate(client, "compact", "gpt-3.5-turbo", words=["apple", "pear"], concurrency=1)
+        self.assertEqual((row["words"], row["errors"], row["definitions"]), (2, 1, 2))
+        self.assertEqual(row["promptTokensPerWord"], 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from mocks.table import InMemoryTableClient
+from vocard.bulk import MAX_TRANSACTION_SIZE, bulk_import_cards, normalize_generated_card, summarize
+
+
+def card(topic, word):
+    return {"topic": topic, "word": word, "partOfSpeech": "n.", "definition": f"Definition of {word}."}
+
+
+class TestBulkImport(unittest.TestCase):
+
+    def test_groups_by_partition_and_chunks(self):
+        # The in-memory table rejects transactions over MAX_TRANSACTION_SIZE operations or several partitions
+        table_client = InMemoryTableClient("Cards")
+        cards = [card("Food", f"word{i}") for i in range(MAX_TRANSACTION_SIZE + 1)] + [card("Office work", "desk")]
+        report = bulk_import_cards(table_client, cards)
+        self.assertEqual(summarize(report), {"created": len(cards), "invalid": 0, "failed": 0})
+        self.assertEqual((table_client.calls, len(table_client)), (3, len(cards)))
+        self.assertEqual(report[-1]["PartitionKey"], "office_work")
+
+    def test_reports_invalid_and_failed_cards(self):
+        table_client = InMemoryTableClient("Cards")
+        table_client.create_entity(entity={"PartitionKey": "food", "RowKey": "pear", "word": "pear"})
+        report = bulk_import_cards(table_client, [card("Food", "apple"), {"word": "kiwi"},
+                                                  dict(card("Food", "pear"), rowKey="pear")])
+        self.assertEqual([item["status"] for item in report], ["created", "invalid", "failed"])
+        self.assertEqual(len(table_client), 2)
+
+    def test_normalize_generated_card(self):
+        generated = {"word": "apple", "partOfSpeech": "n.", "definition": "A fruit.", "example sentence": "Eat it."}
+        self.assertEqual(normalize_generated_card(generated, "Food")["exampleSentence"], "Eat it.")
+        self.assertNotIn("example sentence", normalize_generated_card(generated, "Food"))
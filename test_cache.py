@@ -0,0 +1,71 @@
+import os
+import tempfile
+import time
+import unittest
+
+from cache import DefinitionCache, LRUCache, SqliteStore
+
+
+class FakePrompt:
+    def __init__(self, name, content):
+        self._name = name
+        self._content = content
+
+    def name(self):
+        return self._name
+
+    def hash(self):
+        return str(hash(self._content))
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats.evictions, 1)
+
+    def test_expires_entries(self):
+        cache = LRUCache(max_size=2, ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats.expirations, 1)
+
+
+class TestDefinitionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "definitions.sqlite3")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_hit_after_set_with_normalized_word(self):
+        cache = DefinitionCache(store=SqliteStore(self.path))
+        prompt = FakePrompt("get_word_definition", "v1")
+        self.assertIsNone(cache.get("Apple", None, prompt, "gpt-3.5-turbo"))
+        cache.set("Apple", None, prompt, "gpt-3.5-turbo", {"definitions": [{"word": "apple"}]})
+        self.assertEqual(cache.get(" apple ", None, prompt, "gpt-3.5-turbo"),
+                         {"definitions": [{"word": "apple"}]})
+        self.assertEqual(cache.stats.hits, 1)
+        self.assertEqual(cache.stats.misses, 1)
+
+    def test_persistent_store_survives_new_process_cache(self):
+        prompt = FakePrompt("get_word_definition", "v1")
+        DefinitionCache(store=SqliteStore(self.path)).set("apple", None, prompt, "m", {"definitions": []})
+        cache = DefinitionCache(store=SqliteStore(self.path))
+        self.assertEqual(cache.get("apple", None, prompt, "m"), {"definitions": []})
+        self.assertEqual(cache.stats.store_hits, 1)
+
+    def test_prompt_change_invalidates(self):
+        cache = DefinitionCache(store=SqliteStore(self.path))
+        cache.set("apple", None, FakePrompt("get_word_definition", "v1"), "m", {"definitions": []})
+        self.assertIsNone(cache.get("apple", None, FakePrompt("get_word_definition", "v2"), "m"))
+        self.assertIsNone(cache.get("apple", "food", FakePrompt("get_word_definition", "v1"), "m"))
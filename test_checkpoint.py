@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import unittest
+
+from checkpoint import JsonlCheckpoint
+
+
+def definition(word, sense):
+    return {"word": word, "partOfSpeech": "n.", "definition": sense}
+
+
+class TestJsonlCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.checkpoint = JsonlCheckpoint(os.path.join(self.tmp.name, "output", "words.checkpoint.jsonl"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_completed_words_skip_truncated_line(self):
+        self.checkpoint.append("apple", [definition("apple", "A fruit.")])
+        with open(self.checkpoint.path, "a", encoding='utf-8') as f:
+            f.write('{"word": "pear", "defin')
+        self.assertEqual(self.checkpoint.completed_words(), {"apple"})
+
+    def test_resume_after_truncated_line(self):
+        self.checkpoint.append("apple", [definition("apple", "A fruit.")])
+        with open(self.checkpoint.path, "a", encoding='utf-8') as f:
+            f.write('{"word": "pear", "defin')
+        resumed = JsonlCheckpoint(self.checkpoint.path)
+        resumed.append("pear", [definition("pear", "A fruit.")])
+        self.assertEqual(resumed.completed_words(), {"apple", "pear"})
+        self.assertEqual(resumed.compact(os.path.join(self.tmp.name, "words.json"), "Words"), 2)
+
+    def test_compact_merges_sorted_runs(self):
+        for word in ["pear", "apple", "kiwi", "fig", "banana"]:
+            self.checkpoint.append(word, [definition(word, "1"), definition(word, "2")])
+        self.checkpoint.append("apple", [definition("apple", "duplicate")])
+        output_path = os.path.join(self.tmp.name, "words.json")
+        count = self.checkpoint.compact(output_path, "Words", run_size=3)
+        with open(output_path, encoding='utf-8') as f:
+            data = json.load(f)
+        self.assertEqual(count, 10)
+        self.assertEqual(data["title"], "Words")
+        words = [d["word"] for d in data["vocabularies"]]
+        self.assertEqual(words, sorted(words))
+        self.assertNotIn("duplicate", [d["definition"] for d in data["vocabularies"]])
+
+    def test_compact_empty_checkpoint(self):
+        self.checkpoint.append("apple", [])
+        output_path = os.path.join(self.tmp.name, "words.json")
+        self.checkpoint.compact(output_path, "Words")
+        with open(output_path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {"title": "Words", "vocabularies": []})
@@ -0,0 +1,55 @@
+import unittest
+
+from dedup import VocabularyIndex, lemma_candidates, normalize_part_of_speech
+
+
+def definition(word, part_of_speech, sense):
+    return {"word": word, "partOfSpeech": part_of_speech, "definition": sense}
+
+
+class TestLemmaCandidates(unittest.TestCase):
+
+    def test_candidates(self):
+        self.assertIn("city", lemma_candidates("cities"))
+        self.assertIn("stop", lemma_candidates("stopped"))
+        self.assertEqual(lemma_candidates("Children"), ["child", "children"])
+        self.assertEqual(lemma_candidates("news"), ["news"])
+        self.assertEqual(lemma_candidates("building", plurals_only=True), ["building"])
+
+    def test_part_of_speech(self):
+        self.assertEqual(normalize_part_of_speech("n."), "noun")
+        self.assertEqual(normalize_part_of_speech(" Verb "), "verb")
+
+
+class TestVocabularyIndex(unittest.TestCase):
+
+    def test_filter_words_collapses_plurals(self):
+        index = VocabularyIndex()
+        kept, skipped = index.filter_words(["apples", "apple", "Apple", "boxes", "box", "teacher", "teach", "news"])
+        self.assertEqual(kept, ["apple", "box", "teacher", "teach", "news"])
+        self.assertEqual(sorted(skipped), ["Apple", "apples", "boxes"])
+
+    def test_filter_words_skips_known_lemmas(self):
+        index = VocabularyIndex()
+        index.add(definition("apple", "n.", "A round fruit."))
+        self.assertEqual(index.filter_words(["apples", "pear"]), (["pear"], ["apples"]))
+
+    def test_add_rejects_duplicate_senses(self):
+        index = VocabularyIndex()
+        self.assertTrue(index.add(definition("run", "v.", "To move quickly on foot.")))
+        self.assertFalse(index.add(definition("Run", "verb", "to move quickly on foot")))
+        self.assertFalse(index.add(definition("running", "v.", "To move very quickly on foot.")))
+        self.assertTrue(index.add(definition("run", "n.", "An act of moving quickly on foot.")))
+        self.assertTrue(index.add(definition("run", "v.", "To manage a business.")))
+        self.assertEqual(len(index), 3)
+
+    def test_add_all_keeps_order(self):
+        index = VocabularyIndex()
+        definitions = [definition("bank", "n.", "Land beside a river."),
+                       definition("bank", "n.", "An organization that keeps money."),
+                       definition("bank", "n.", "The land beside a river.")]
+        self.assertEqual(index.add_all(definitions), definitions[:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
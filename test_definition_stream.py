@@ -0,0 +1,119 @@
+import asyncio
+import json
+import inspect
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import azure.functions as func
+from azurefunctions.extensions.base import HttpV2FeatureChecker
+from azurefunctions.extensions.http.fastapi import Request
+
+import function_app
+from ai import word_def_asst
+from ai.definition_stream import DefinitionStreamParser, stream_word_definition
+from cache import DefinitionCache
+from mocks.functions import handler
+
+COMPLETION = json.dumps({"definitions": [
+    {"word": "brace", "partOfSpeech": "n.", "definition": "A mark like { or }, \"quoted\"."},
+    {"word": "brace", "partOfSpeech": "v.", "definition": "To prepare for something difficult."},
+    {"word": "brace", "definition": "Missing its part of speech."},
+]}, indent=2)
+
+
+class FakeStream:
+    def __init__(self, text, size):
+        self.chunks = [text[i:i + size] for i in range(0, len(text), size)]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=chunk))])
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        return FakeStream(COMPLETION, 7)
+
+
+class TestDefinitionStreamParser(unittest.TestCase):
+
+    def test_emits_objects_as_they_complete(self):
+        for size in (1, 5, 64, len(COMPLETION)):
+            parser = DefinitionStreamParser()
+            emitted = []
+            for start in range(0, len(COMPLETION), size):
+                emitted.extend(parser.feed(COMPLETION[start:start + size]))
+            self.assertEqual(emitted, json.loads(COMPLETION)["definitions"])
+            self.assertTrue(parser.done)
+
+    def test_first_object_before_end_of_completion(self):
+        parser = DefinitionStreamParser()
+        first_end = COMPLETION.index("},\n") + 1
+        self.assertEqual(len(parser.feed(COMPLETION[:first_end])), 1)
+        self.assertFalse(parser.done)
+
+
+class TestStreamWordDefinition(unittest.TestCase):
+
+    def test_streams_valid_definitions_and_caches_them(self):
+        completions = FakeCompletions()
+        client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        cache = DefinitionCache()
+
+        async def collect():
+            return [d async for d in stream_word_definition("brace", client=client, cache=cache)]
+
+        first = asyncio.run(collect())
+        self.assertEqual([d["partOfSpeech"] for d in first], ["n.", "v."])
+        self.assertEqual(asyncio.run(collect()), first)
+        self.assertEqual(completions.calls, 1)
+
+
+class TestHttpStreamingExtension(unittest.TestCase):
+    # Importing the fastapi extension switches every HTTP function of the app to the worker's HTTP proxy,
+    # so the legacy func.HttpRequest handlers have to keep working next to the streaming one
+
+    def http_functions(self):
+        for function in function_app.app.get_functions():
+            if function.get_bindings()[0].type == "httpTrigger":
+                yield function
+
+    def test_extension_is_loaded_with_the_app(self):
+        self.assertTrue(HttpV2FeatureChecker.http_v2_enabled())
+
+    def test_every_http_handler_takes_a_supported_request(self):
+        for function in self.http_functions():
+            parameter = next(iter(inspect.signature(function.get_user_function()).parameters.values()))
+            self.assertIn(parameter.annotation, (func.HttpRequest, Request), function.get_function_name())
+
+    def test_legacy_handler_runs_with_extension_loaded(self):
+        result = {"definitions": [{"word": "brace", "partOfSpeech": "n.", "definition": "A mark."}]}
+        worker = mock.Mock(**{"return_value.get_word_definition.return_value": result})
+        with mock.patch.object(word_def_asst, "worker", worker):
+            request = func.HttpRequest("POST", "/api/definitions/gen", body=json.dumps({"word": "brace"}).encode())
+            response = handler(word_def_asst.generate_definitions)(request)
+        self.assertIsInstance(response, func.HttpResponse)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_body()), result)
+
+    def test_streaming_handler_rejects_missing_word(self):
+        async def receive():
+            return {"type": "http.request", "body": b"{}", "more_body": False}
+
+        request = Request({"type": "http", "method": "POST", "path": "/api/definitions/stream", "headers": []},
+                          receive)
+        response = asyncio.run(handler(word_def_asst.stream_definitions)(request))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.media_type, "application/x-ndjson")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+import azure.functions as func
+from azure.core.exceptions import ResourceNotFoundError
+
+from cache import EntityCache
+from mocks.table import InMemoryTableClient
+
+
+class TestEntityCache(unittest.TestCase):
+
+    def setUp(self):
+        self.table_client = InMemoryTableClient("Modules")
+        self.etag = self.put("english", "English")
+        self.table_client.calls = 0
+        self.cache = EntityCache()
+
+    def put(self, row_key, title):
+        return self.table_client.upsert_entity({"PartitionKey": "default", "RowKey": row_key, "title": title})["etag"]
+
+    def test_entity_reads_are_cached_until_invalidated(self):
+        entity, etag = self.cache.get_entity(self.table_client, "default", "english")
+        self.assertEqual((entity["RowKey"], entity["title"], etag), ("english", "English", self.etag))
+        self.cache.get_entity(self.table_client, "default", "english")
+        self.assertEqual(self.table_client.calls, 1)
+        etag = self.put("english", "British English")
+        self.cache.invalidate("Modules", "default", "english")
+        entity, new_etag = self.cache.get_entity(self.table_client, "default", "english")
+        self.assertEqual((entity["title"], new_etag), ("British English", etag))
+
+    def test_missing_entity_raises(self):
+        with self.assertRaises(ResourceNotFoundError):
+            self.cache.get_entity(self.table_client, "default", "french")
+
+    def test_listing_etag_changes_with_content(self):
+        items, etag = self.cache.list_partition(self.table_client, "default")
+        self.assertEqual([item["RowKey"] for item in items], ["english"])
+        self.assertEqual(self.cache.list_partition(self.table_client, "default")[1], etag)
+        self.assertEqual(self.table_client.calls, 1)
+        self.put("french", "French")
+        self.cache.invalidate("Modules", "default", "french")
+        self.assertNotEqual(self.cache.list_partition(self.table_client, "default")[1], etag)
+
+
+class TestConditionalResponse(unittest.TestCase):
+
+    def test_not_modified_when_etag_matches(self):
+        from function_app import conditional_response
+        req = func.HttpRequest("GET", "/api/modules", headers={"If-None-Match": 'W/"1"'}, body=b"")
+        self.assertEqual(conditional_response(req, {"title": "English"}, 'W/"1"').status_code, 304)
+        response = conditional_response(req, {"title": "English"}, 'W/"2"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["ETag"], 'W/"2"')
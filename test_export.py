@@ -0,0 +1,171 @@
+import datetime
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import azure.functions as func
+
+import function_app
+from mocks.functions import handler
+from mocks.media_server import InMemoryMediaStore
+from mocks.table import InMemoryTableClient
+from vocard import aggregates
+from vocard.export import deck_name, parse_since, prune_decks, quantize_since, write_deck
+
+
+def read_jsonl(path):
+    with gzip.open(path, "rt", encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+class TestWriteDeck(unittest.TestCase):
+
+    def setUp(self):
+        self.cards = InMemoryTableClient("Cards")
+        for row_key, word in [("1", "apple"), ("2", "pear")]:
+            self.cards.create_entity(entity={"PartitionKey": "fruits", "RowKey": row_key, "topic": "Fruits",
+                                             "word": word, "definition": f"A {word}."})
+        self.cards.create_entity(entity={"PartitionKey": "tools", "RowKey": "1", "topic": "Tools", "word": "saw"})
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "deck")
+
+    def test_full_jsonl_deck(self):
+        header = write_deck(self.path, self.cards, "topic", "fruits", ["fruits"], "v1")
+        lines = read_jsonl(self.path)
+        self.assertEqual(lines[0], header)
+        self.assertEqual([card["word"] for card in lines[1:]], ["apple", "pear"])
+        self.assertEqual(lines[1]["topicKey"], "fruits")
+        self.assertIn("updatedAt", lines[1])
+        self.assertNotIn("pronUk", lines[1])
+
+    def test_delta_deck_lists_current_ids(self):
+        since = datetime.datetime.now(datetime.timezone.utc)
+        self.cards.upsert_entity(entity={"PartitionKey": "fruits", "RowKey": "3", "topic": "Fruits", "word": "fig"})
+        self.cards.delete_entity("fruits", "1")
+        write_deck(self.path, self.cards, "module", "basics", ["fruits", "tools"], "v2", since=since)
+        lines = read_jsonl(self.path)
+        self.assertEqual([card["word"] for card in lines[1:-1]], ["fig"])
+        self.assertEqual(lines[-1], {"ids": ["fruits/2", "fruits/3", "tools/1"]})
+        self.assertLess(parse_since(lines[0]["syncedAt"]), since)
+
+    def test_sqlite_deck(self):
+        header = write_deck(self.path, self.cards, "module", "basics", ["fruits", "tools"], "v1", fmt="sqlite")
+        connection = sqlite3.connect(self.path)
+        try:
+            words = [row[0] for row in connection.execute("SELECT word FROM cards ORDER BY word")]
+            meta = dict(connection.execute("SELECT key, value FROM meta"))
+        finally:
+            connection.close()
+        self.assertEqual(words, ["apple", "pear", "saw"])
+        self.assertEqual(json.loads(meta["syncedAt"]), header["syncedAt"])
+
+    def test_parse_since(self):
+        self.assertIsNone(parse_since(None))
+        self.assertEqual(parse_since("2024-01-01T00:00:00Z"),
+                         datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc))
+        with self.assertRaises(ValueError):
+            parse_since("yesterday")
+
+
+class TestExportDeck(unittest.TestCase):
+
+    def setUp(self):
+        self.tables = {name: InMemoryTableClient(name) for name in ["Cards", "Topics", "Modules", "TopicStats"]}
+        self.store = InMemoryMediaStore("https://cdn.example.com/decks")
+        for patcher in [
+            mock.patch.object(function_app, "get_table_client", side_effect=self.tables.__getitem__),
+            mock.patch.object(function_app, "get_stats_table", return_value=self.tables["TopicStats"]),
+            mock.patch.object(aggregates, "get_stats_table", return_value=self.tables["TopicStats"]),
+            mock.patch.object(function_app, "get_deck_store", return_value=self.store),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.tables["Modules"].create_entity(entity={"PartitionKey": "default", "RowKey": "deck_basics",
+                                                     "title": "Deck Basics"})
+        self.tables["Topics"].create_entity(entity={"PartitionKey": "deck_basics", "RowKey": "fruits",
+                                                    "module": "Deck Basics", "title": "Fruits"})
+
+    def export(self, scope, key, **params):
+        request = func.HttpRequest("GET", f"/api/decks/{scope}/{key}", body=b"", params=params,
+                                   route_params={"scope": scope, "key": key})
+        return handler(function_app.export_deck)(request)
+
+    def test_deck_is_built_once_per_version(self):
+        request = func.HttpRequest("POST", "/api/cards", body=json.dumps(
+            {"topic": "Fruits", "word": "apple", "partOfSpeech": "n.", "definition": "A fruit."}).encode('utf-8'))
+        handler(function_app.create_new_card)(request)
+        response = self.export("module", "deck_basics")
+        self.assertEqual(response.status_code, 302)
+        location = response.headers["Location"]
+        self.assertTrue(location.startswith("https://cdn.example.com/decks/module/deck_basics/"))
+        self.assertTrue(location.endswith("/full.jsonl.gz"))
+        self.assertEqual(self.export("module", "deck_basics").headers["Location"], location)
+        self.assertEqual(self.store.puts, 1)
+
+        handler(function_app.create_new_card)(func.HttpRequest("POST", "/api/cards", body=json.dumps(
+            {"topic": "Fruits", "word": "pear", "partOfSpeech": "n.", "definition": "A fruit."}).encode('utf-8')))
+        self.assertNotEqual(self.export("module", "deck_basics").headers["Location"], location)
+        self.assertEqual(self.store.puts, 2)
+        sqlite_deck = self.export("topic", "fruits", format="sqlite", since="2024-01-01T00:34:56.789Z")
+        self.assertTrue(sqlite_deck.headers["Location"].endswith("/since-20240101T000000Z.sqlite"))
+
+    def delta_header(self, location):
+        name = location[len(self.store.base_url) + 1:]
+        lines = gzip.decompress(self.store.blobs[name][1]).decode('utf-8').splitlines()
+        return json.loads(lines[0]), json.loads(lines[-1])
+
+    def test_delta_decks_are_shared_and_list_ids_only_after_deletions(self):
+        handler(function_app.create_new_card)(func.HttpRequest("POST", "/api/cards", body=json.dumps(
+            {"topic": "Fruits", "word": "apple", "partOfSpeech": "n.", "definition": "A fruit."}).encode('utf-8')))
+        # Devices that synced within the same interval get the same delta blob
+        later = datetime.datetime.now(datetime.timezone.utc).replace(minute=0) + datetime.timedelta(hours=2)
+        location = self.export("topic", "fruits", since=later.isoformat()).headers["Location"]
+        self.assertEqual(self.export("topic", "fruits", since=(later + datetime.timedelta(minutes=30)).isoformat())
+                         .headers["Location"], location)
+        self.assertEqual(self.store.puts, 1)
+        header, _ = self.delta_header(location)
+        self.assertFalse(header["hasIds"])
+
+        card = next(iter(self.tables["Cards"].list_entities()))
+        request = func.HttpRequest("DELETE", "/api/cards/fruits/x/delete", body=b"",
+                                   route_params={"topicKey": "fruits", "cardKey": card["RowKey"]})
+        self.assertEqual(handler(function_app.delete_card)(request).status_code, 200)
+        header, ids = self.delta_header(self.export("topic", "fruits", since="2024-01-01T00:00:00Z")
+                                        .headers["Location"])
+        self.assertTrue(header["hasIds"])
+        self.assertEqual(ids, {"ids": []})
+
+    def test_bad_requests(self):
+        self.assertEqual(self.export("deck", "fruits").status_code, 400)
+        self.assertEqual(self.export("topic", "fruits", format="csv").status_code, 400)
+        self.assertEqual(self.export("topic", "fruits", since="soon").status_code, 400)
+        self.assertEqual(self.export("module", "nope").status_code, 404)
+
+    def test_deck_name(self):
+        self.assertEqual(deck_name("topic", "fruits", "abc", "sqlite"), "topic/fruits/abc/full.sqlite")
+
+    def test_quantize_since(self):
+        since = datetime.datetime(2024, 1, 1, 10, 34, 56, 789, tzinfo=datetime.timezone.utc)
+        self.assertEqual(quantize_since(since, 3600), datetime.datetime(2024, 1, 1, 10, tzinfo=datetime.timezone.utc))
+        self.assertEqual(quantize_since(since, 86400), datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc))
+        self.assertIsNone(quantize_since(None))
+
+    def test_prune_decks_keeps_latest_and_recently_superseded_versions(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for name, age in [("topic/fruits/v1/full.jsonl.gz", 50), ("topic/fruits/v1/since-20240101T000000Z.sqlite", 40),
+                          ("topic/fruits/v2/full.jsonl.gz", 30), ("topic/fruits/v3/full.jsonl.gz", 2),
+                          ("topic/tools/v1/full.jsonl.gz", 100)]:
+            self.store.put(name, b"", "application/gzip")
+            self.store.modified[name] = now - datetime.timedelta(hours=age)
+        self.assertEqual(prune_decks(self.store, datetime.timedelta(hours=24)), 2)
+        self.assertEqual(sorted(self.store.blobs), ["topic/fruits/v2/full.jsonl.gz", "topic/fruits/v3/full.jsonl.gz",
+                                                    "topic/tools/v1/full.jsonl.gz"])
+
+
+if __name__ == '__main__':
+    unittest.main()
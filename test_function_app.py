@@ -0,0 +1,91 @@
+import json
+import unittest
+from unittest import mock
+
+import azure.functions as func
+
+import function_app
+from mocks.functions import handler
+from mocks.table import InMemoryTableClient
+from vocard import aggregates
+
+
+def card(**fields):
+    return dict({"topic": "Food", "word": "apple", "partOfSpeech": "n.", "definition": "A fruit."}, **fields)
+
+
+class TestConditionalWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.table_client = InMemoryTableClient("Cards")
+        self.etag = self.table_client.create_entity(entity=dict(card(), PartitionKey="food", RowKey="1"))["etag"]
+        self.table_client.calls = 0
+        self.stats = InMemoryTableClient("TopicStats")
+        self.stats.create_entity(entity={"PartitionKey": "topic", "RowKey": "food", "cardCount": 1,
+                                         "partsOfSpeech": json.dumps({"n.": 1}), "stale": False})
+        for patcher in [
+            mock.patch.object(function_app, "get_table_client", return_value=self.table_client),
+            mock.patch.object(aggregates, "get_stats_table", return_value=self.stats),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def request(self, method, body=None, headers=None, card_key="1"):
+        return func.HttpRequest(method, f"/api/cards/food/{card_key}/change", headers=headers or {},
+                                route_params={"topicKey": "food", "cardKey": card_key},
+                                body=json.dumps(body).encode('utf-8') if body is not None else b"")
+
+    def topic_stats(self):
+        stats = self.stats.get_entity("topic", "food")
+        return stats["cardCount"], json.loads(stats["partsOfSpeech"]), stats["stale"]
+
+    def test_update_is_a_single_storage_call(self):
+        response = handler(function_app.update_card)(self.request("PATCH", {"definition": "A round fruit."}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.table_client.calls, 1)
+        self.assertNotEqual(response.headers["ETag"], self.etag)
+
+    def test_update_moves_part_of_speech_in_place(self):
+        response = handler(function_app.update_card)(self.request("PUT", card(partOfSpeech="v.")))
+        self.assertEqual(response.status_code, 200)
+        # The read of the previous part of speech and the write pinned to its version
+        self.assertEqual(self.table_client.calls, 2)
+        self.assertEqual(self.topic_stats(), (1, {"v.": 1}, False))
+
+    def test_update_racing_another_write_marks_stats_stale(self):
+        get_entity = self.table_client.get_entity
+
+        def read_then_race(*args, **kwargs):
+            current = get_entity(*args, **kwargs)
+            self.table_client.upsert_entity(dict(card(partOfSpeech="adj."), PartitionKey="food", RowKey="1"))
+            return current
+
+        with mock.patch.object(self.table_client, "get_entity", side_effect=read_then_race):
+            response = handler(function_app.update_card)(self.request("PUT", card(partOfSpeech="v.")))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.topic_stats()[2])
+
+    def test_update_with_stale_etag_fails(self):
+        response = handler(function_app.update_card)(
+            self.request("PUT", card(), headers={"If-Match": 'W/"0"'}))
+        self.assertEqual(response.status_code, 412)
+        response = handler(function_app.update_card)(
+            self.request("PUT", card(), headers={"If-Match": self.etag}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_missing_card(self):
+        response = handler(function_app.update_card)(self.request("PUT", card(), card_key="2"))
+        self.assertEqual(response.status_code, 404)
+
+    def test_patch_merges_partial_body(self):
+        response = handler(function_app.update_card)(self.request("PATCH", {"meaningVi": "quả táo"}))
+        self.assertEqual(response.status_code, 200)
+        entity = self.table_client.get_entity("food", "1")
+        self.assertEqual((entity["word"], entity["meaningVi"]), ("apple", "quả táo"))
+
+    def test_delete(self):
+        delete = handler(function_app.delete_card)
+        self.assertEqual(delete(self.request("DELETE", headers={"If-Match": 'W/"0"'})).status_code, 412)
+        self.assertEqual(delete(self.request("DELETE")).status_code, 200)
+        self.assertEqual(self.topic_stats(), (0, {}, False))
+        self.assertEqual(delete(self.request("DELETE")).status_code, 404)
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import unittest
+from types import SimpleNamespace
+
+from cache import DefinitionCache
+from generation_engine import AdaptiveBatchSizer, GenerationEngine, TokenBucket, split_batch_definitions
+from vocabulary_worker import VocabularyWorker
+
+
+class ThrottledError(Exception):
+    status_code = 429
+
+
+class FakeCompletions:
+    def __init__(self, fail_first=0):
+        self.calls = 0
+        self.fail_first = fail_first
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.fail_first:
+            raise ThrottledError("Rate limit reached")
+        word = kwargs["messages"][1]["content"].replace("Word: ", "")
+        content = json.dumps({"definitions": [{"word": word, "partOfSpeech": "n.", "definition": word}]})
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(total_tokens=100)
+        )
+
+
+class FakeBatchCompletions:
+    # Drops the last word of every multi-word batch to exercise the retry path
+    def __init__(self):
+        self.batches = []
+
+    async def create(self, **kwargs):
+        words = json.loads(kwargs["messages"][1]["content"].replace("Words: ", ""))
+        self.batches.append(words)
+        answered = words[:-1] if len(words) > 1 else words
+        content = json.dumps({"definitions": {
+            word: [{"word": word, "partOfSpeech": "n.", "definition": word}] for word in answered
+        }})
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")],
+            usage=SimpleNamespace(total_tokens=100, completion_tokens=80)
+        )
+
+
+class ScriptedCompletions:
+    # Answers with the given message contents in turn, the last one repeating
+    def __init__(self, *contents):
+        self.contents = list(contents)
+        self.calls = 0
+
+    def answer(self):
+        content = self.contents[min(self.calls, len(self.contents) - 1)]
+        self.calls += 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+    def create(self, **kwargs):
+        return self.answer()
+
+
+class AsyncScriptedCompletions(ScriptedCompletions):
+    async def create(self, **kwargs):
+        return self.answer()
+
+
+VALID = json.dumps({"definitions": [{"word": "apple", "partOfSpeech": "n.", "definition": "A fruit."}]})
+
+
+def fake_client(completions):
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+class TestGenerationEngine(unittest.TestCase):
+
+    def test_run_sorts_once_and_uses_cache(self):
+        completions = FakeCompletions()
+        engine = GenerationEngine(client=fake_client(completions), cache=DefinitionCache(), concurrency=4)
+        definitions, failed = asyncio.run(engine.run(["pear", "apple", "kiwi"]))
+        self.assertEqual([d["word"] for d in definitions], ["apple", "kiwi", "pear"])
+        self.assertEqual(failed, [])
+        asyncio.run(engine.run(["apple"]))
+        self.assertEqual(completions.calls, 3)
+
+    def test_retries_throttled_requests(self):
+        completions = FakeCompletions(fail_first=1)
+        engine = GenerationEngine(client=fake_client(completions), cache=DefinitionCache())
+        engine.max_retries = 1
+        asyncio.run(engine.run(["apple"]))
+        self.assertEqual(completions.calls, 2)
+
+    def test_token_bucket_waits_for_refill(self):
+        async def acquire_twice():
+            bucket = TokenBucket(rate_per_minute=600, capacity=1)
+            await bucket.acquire(1)
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            await bucket.acquire(1)
+            return loop.time() - start
+
+        self.assertGreaterEqual(asyncio.run(acquire_twice()), 0.05)
+
+
+class TestMalformedAnswers(unittest.TestCase):
+
+    def test_worker_does_not_cache_malformed_answers(self):
+        completions = ScriptedCompletions('{"definition": []}', '{"definitions": []}', VALID)
+        worker = VocabularyWorker(cache=DefinitionCache(), client=fake_client(completions))
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                worker.get_word_definition("apple")
+        self.assertEqual(worker.get_word_definition("apple")["definitions"][0]["word"], "apple")
+        worker.get_word_definition("apple")
+        self.assertEqual(completions.calls, 3)
+
+    def test_engine_does_not_cache_malformed_answers(self):
+        completions = AsyncScriptedCompletions("not json", VALID)
+        engine = GenerationEngine(client=fake_client(completions), cache=DefinitionCache(), concurrency=1)
+        with self.assertRaises(ValueError):
+            asyncio.run(engine.get_word_definition("apple"))
+        asyncio.run(engine.get_word_definition("apple"))
+        asyncio.run(engine.get_word_definition("apple"))
+        self.assertEqual(completions.calls, 2)
+
+    def test_malformed_answer_fails_only_its_word(self):
+        class PickyCompletions(FakeCompletions):
+            async def create(self, **kwargs):
+                if "kiwi" in kwargs["messages"][1]["content"]:
+                    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="{}"))],
+                                           usage=None)
+                return await super().create(**kwargs)
+
+        engine = GenerationEngine(client=fake_client(PickyCompletions()), cache=DefinitionCache(), concurrency=2)
+        definitions, failed = asyncio.run(engine.run(["pear", "kiwi", "apple"]))
+        self.assertEqual([d["word"] for d in definitions], ["apple", "pear"])
+        self.assertEqual(failed, ["kiwi"])
+
+
+class TestBatchedDefinitions(unittest.TestCase):
+
+    def test_split_validates_each_word(self):
+        payload = {"definitions": {
+            "Apple": [{"word": "apple", "partOfSpeech": "n.", "definition": "A fruit."}],
+            "pear": [{"word": "pear", "partOfSpeech": "n."}],
+        }}
+        result, retry = split_batch_definitions(payload, ["apple", "pear", "kiwi"])
+        self.assertEqual(list(result), ["apple"])
+        self.assertEqual(retry, ["pear", "kiwi"])
+
+    def test_sizer_halves_on_truncation_and_grows_from_usage(self):
+        sizer = AdaptiveBatchSizer(initial=8, completion_budget=1000, headroom=1.0)
+        sizer.record(8, 0, truncated=True)
+        self.assertEqual(sizer.next_size(), 4)
+        sizer.record(4, 4, completion_tokens=200)
+        self.assertEqual(sizer.next_size(), 20)
+
+    def test_run_batched_retries_missing_words(self):
+        completions = FakeBatchCompletions()
+        engine = GenerationEngine(client=fake_client(completions), cache=DefinitionCache(), concurrency=1)
+        definitions, failed = asyncio.run(engine.run_batched(["pear", "apple", "kiwi"]))
+        self.assertEqual([d["word"] for d in definitions], ["apple", "kiwi", "pear"])
+        self.assertEqual(failed, [])
+        self.assertEqual(completions.batches[0], ["pear", "apple", "kiwi"])
+
+    def test_run_batched_fails_only_malformed_words(self):
+        class Completions(FakeBatchCompletions):
+            # Batches never answer kiwi, and its single-word answer is malformed
+            async def create(self, **kwargs):
+                content = kwargs["messages"][1]["content"]
+                if content.startswith("Word: "):
+                    body = "{}" if "kiwi" in content else VALID
+                    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=body))],
+                                           usage=None)
+                words = [word for word in json.loads(content.replace("Words: ", "")) if word != "kiwi"]
+                kwargs["messages"] = [kwargs["messages"][0],
+                                      {"role": "user", "content": f"Words: {json.dumps(words + ['x'])}"}]
+                return await super().create(**kwargs)
+
+        engine = GenerationEngine(client=fake_client(Completions()), cache=DefinitionCache(), concurrency=2)
+        definitions, failed = asyncio.run(engine.run_batched(["pear", "kiwi", "apple"]))
+        self.assertEqual([d["word"] for d in definitions], ["apple", "pear"])
+        self.assertEqual(failed, ["kiwi"])
+
+    def test_run_batched_with_idle_workers(self):
+        completions = FakeBatchCompletions()
+        engine = GenerationEngine(client=fake_client(completions), cache=DefinitionCache(), concurrency=4)
+        self.assertEqual(asyncio.run(engine.run_batched([])), ([], []))
+        definitions, failed = asyncio.run(engine.run_batched(["pear", "apple", "kiwi"]))
+        self.assertEqual([d["word"] for d in definitions], ["apple", "kiwi", "pear"])
+        self.assertEqual(failed, [])
+
+    def test_run_batched_raises_on_result_errors(self):
+        def on_result(word, entries):
+            raise OSError("disk full")
+
+        engine = GenerationEngine(client=fake_client(FakeBatchCompletions()), cache=DefinitionCache(), concurrency=2)
+        with self.assertRaises(OSError):
+            asyncio.run(engine.run_batched(["pear", "apple"], on_result=on_result))
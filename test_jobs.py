@@ -0,0 +1,151 @@
+import json
+import unittest
+from unittest import mock
+
+import azure.functions as func
+
+from ai import generation_jobs
+from mocks.functions import Out, handler
+from mocks.table import InMemoryTableClient
+from vocard import jobs
+from vocard.jobs import record_item
+
+
+class FakeWorker:
+    fail_words = set()
+
+    def get_vocabulary_list(self, topic):
+        if topic in FakeWorker.fail_words:
+            raise RuntimeError("model unavailable")
+        return ["apple", "pear"]
+
+    def get_word_definition(self, word, context=None):
+        if word in FakeWorker.fail_words:
+            raise RuntimeError("model unavailable")
+        return {"definitions": [{"word": word, "partOfSpeech": "n.", "definition": f"A {word}."},
+                                {"word": word, "partOfSpeech": "v.", "definition": f"To {word}."}]}
+
+
+def message(body, dequeue_count=1):
+    return mock.Mock(get_json=mock.Mock(return_value=json.loads(body)), dequeue_count=dequeue_count)
+
+
+class TestGenerationJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.tables = {}
+        get_table_client = lambda name: self.tables.setdefault(name, InMemoryTableClient(name))
+        for patcher in [
+            mock.patch.object(generation_jobs, "get_table_client", side_effect=get_table_client),
+            mock.patch.object(generation_jobs, "get_table_service"),
+            mock.patch.object(generation_jobs, "VocabularyWorker", FakeWorker),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        FakeWorker.fail_words = set()
+
+    def create(self, body):
+        items = Out()
+        request = func.HttpRequest("POST", "/api/jobs/create", body=json.dumps(body).encode('utf-8'))
+        response = handler(generation_jobs.create_job)(request, items)
+        return response, items.value
+
+    def status(self, job_id):
+        request = func.HttpRequest("GET", f"/api/jobs/{job_id}", route_params={"jobId": job_id}, body=b"")
+        return json.loads(handler(generation_jobs.get_job)(request).get_body())
+
+    def process(self, queue_messages, dequeue_count=1):
+        produced = []
+        for body in queue_messages:
+            items = Out()
+            handler(generation_jobs.process_job_item)(message(body, dequeue_count), items)
+            produced += items.value or []
+        return produced
+
+    def test_topic_job_fans_out_and_in(self):
+        response, queued = self.create({"topic": "Food"})
+        self.assertEqual(response.status_code, 202)
+        job_id = json.loads(response.get_body())["jobId"]
+        word_messages = self.process(queued)
+        self.assertEqual(len(word_messages), 2)
+        self.assertEqual(self.status(job_id)["status"], "running")
+        self.process(word_messages)
+        # A redelivered item neither duplicates cards nor moves the counters again
+        self.process(word_messages[:1])
+        status = self.status(job_id)
+        self.assertEqual((status["status"], status["completed"], status["cards"], status["progress"]),
+                         ("completed", 2, 4, 1.0))
+        self.assertEqual(len(self.tables["Cards"]), 4)
+
+    def test_failed_items_are_retried_then_recorded(self):
+        FakeWorker.fail_words = {"kiwi"}
+        response, queued = self.create({"topic": "Food", "words": ["apple", "kiwi"]})
+        job_id = json.loads(response.get_body())["jobId"]
+        self.process(queued[:1])
+        with self.assertRaises(RuntimeError):
+            self.process(queued[1:])
+        self.process(queued[1:], dequeue_count=5)
+        status = self.status(job_id)
+        self.assertEqual((status["status"], status["completed"], status["failed"]), ("completed_with_errors", 1, 1))
+
+    def test_failed_word_list_fails_the_job(self):
+        FakeWorker.fail_words = {"Food"}
+        response, queued = self.create({"topic": "Food"})
+        job_id = json.loads(response.get_body())["jobId"]
+        with self.assertRaises(RuntimeError):
+            self.process(queued)
+        self.assertEqual(self.status(job_id)["status"], "queued")
+        self.assertEqual(self.process(queued, dequeue_count=5), [])
+        status = self.status(job_id)
+        self.assertEqual((status["status"], status["error"]), ("failed", "model unavailable"))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.create({"words": ["apple"]})[0].status_code, 400)
+        self.assertEqual(self.create({"topic": "Food", "words": "apple"})[0].status_code, 400)
+        request = func.HttpRequest("GET", "/api/jobs/missing", route_params={"jobId": "missing"}, body=b"")
+        self.assertEqual(handler(generation_jobs.get_job)(request).status_code, 404)
+
+
+class TestRecordItem(unittest.TestCase):
+
+    def test_concurrent_updates_are_not_lost(self):
+        from concurrent.futures import ThreadPoolExecutor
+        jobs_client, items_client = InMemoryTableClient("Jobs"), InMemoryTableClient("JobItems")
+        jobs_client.create_entity({"PartitionKey": "job", "RowKey": "1", "status": "queued", "total": 40,
+                                   "completed": 0, "failed": 0, "cards": 0})
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda i: record_item(jobs_client, items_client, "1", i, f"w{i}", cards=2), range(40)))
+        job = jobs_client.get_entity("job", "1")
+        self.assertEqual((job["completed"], job["cards"], job["status"]), (40, 80, "completed"))
+
+    def test_item_is_applied_when_job_update_ran_out_of_attempts(self):
+        jobs_client, items_client = InMemoryTableClient("Jobs"), InMemoryTableClient("JobItems")
+        jobs_client.create_entity({"PartitionKey": "job", "RowKey": "1", "status": "queued", "total": 2,
+                                   "completed": 0, "failed": 0, "cards": 0})
+        with mock.patch.object(jobs, "update_job", side_effect=RuntimeError("Could not update job 1")):
+            with self.assertRaises(RuntimeError):
+                record_item(jobs_client, items_client, "1", 0, "apple", cards=2)
+        # The redelivered message applies the stored item once, later deliveries are duplicates
+        self.assertTrue(record_item(jobs_client, items_client, "1", 0, "apple", cards=2))
+        self.assertFalse(record_item(jobs_client, items_client, "1", 0, "apple", cards=2))
+        record_item(jobs_client, items_client, "1", 1, "pear", cards=1)
+        job = jobs_client.get_entity("job", "1")
+        self.assertEqual((job["completed"], job["cards"], job["status"]), (2, 3, "completed"))
+
+    def test_double_counted_item_is_recounted_before_completion(self):
+        jobs_client, items_client = InMemoryTableClient("Jobs"), InMemoryTableClient("JobItems")
+        jobs_client.create_entity({"PartitionKey": "job", "RowKey": "1", "status": "queued", "total": 2,
+                                   "completed": 0, "failed": 0, "cards": 0})
+        record_item(jobs_client, items_client, "1", 0, "apple", cards=2)
+        # As if the job update succeeded but the applied flag was never written
+        items_client.update_entity({"PartitionKey": "1", "RowKey": "000000", "applied": False})
+        record_item(jobs_client, items_client, "1", 0, "apple", cards=2)
+        job = jobs_client.get_entity("job", "1")
+        self.assertEqual((job["completed"], job["cards"], job["status"]), (1, 2, "running"))
+        record_item(jobs_client, items_client, "1", 1, "pear", error=ValueError("no cards"))
+        job = jobs_client.get_entity("job", "1")
+        self.assertEqual((job["completed"], job["failed"], job["status"]), (1, 1, "completed_with_errors"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import base64
+import json
+import os
+import tempfile
+import unittest
+import urllib.parse
+from unittest import mock
+
+from azure.storage.blob import ContainerClient
+
+from checkpoint import JsonlCheckpoint
+from mocks.media_server import InMemoryMediaStore, MockMediaServer
+from vocard import media
+from vocard.media import BlobMediaStore, MediaError, MediaPipeline, fetch_audio, get_media_pipeline
+
+CLIP = b"ID3\x03\x00\x00\x00" + b"\x00" * 64
+
+
+class TestMediaPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockMediaServer(files={
+            "/uk/apple.mp3": ("audio/mpeg", CLIP),
+            "/us/apple.mp3": ("audio/mpeg", CLIP),
+            "/uk/pear.mp3": ("audio/mpeg", CLIP + b"pear"),
+            "/page.html": ("text/html", b"<html></html>"),
+        }, failures={"/uk/pear.mp3": 1}).start()
+        self.addCleanup(self.server.stop)
+        self.store = InMemoryMediaStore()
+        self.pipeline = MediaPipeline(self.store, concurrency=4, backoff=0.01)
+
+    def test_localize_rewrites_and_deduplicates(self):
+        url = self.server.url
+        cards = [
+            {"word": "apple", "pronUk": url("/uk/apple.mp3"), "pronUs": url("/us/apple.mp3")},
+            {"word": "apple", "pronUk": url("/uk/apple.mp3"), "pronUs": url("/missing.mp3")},
+            {"word": "pear", "pronUk": url("/uk/pear.mp3"), "pronUs": url("/page.html")},
+        ]
+        self.pipeline.localize(cards)
+        # The same clip behind two URLs is stored once
+        self.assertEqual(cards[0]["pronUk"], cards[0]["pronUs"])
+        self.assertTrue(cards[0]["pronUk"].startswith(self.store.base_url + "/audio/"))
+        self.assertTrue(cards[0]["pronUk"].endswith(".mp3"))
+        self.assertEqual(len(self.store.blobs), 2)
+        self.assertEqual(self.server.requests["/uk/apple.mp3"], 1)
+        # Invalid URLs are dropped, a transient failure is retried
+        self.assertNotIn("pronUs", cards[1])
+        self.assertNotIn("pronUs", cards[2])
+        self.assertTrue(cards[2]["pronUk"].startswith(self.store.base_url))
+        self.assertEqual(self.server.requests["/uk/pear.mp3"], 2)
+        self.assertEqual(self.pipeline.stats["invalid"], 2)
+        self.assertEqual(self.pipeline.stats["deduplicated"], 1)
+
+    def test_resolved_urls_are_not_fetched_again(self):
+        card = {"word": "apple", "pronUk": self.server.url("/uk/apple.mp3")}
+        self.pipeline.localize([card])
+        again = {"word": "apple", "pronUk": self.server.url("/uk/apple.mp3")}
+        self.pipeline.localize([again, dict(card)])
+        self.assertEqual(again["pronUk"], card["pronUk"])
+        self.assertEqual(self.server.requests["/uk/apple.mp3"], 1)
+        self.assertEqual(self.store.puts, 1)
+
+    def test_resolved_urls_are_bounded(self):
+        pipeline = MediaPipeline(self.store, max_resolved=1)
+        for word in ["apple", "pear"]:
+            pipeline.localize([{"word": word, "pronUk": self.server.url(f"/uk/{word}.mp3")}])
+        # apple was evicted by pear, so it is fetched again (and found in the store)
+        pipeline.localize([{"word": "apple", "pronUk": self.server.url("/uk/apple.mp3")}])
+        self.assertEqual(self.server.requests["/uk/apple.mp3"], 2)
+        self.assertEqual(self.store.puts, 2)
+
+    def test_transient_failures_keep_the_url_and_are_retried(self):
+        self.server.failures["/us/apple.mp3"] = 3
+        url = self.server.url("/us/apple.mp3")
+        card = {"word": "apple", "pronUs": url}
+        self.pipeline.localize([card])
+        self.assertEqual(card["pronUs"], url)
+        self.assertEqual(self.pipeline.stats["fetch_errors"], 1)
+        # Not remembered as invalid: the next call fetches it again, once the site has recovered
+        later = {"word": "apple", "pronUs": url}
+        self.pipeline.localize([later])
+        self.assertTrue(later["pronUs"].startswith(self.store.base_url))
+        self.assertEqual(self.server.requests["/us/apple.mp3"], 4)
+
+    def test_fetch_audio_validates_responses(self):
+        self.assertEqual(fetch_audio(self.server.url("/uk/apple.mp3")), (CLIP, "audio/mpeg"))
+        with self.assertRaises(MediaError) as error:
+            fetch_audio(self.server.url("/page.html"))
+        self.assertFalse(error.exception.transient)
+        with self.assertRaises(MediaError):
+            fetch_audio(self.server.url("/uk/apple.mp3"), max_bytes=8)
+
+    def test_checkpoint_compaction_localizes_each_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = JsonlCheckpoint(os.path.join(directory, "words.checkpoint.jsonl"))
+            for word in ["pear", "apple"]:
+                checkpoint.append(word, [{"word": word, "pronUk": self.server.url(f"/uk/{word}.mp3")}])
+            output = os.path.join(directory, "words.json")
+            checkpoint.compact(output, "Words", run_size=1, transform=self.pipeline.localize)
+            with open(output, encoding='utf-8') as f:
+                vocabularies = json.load(f)["vocabularies"]
+        self.assertEqual([v["word"] for v in vocabularies], ["apple", "pear"])
+        self.assertTrue(all(v["pronUk"].startswith(self.store.base_url) for v in vocabularies))
+
+
+
+class TestBlobMediaStore(unittest.TestCase):
+    ACCOUNT_KEY = base64.b64encode(b"key").decode()
+
+    def container(self, connection_string=None):
+        return ContainerClient.from_connection_string(
+            connection_string or f"DefaultEndpointsProtocol=https;AccountName=vocard;AccountKey={self.ACCOUNT_KEY};"
+                                 f"EndpointSuffix=core.windows.net", "decks")
+
+    def test_public_base_url(self):
+        store = BlobMediaStore(self.container(), "https://cdn.example.com/decks/")
+        self.assertEqual(store.url("audio/a.mp3"), "https://cdn.example.com/decks/audio/a.mp3")
+
+    def test_read_sas_url_without_public_base_url(self):
+        url = urllib.parse.urlparse(BlobMediaStore(self.container(), sas_ttl=60).url("module/basics/full.jsonl.gz"))
+        self.assertEqual(url.path, "/decks/module/basics/full.jsonl.gz")
+        query = urllib.parse.parse_qs(url.query)
+        self.assertEqual(query["sp"], ["r"])
+        self.assertIn("se", query)
+        self.assertIn("sig", query)
+
+    def test_private_container_needs_a_way_to_serve_blobs(self):
+        with self.assertRaises(ValueError):
+            BlobMediaStore(self.container())
+        with self.assertRaises(ValueError):
+            BlobMediaStore(self.container("DefaultEndpointsProtocol=https;AccountName=vocard;"
+                                          "SharedAccessSignature=sv=2024&sig=x;EndpointSuffix=core.windows.net"),
+                           sas_ttl=60)
+
+    def test_media_pipeline_requires_media_base_url(self):
+        with mock.patch.dict(os.environ, {"MediaContainer": "media"}), \
+                mock.patch.object(media, "_media_pipeline", None):
+            os.environ.pop("MediaBaseUrl", None)
+            with self.assertRaises(ValueError):
+                get_media_pipeline()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from vocard.model import Card, Module, Topic, ValidationError
+
+
+def card(**fields):
+    return dict({"topic": "Food", "word": "apple", "partOfSpeech": "n.", "definition": "A fruit."}, **fields)
+
+
+class TestCompiledValidation(unittest.TestCase):
+
+    def test_valid_records(self):
+        Card.validate(card(ipaUk="/ˈæp.əl/", partitionKey="food"))
+        Topic.validate({"module": "English", "title": "Food"})
+        Module.validate({"title": "English", "description": "Everyday English"})
+
+    def test_collects_every_error(self):
+        with self.assertRaises(ValidationError) as context:
+            Card.validate({"topic": "Food", "word": 1, "meaningVi": None})
+        errors = context.exception.errors
+        self.assertTrue(errors[0].startswith("Missing required keys"))
+        self.assertEqual(errors[1:], ["word must be a string", "meaningVi must be a string"])
+        self.assertIsInstance(context.exception, ValueError)
+
+    def test_partial_skips_required_keys(self):
+        Card.validate({"meaningVi": "quả táo"}, partial=True)
+        with self.assertRaises(ValueError):
+            Card.validate({"meaningVi": 1}, partial=True)
+
+    def test_rejects_non_objects(self):
+        self.assertEqual(Card.errors(["apple"]), ["Card must be a JSON object"])
+
+    def test_validate_many_reports_invalid_indexes(self):
+        records = [card(), card(definition=None), "apple", card(word="pear")]
+        self.assertEqual([index for index, _ in Card.validate_many(records)], [1, 2])
+
+    def test_slots_dataclass_keeps_unknown_keys_in_extra(self):
+        instance = Card.from_dict(card(PartitionKey="food"))
+        self.assertEqual(instance.word, "apple")
+        self.assertEqual(instance.extra, {"PartitionKey": "food"})
+        self.assertFalse(hasattr(instance, "__dict__"))
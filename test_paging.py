@@ -0,0 +1,33 @@
+import unittest
+
+from vocard.model import CARD_FIELDS
+from vocard.paging import decode_continuation_token, encode_continuation_token, parse_page_size, parse_select
+
+
+class TestPaging(unittest.TestCase):
+
+    def test_continuation_token_round_trip(self):
+        token = {"PartitionKey": "food", "RowKey": "1!28!ZmE-"}
+        encoded = encode_continuation_token(token)
+        self.assertNotIn("=", encoded)
+        self.assertEqual(decode_continuation_token(encoded), token)
+        self.assertIsNone(encode_continuation_token(None))
+        self.assertIsNone(decode_continuation_token(None))
+
+    def test_invalid_continuation_token(self):
+        with self.assertRaises(ValueError):
+            decode_continuation_token("not-a-token")
+
+    def test_select_always_includes_keys(self):
+        self.assertEqual(parse_select("word, definition", CARD_FIELDS),
+                         ["PartitionKey", "RowKey", "word", "definition"])
+        self.assertIsNone(parse_select(None, CARD_FIELDS))
+        with self.assertRaises(ValueError):
+            parse_select("word,password", CARD_FIELDS)
+
+    def test_page_size_bounds(self):
+        self.assertEqual(parse_page_size(None), 10)
+        self.assertEqual(parse_page_size("50"), 50)
+        for value in ("0", "1001", "ten"):
+            with self.assertRaises(ValueError):
+                parse_page_size(value)
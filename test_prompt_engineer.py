@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from prompt_engineer import (PROMPTS_DIR, Prompt, PromptRegistry, count_message_tokens, count_tokens, get_prompt,
+                             supports_structured_outputs)
+from vocabulary_worker import VocabularyWorker
+
+
+class TestPromptRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "greeting.txt")
+        self.write("Hello")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, content, mtime_ns=None):
+        with open(self.path, "w", encoding='utf-8') as f:
+            f.write(content)
+        if mtime_ns is not None:
+            os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+    def test_preloads_templates_with_hashes(self):
+        registry = PromptRegistry(self.tmp.name)
+        self.assertEqual(registry.get("Greeting").content(), "Hello")
+        self.assertEqual(registry.get("greeting").hash(), Prompt("greeting", "Hello").hash())
+        self.assertEqual(list(registry.hashes()), ["greeting"])
+
+    def test_reloads_changed_files(self):
+        registry = PromptRegistry(self.tmp.name, reload_interval=0)
+        before = registry.get("greeting").hash()
+        self.write("Hello again", mtime_ns=os.stat(self.path).st_mtime_ns + 10 ** 9)
+        self.assertEqual(registry.get("greeting").content(), "Hello again")
+        self.assertNotEqual(registry.get("greeting").hash(), before)
+
+    def test_default_registry_is_cwd_independent(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            self.assertTrue(get_prompt("get_word_definition").content())
+            self.assertEqual(Prompt("get_word_definition").hash(), get_prompt("get_word_definition").hash())
+        finally:
+            os.chdir(cwd)
+        self.assertTrue(os.path.isabs(PROMPTS_DIR))
+
+    def test_schema_sets_response_format(self):
+        schema = {"type": "object", "properties": {}, "required": [], "additionalProperties": False}
+        with open(os.path.join(self.tmp.name, "greeting.schema.json"), "w", encoding='utf-8') as f:
+            json.dump(schema, f)
+        prompt = PromptRegistry(self.tmp.name).get("greeting")
+        self.assertEqual(prompt.response_format(), {"type": "json_schema", "json_schema": {
+            "name": "greeting", "strict": True, "schema": schema}})
+        self.assertNotEqual(prompt.hash(), Prompt("greeting", "Hello").hash())
+        self.assertEqual(Prompt("greeting", "Hello").response_format(), {"type": "json_object"})
+
+
+class TestPromptVariants(unittest.TestCase):
+
+    def test_compact_variant_is_smaller(self):
+        model = "gpt-4o-mini"
+        full, full_messages = VocabularyWorker.definition_messages("contract", variant="full", model=model)
+        compact, compact_messages = VocabularyWorker.definition_messages("contract", "Law", variant="compact",
+                                                                         model=model)
+        self.assertEqual(compact.response_format(model)["type"], "json_schema")
+        # Billed prompt tokens, the schema sent as the response format included
+        self.assertLess(count_message_tokens(compact_messages, model) + compact.format_tokens(model),
+                        (count_message_tokens(full_messages, model) + full.format_tokens(model)) / 2)
+        self.assertLess(compact.tokens(model), full.tokens(model))
+        with self.assertRaises(ValueError):
+            VocabularyWorker.definition_messages("contract", variant="verbose")
+
+    def test_compact_variant_without_structured_outputs(self):
+        self.assertFalse(supports_structured_outputs("gpt-3.5-turbo"))
+        self.assertTrue(supports_structured_outputs("gpt-4o-mini"))
+        self.assertTrue(supports_structured_outputs("ft:gpt-4o-mini-2024-07-18:acme::abc"))
+        prompt, messages = VocabularyWorker.definition_messages("contract", variant="compact", model="gpt-3.5-turbo")
+        self.assertEqual(prompt.response_format("gpt-3.5-turbo"), {"type": "json_object"})
+        self.assertIn(json.dumps(prompt.schema(), separators=(",", ":")), messages[0]["content"])
+        _, structured = VocabularyWorker.definition_messages("contract", variant="compact", model="gpt-4o-mini")
+        self.assertEqual(structured[0]["content"], prompt.content())
+        # The schema is billed whether it is sent as the response format or in the instructions
+        self.assertGreater(prompt.tokens("gpt-4o-mini"), count_tokens(prompt.content(), "gpt-4o-mini"))
+        self.assertGreater(prompt.tokens("gpt-3.5-turbo"), count_tokens(prompt.content()))
+
+    def test_model_routing(self):
+        with mock.patch.dict(os.environ, {"OpenAIModel": "gpt-4o-mini", "OpenAIVocabularyListModel": "gpt-4o"}):
+            self.assertEqual(VocabularyWorker.model_for("get_word_definition"), "gpt-4o-mini")
+            self.assertEqual(VocabularyWorker.model_for("get_vocabulary_list"), "gpt-4o")
+            self.assertEqual(VocabularyWorker.model_for("get_vocabulary_list", "gpt-4.1"), "gpt-4.1")
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(VocabularyWorker.model_for("get_word_definition"), VocabularyWorker.MODEL)
@@ -0,0 +1,151 @@
+import datetime
+import json
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+import azure.functions as func
+
+import function_app
+from mocks.functions import handler
+from mocks.table import InMemoryTableClient
+from vocard import search
+from vocard.search import SearchIndex, build_search_index, fold
+
+
+def card(row_key, word, meaning_vi="", definition="", topic="Fruits"):
+    return {"PartitionKey": topic.lower(), "RowKey": row_key, "topic": topic, "word": word,
+            "meaningVi": meaning_vi, "definition": definition}
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.add(card("1", "apple", "quả táo", "A round fruit."))
+        self.index.add(card("2", "application", "ứng dụng", "A program.", topic="Tech"))
+        self.index.add(card("3", "pear", "quả lê", "A sweet fruit shaped like an apple."))
+        self.index.add(card("4", "road", "đường", "A way for travelling."))
+
+    def keys(self, results):
+        return [result["RowKey"] for result in results]
+
+    def test_fold_strips_vietnamese_diacritics(self):
+        self.assertEqual(fold("Quả Táo"), "qua tao")
+        self.assertEqual(fold("Đường"), "duong")
+
+    def test_search_ignores_diacritics(self):
+        self.assertEqual(self.keys(self.index.search("qua tao")), ["1"])
+        self.assertEqual(self.keys(self.index.search("duong")), ["4"])
+
+    def test_word_matches_rank_above_definition_matches(self):
+        self.assertEqual(self.keys(self.index.search("apple")), ["1", "3"])
+
+    def test_last_token_matches_as_prefix(self):
+        self.assertEqual(self.keys(self.index.search("app")), ["1", "2", "3"])
+        self.assertEqual(self.keys(self.index.search("app", topic_key="tech")), ["2"])
+        self.assertEqual(self.index.search("qu le"), [])
+        self.assertEqual(self.keys(self.index.search("qua l")), ["3"])
+
+    def test_suggest(self):
+        self.assertEqual(self.index.suggest("AP"), ["apple", "application"])
+        self.assertEqual(self.index.suggest("x"), [])
+
+    def test_remove_and_merge(self):
+        self.assertTrue(self.index.remove("fruits", "1"))
+        self.assertFalse(self.index.remove("fruits", "1"))
+        self.assertEqual(self.keys(self.index.search("tao")), [])
+        self.index.merge("fruits", "3", {"meaningVi": "trái lê"})
+        self.assertEqual(self.keys(self.index.search("trai")), ["3"])
+        self.assertEqual(self.index.search("qua"), [])
+        self.assertEqual(self.index.document("fruits", "3")["word"], "pear")
+        self.assertEqual(self.index.suggest("a"), ["application"])
+
+    def test_snapshot_round_trip(self):
+        self.index.remove("fruits", "1")
+        self.index.synced_at = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        loaded = SearchIndex.from_snapshot(self.index.to_snapshot())
+        self.assertEqual(len(loaded), 3)
+        self.assertEqual(loaded.synced_at, self.index.synced_at)
+        for query in ["app", "qua", "duong", "fruit"]:
+            self.assertEqual(loaded.search(query), self.index.search(query))
+        self.assertEqual(loaded.suggest("p"), ["pear"])
+        loaded.add(card("5", "apricot"))
+        self.assertEqual(self.keys(loaded.search("apr")), ["5"])
+
+    def test_refresh_picks_up_new_cards(self):
+        table_client = InMemoryTableClient("Cards")
+        table_client.create_entity(entity=card("1", "apple"))
+        index = build_search_index(table_client)
+        table_client.create_entity(entity=card("2", "banana"))
+        self.assertEqual(index.search("banana"), [])
+        index.refresh(table_client)
+        self.assertEqual(self.keys(index.search("banana")), ["2"])
+
+    def test_due_refresh_does_not_block_searches(self):
+        table_client = InMemoryTableClient("Cards")
+        table_client.create_entity(entity=card("1", "apple"))
+        search.replace_search_index(build_search_index(table_client))
+        self.addCleanup(search.replace_search_index, None)
+        table_client.create_entity(entity=card("2", "banana"))
+        release = threading.Event()
+        query_entities = table_client.query_entities
+
+        def slow_query(*args, **kwargs):
+            release.wait(5)
+            return query_entities(*args, **kwargs)
+
+        with mock.patch.dict(os.environ, {"SearchRefreshInterval": "0"}), \
+                mock.patch.object(table_client, "query_entities", side_effect=slow_query):
+            index = search.get_search_index(table_client)
+            # Served from the current index while the refresh waits on the table
+            self.assertEqual(self.keys(index.search("apple")), ["1"])
+            self.assertIs(search.get_search_index(table_client), index)
+            release.set()
+            for _ in range(100):
+                if not search._search_index_refreshing:
+                    break
+                time.sleep(0.01)
+        self.assertEqual(self.keys(index.search("banana")), ["2"])
+
+
+class TestSearchHandlers(unittest.TestCase):
+
+    def setUp(self):
+        self.table_client = InMemoryTableClient("Cards")
+        self.table_client.create_entity(entity=card("1", "apple", "quả táo"))
+        patcher = mock.patch.object(function_app, "get_table_client", return_value=self.table_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        search.replace_search_index(build_search_index(self.table_client))
+        self.addCleanup(search.replace_search_index, None)
+
+    def search(self, **params):
+        request = func.HttpRequest("GET", "/api/cards/search", body=b"", params=params)
+        return handler(function_app.search_cards)(request)
+
+    def test_search_endpoint(self):
+        response = self.search(q="táo")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c["word"] for c in json.loads(response.get_body())["cards"]], ["apple"])
+        self.assertEqual(self.search(q=" ").status_code, 400)
+        self.assertEqual(self.search(q="apple", limit="0").status_code, 400)
+
+    def test_card_writes_update_the_index(self):
+        body = {"topic": "Fruits", "word": "banana", "partOfSpeech": "noun", "definition": "A long fruit.",
+                "meaningVi": "quả chuối"}
+        request = func.HttpRequest("POST", "/api/cards/create", body=json.dumps(body).encode('utf-8'))
+        self.assertEqual(handler(function_app.create_new_card)(request).status_code, 200)
+        cards = json.loads(self.search(q="chuoi").get_body())["cards"]
+        self.assertEqual([c["word"] for c in cards], ["banana"])
+
+        request = func.HttpRequest("DELETE", "/api/cards/fruits/x/delete", body=b"",
+                                   route_params={"topicKey": cards[0]["PartitionKey"], "cardKey": cards[0]["RowKey"]})
+        self.assertEqual(handler(function_app.delete_card)(request).status_code, 200)
+        self.assertEqual(json.loads(self.search(q="chuoi").get_body())["cards"], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+from cache import DefinitionCache
+from mocks.table import InMemoryTableClient
+import singleflight
+from singleflight import SingleFlight, TableLease, get_definition_lease
+from vocabulary_worker import VocabularyWorker
+
+
+class SlowCompletions:
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def create(self, messages, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        content = json.dumps({"definitions": [{"word": "apple", "partOfSpeech": "n.", "definition": "A fruit."}]})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_share_one_execution(self):
+        flights = SingleFlight()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"value": 1}
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: flights.do("key", fn), range(8)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 7)
+        self.assertEqual(flights.coalesced, 7)
+        self.assertEqual(flights.in_flight(), 0)
+
+    def test_errors_are_shared_and_not_remembered(self):
+        flights = SingleFlight()
+
+        def fail():
+            time.sleep(0.1)
+            raise RuntimeError("boom")
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(flights.do, "key", fail) for _ in range(4)]
+        for future in futures:
+            self.assertIsInstance(future.exception(), RuntimeError)
+        self.assertEqual(flights.do("key", lambda: 2), (2, False))
+
+    def test_worker_coalesces_duplicate_definition_requests(self):
+        completions = SlowCompletions()
+        client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        worker = VocabularyWorker(cache=DefinitionCache(), client=client)
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(lambda _: worker.get_word_definition("apple", "Food"), range(10)))
+        self.assertEqual(completions.calls, 1)
+        self.assertTrue(all(result["definitions"][0]["word"] == "apple" for result in results))
+
+
+class TestTableLease(unittest.TestCase):
+
+    def test_lease_is_exclusive_until_released_or_expired(self):
+        table_client = InMemoryTableClient("Leases")
+        first = TableLease(table_client, duration=60, owner="a")
+        second = TableLease(table_client, duration=60, owner="b")
+        self.assertTrue(first.acquire("key"))
+        self.assertFalse(second.acquire("key"))
+        first.release("key")
+        self.assertTrue(second.acquire("key"))
+        expired = TableLease(table_client, duration=-1, owner="c")
+        self.assertTrue(expired.acquire("other"))
+        self.assertTrue(first.acquire("other"))
+        # The expired holder's release must not remove the new holder's lease
+        expired.release("other")
+        self.assertFalse(second.acquire("other"))
+
+    def test_run_waits_for_the_holders_result(self):
+        table_client = InMemoryTableClient("Leases")
+        holder = TableLease(table_client, owner="a")
+        waiter = TableLease(table_client, owner="b")
+        results = {}
+        self.assertTrue(holder.acquire("key"))
+
+        def finish():
+            time.sleep(0.2)
+            results["key"] = "done"
+            holder.release("key")
+
+        threading.Thread(target=finish).start()
+        self.assertEqual(waiter.run("key", lambda: "generated twice", lambda: results.get("key"), 0.05), "done")
+
+    def test_run_stops_waiting_after_max_wait(self):
+        table_client = InMemoryTableClient("Leases")
+        holder = TableLease(table_client, owner="a")
+        waiter = TableLease(table_client, owner="b", max_wait=0.2)
+        self.assertTrue(holder.acquire("key"))
+        start = time.monotonic()
+        self.assertEqual(waiter.run("key", lambda: "generated", lambda: None, 0.05), "generated")
+        self.assertLess(time.monotonic() - start, 1)
+
+
+class TestDefinitionLease(unittest.TestCase):
+
+    def test_disabled_without_a_shared_cache_backend(self):
+        settings = {"DefinitionLeaseTable": "Leases", "DefinitionCacheBackend": "sqlite"}
+        with mock.patch.dict("os.environ", settings), mock.patch.object(singleflight, "_definition_lease", None), \
+                mock.patch("clients.get_table_service") as get_table_service:
+            self.assertIsNone(get_definition_lease())
+        get_table_service.assert_not_called()
+
+    def test_enabled_with_the_table_backend(self):
+        settings = {"DefinitionLeaseTable": "Leases", "DefinitionCacheBackend": "table", "DefinitionLeaseMaxWait": "5"}
+        with mock.patch.dict("os.environ", settings), mock.patch.object(singleflight, "_definition_lease", None), \
+                mock.patch("clients.get_table_service"), \
+                mock.patch("clients.get_table_client", return_value=InMemoryTableClient("Leases")):
+            self.assertEqual(get_definition_lease().max_wait, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
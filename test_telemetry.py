@@ -0,0 +1,53 @@
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from telemetry import NOOP_TIMER, OPENAI, TABLE_IO, LogRecorder, Telemetry, _create_recorder
+
+
+class RecordingRecorder:
+    def __init__(self):
+        self.durations = []
+        self.tokens = []
+
+    def duration(self, stage, milliseconds, attributes):
+        self.durations.append((stage, milliseconds, attributes))
+
+    def token_usage(self, kind, amount, attributes):
+        self.tokens.append((kind, amount, attributes))
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_otel_without_exporter_falls_back_to_log(self):
+        with mock.patch.dict(os.environ, {"APPLICATIONINSIGHTS_CONNECTION_STRING": ""}):
+            self.assertIsInstance(_create_recorder("otel"), LogRecorder)
+        self.assertIsNone(_create_recorder("off"))
+
+    def test_stage_records_duration_and_errors(self):
+        recorder = RecordingRecorder()
+        telemetry = Telemetry(recorder)
+        with telemetry.stage(TABLE_IO, table="Cards"):
+            pass
+        with self.assertRaises(KeyError):
+            with telemetry.stage(TABLE_IO, table="Cards"):
+                raise KeyError("x")
+        self.assertEqual([(stage, attributes) for stage, _, attributes in recorder.durations],
+                         [(TABLE_IO, {"table": "Cards"}), (TABLE_IO, {"table": "Cards", "error": "KeyError"})])
+        self.assertTrue(all(milliseconds >= 0 for _, milliseconds, _ in recorder.durations))
+
+    def test_disabled_and_sampled_out_stages_are_noops(self):
+        self.assertIs(Telemetry(None).stage(OPENAI), NOOP_TIMER)
+        recorder = RecordingRecorder()
+        telemetry = Telemetry(recorder, sample_rate=0.0)
+        self.assertIs(telemetry.stage(OPENAI), NOOP_TIMER)
+        telemetry.record_duration(OPENAI, 0.5)
+        # Token usage is never sampled
+        telemetry.record_usage(SimpleNamespace(prompt_tokens=12, completion_tokens=30), model="m")
+        self.assertEqual(recorder.durations, [])
+        self.assertEqual(recorder.tokens, [("prompt", 12, {"model": "m"}), ("completion", 30, {"model": "m"})])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,59 +1,173 @@
 # This is Vocabulary Worker, an AI-powered Python script that can help users generate English vocabulary data.
+import argparse
 import asyncio
-import concurrent.futures
 import logging
-import multiprocessing
 import os
 import threading
 import datetime
-from openai import OpenAI
 import json
-from dotenv import load_dotenv
 
-from prompt_engineer import Prompt
+from cache import DefinitionCache, get_default_cache
+from clients import get_openai_client
+from dedup import VocabularyIndex
+from prompt_engineer import get_prompt
+from singleflight import SingleFlight, get_definition_lease
+from telemetry import JSON_PARSE, OPENAI, record_usage, stage
+from vocard.media import localize_media
+
+
+# Definition prompt variants: the templates used without and with a context. "compact" replaces the long
+# field list and worked example with a short instruction and a JSON schema response format.
+DEFINITION_VARIANTS = {
+    "full": ("get_word_definition", "get_word_definition_in_context"),
+    "compact": ("get_word_definition_compact", "get_word_definition_compact"),
+}
+# Settings that route an operation to a model other than OpenAIModel
+MODEL_SETTINGS = {
+    "get_word_definition": "OpenAIDefinitionModel",
+    "get_word_definitions": "OpenAIDefinitionModel",
+    "get_vocabulary_list": "OpenAIVocabularyListModel",
+}
+
+
+def parse_definitions(content):
+    # The {"definitions": [...]} answer of a definition completion. Raises ValueError for anything else, so
+    # that a malformed or empty answer is neither cached nor handed on.
+    try:
+        result = json.loads(content)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Answer is not JSON: {e}")
+    if not has_definitions(result):
+        raise ValueError("Answer has no definitions")
+    return result
+
+
+def has_definitions(result):
+    definitions = result.get("definitions") if isinstance(result, dict) else None
+    return isinstance(definitions, list) and bool(definitions) and all(isinstance(d, dict) for d in definitions)
 
 
 # Define a VocabularyWorker static class
 class VocabularyWorker:
     LOGGER = logging.getLogger(__name__)
+    MODEL = "gpt-3.5-turbo"
+    FLIGHTS = SingleFlight()
+
+    def __init__(self, cache=None, client=None):
+        self.client = client if client is not None else get_openai_client()
+        self.cache = cache if cache is not None else get_default_cache()
+
+    @staticmethod
+    def model_for(operation, model=None):
+        # An explicit model wins, then the operation's setting, then OpenAIModel, then MODEL
+        return model or os.environ.get(MODEL_SETTINGS.get(operation, "")) or os.environ.get("OpenAIModel") or \
+            VocabularyWorker.MODEL
+
+    @staticmethod
+    def definition_variant(variant=None):
+        variant = variant or os.environ.get("DefinitionPromptVariant", "full")
+        if variant not in DEFINITION_VARIANTS:
+            raise ValueError(f"Unknown definition prompt variant: {variant}")
+        return variant
+
+    @staticmethod
+    def definition_messages(word, context=None, variant=None, model=None):
+        # The instructions depend on the model the messages are sent to: see Prompt.instructions
+        plain, in_context = DEFINITION_VARIANTS[VocabularyWorker.definition_variant(variant)]
+        prompt = get_prompt(plain) if not context else get_prompt(in_context)
+        model = VocabularyWorker.model_for("get_word_definition", model)
+        messages = [
+            {"role": "system", "content": prompt.instructions(model)},
+            {"role": "user", "content": f"Word: {word}"} if not context else
+            {"role": "user", "content": f"Word: {word}, Context: {context}"}
+        ]
+        return prompt, messages
+
+    @staticmethod
+    def batch_definition_messages(words, context=None, model=None):
+        prompt = get_prompt("get_word_definitions_batch")
+        model = VocabularyWorker.model_for("get_word_definitions", model)
+        content = f"Words: {json.dumps(words, ensure_ascii=False)}"
+        if context:
+            content += f", Context: {context}"
+        messages = [
+            {"role": "system", "content": prompt.instructions(model)},
+            {"role": "user", "content": content}
+        ]
+        return prompt, messages
+
+    def get_word_definition(self, word, context=None, model=None, variant=None):
+        model = VocabularyWorker.model_for("get_word_definition", model)
+        prompt, messages = VocabularyWorker.definition_messages(word, context, variant, model)
+        cached = self._cached(word, context, prompt, model)
+        if cached is not None:
+            return cached
+        # Concurrent requests for the same word share one completion; with a lease table configured the
+        # coalescing extends across instances
+        key = DefinitionCache.make_key(word, context, prompt, model)
+        lease = get_definition_lease()
+
+        def generate_once():
+            if lease is None:
+                # A call that finished just before this one started has already filled the cache
+                cached = self._cached(word, context, prompt, model)
+                return cached if cached is not None else \
+                    self._generate_definition(word, context, prompt, messages, model)
+            return lease.run(key, lambda: self._generate_definition(word, context, prompt, messages, model),
+                             lambda: self._cached(word, context, prompt, model))
+
+        result, _ = VocabularyWorker.FLIGHTS.do(key, generate_once)
+        return result
+
+    def _cached(self, word, context, prompt, model):
+        # Entries cached before answers were checked may be malformed; those are generated again
+        cached = self.cache.get(word, context, prompt, model)
+        return cached if has_definitions(cached) else None
 
-    def __init__(self):
-        load_dotenv()
-        self.client = OpenAI()
-
-    def get_word_definition(self, word, context=None):
-        prompt = Prompt("get_word_definition") if not context else Prompt("get_word_definition_in_context")
-        # start time tracking
-        start_time = datetime.datetime.now()
-        completion = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": prompt.content()},
-                {"role": "user", "content": f"Word: {word}"} if not context else
-                {"role": "user", "content": f"Word: {word}, Context: {context}"}
-            ]
-        )
+    def _generate_definition(self, word, context, prompt, messages, model):
+        with stage(OPENAI, model=model, operation="get_word_definition"):
+            completion = self.client.chat.completions.create(
+                model=model,
+                response_format=prompt.response_format(model),
+                messages=messages
+            )
+        record_usage(completion.usage, model=model, operation="get_word_definition")
 
         json_string = completion.choices[0].message.content
-        return json.loads(json_string)
-
-    def get_vocabulary_list(self, topic):
-        prompt = Prompt("get_vocabulary_list")
-        completion = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": prompt.content()},
-                {"role": "user", "content": f"Theme: {topic}"}
-            ]
-        )
+        with stage(JSON_PARSE):
+            result = parse_definitions(json_string)
+        self.cache.set(word, context, prompt, model, result)
+        return result
+
+    def get_vocabulary_list(self, topic, model=None):
+        prompt = get_prompt("get_vocabulary_list")
+        model = VocabularyWorker.model_for("get_vocabulary_list", model)
+        with stage(OPENAI, model=model, operation="get_vocabulary_list"):
+            completion = self.client.chat.completions.create(
+                model=model,
+                response_format=prompt.response_format(model),
+                messages=[
+                    {"role": "system", "content": prompt.instructions(model)},
+                    {"role": "user", "content": f"Theme: {topic}"}
+                ]
+            )
+        record_usage(completion.usage, model=model, operation="get_vocabulary_list")
 
         # print(completion.choices[0].message)
         # extract the JSON string from the completion.choices[0].message
         json_string = completion.choices[0].message.content
         # convert the JSON string to a Python dictionary
-        return json.loads(json_string)["vocabularies"]
+        with stage(JSON_PARSE):
+            return json.loads(json_string)["vocabularies"]
+
+
+def generation_metadata(*prompt_names, model=None):
+    # Records which model and which prompt versions (content hashes) produced a generated file
+    return {
+        "model": VocabularyWorker.model_for("get_word_definition", model),
+        "prompts": {name: get_prompt(name).hash() for name in prompt_names},
+        "generatedAt": datetime.datetime.now(datetime.timezone.utc).isoformat()
+    }
 
 
 def write_data_to_file(data, filename, encoding='utf-8'):
@@ -66,79 +180,86 @@ def write_data_to_file(data, filename, encoding='utf-8'):
 
 def generate(topic):
     worker = VocabularyWorker()
-    words = worker.get_vocabulary_list(topic)
-    data = {"title": topic, "vocabularies": []}
+    index = VocabularyIndex()
+    words, skipped = index.filter_words(worker.get_vocabulary_list(topic))
+    if skipped:
+        VocabularyWorker.LOGGER.info(f"Skipping {len(skipped)} duplicate or inflected words: {skipped}")
+    data = {"title": topic, "metadata": generation_metadata("get_vocabulary_list", "get_word_definition_in_context"),
+            "vocabularies": []}
     for word in words:
         definitions = worker.get_word_definition(word, topic)["definitions"]
-        data["vocabularies"].extend(definitions)
+        data["vocabularies"].extend(index.add_all(definitions))
+    localize_media(data["vocabularies"])
     filename = f"{topic.replace(' ', '_').lower()}.json"
     thread = threading.Thread(target=write_data_to_file, args=(data, filename))
     thread.start()
 
 
-def add_element_to_list(lock, shared_list, word):
-    # Log the word being processed
-    print(f"Processing word: {word}")
-    start_time = datetime.datetime.now()
-    worker = VocabularyWorker()
-    word_definitions = worker.get_word_definition(word)
-    definitions = word_definitions["definitions"]
-    with lock:
-        shared_list.extend(definitions)
-        # Sort the shared_list by the word, alphabetically ascending
-        shared_list.sort(key=lambda x: x["word"])
-    end_time = datetime.datetime.now()
-    # Log the time taken to process the word
-    print(f"Time taken to process word: {word}: {end_time - start_time}")
-    return f'Added {word}'
-
-
-def generate_from_file(filename: str):
+def generate_from_file(filename: str, batched: bool = False):
+    from generation_engine import GenerationEngine
     path: str = f"input/{filename}"
     words = []
     with open(path, "r", encoding='utf-8') as f:
         json_data = json.load(f)
         title = filename.replace(".json", "").replace("_", " ").title()
         words = json_data["words"]
-    return_data = {"title": title, "vocabularies": []}
-    # queue = multiprocessing.Queue()
-    # processes = []
-    # for word in words:
-    #     process = multiprocessing.Process(target=add_element_to_list, args=(queue, word))
-    #     processes.append(process)
-    #     process.start()
-    # start_wait_time = datetime.datetime.now()
-    # for process in processes:
-    #     process.join()
-    # end_wait_time = datetime.datetime.now()
-    # print(f"Time taken to wait for all processes to finish: {end_wait_time - start_wait_time}")
-    # start_queue_check_out_time = datetime.datetime.now()
-    # while not queue.empty():
-    #     return_data["vocabularies"].append(queue.get())
-    # end_queue_check_out_time = datetime.datetime.now()
-    # print(f"Time taken to check out all elements from the queue: {end_queue_check_out_time - start_queue_check_out_time}")
-    # start_time = datetime.datetime.now()
-    # # Sort the vocabularies by the word, alphabetically ascending
-    # return_data["vocabularies"].sort(key=lambda x: x["word"])
-    # end_time = datetime.datetime.now()
-    # print(f"Time taken to sort the vocabularies: {end_time - start_time}")
-    lock = threading.Lock()
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(add_element_to_list, lock, return_data["vocabularies"], word) for word in words]
-
-        for future in concurrent.futures.as_completed(futures):
-            print(future.result())
-    # await asyncio.gather(*[add_element_to_list(return_data["vocabularies"], word) for word in words])
-    # for word in words:
-    #     definitions = worker.get_word_definition(word)["definitions"]
-    #     data["vocabularies"].extend(definitions)
-    #     processed_words += 1
-    #     completion_percentage = (processed_words / total_words) * 100
-    #     print(f"Completion: {completion_percentage:.2f}%")
-    return return_data
+    index = VocabularyIndex()
+    words, skipped = index.filter_words(words)
+    if skipped:
+        VocabularyWorker.LOGGER.info(f"Skipping {len(skipped)} duplicate or inflected words: {skipped}")
+    start_time = datetime.datetime.now()
+    engine = GenerationEngine()
+    definitions, failed = asyncio.run(engine.run_batched(words) if batched else engine.run(words))
+    definitions = localize_media(index.add_all(definitions))
+    end_time = datetime.datetime.now()
+    VocabularyWorker.LOGGER.info(f"Time taken to process {len(words)} words: {end_time - start_time}")
+    if failed:
+        VocabularyWorker.LOGGER.warning(f"Failed to define {len(failed)} words: {failed}")
+    prompt_name = "get_word_definitions_batch" if batched else "get_word_definition"
+    return {"title": title, "metadata": generation_metadata(prompt_name), "vocabularies": definitions}
+
+
+def generate_to_file(filename: str, batched: bool = False):
+    # Streaming, resumable counterpart of generate_from_file: every finished word is appended to
+    # output/<name>.checkpoint.jsonl, words already in the checkpoint are skipped on restart, and the
+    # checkpoint is then compacted into the sorted output/<name> file without loading it into memory
+    from checkpoint import JsonlCheckpoint
+    from generation_engine import GenerationEngine
+    with open(f"input/{filename}", "r", encoding='utf-8') as f:
+        words = json.load(f)["words"]
+    title = filename.replace(".json", "").replace("_", " ").title()
+    checkpoint = JsonlCheckpoint(f"output/{filename.replace('.json', '')}.checkpoint.jsonl")
+    # Seed the index with what earlier runs produced, so a resumed run deduplicates against it too
+    index = VocabularyIndex()
+    completed = set()
+    for record in checkpoint.records():
+        if record["word"] not in completed:
+            completed.add(record["word"])
+            index.add_all(record["definitions"])
+    remaining, skipped = index.filter_words([word for word in words if word not in completed])
+    if skipped:
+        VocabularyWorker.LOGGER.info(f"Skipping {len(skipped)} duplicate or inflected words: {skipped}")
+    VocabularyWorker.LOGGER.info(f"{len(completed)} words already checkpointed, {len(remaining)} remaining")
+
+    def on_result(word, definitions):
+        # Words whose senses were all duplicates are still checkpointed so that they are not redone
+        checkpoint.append(word, index.add_all(definitions))
+
+    engine = GenerationEngine()
+    run = engine.run_batched if batched else engine.run
+    _, failed = asyncio.run(run(remaining, on_result=on_result))
+    if failed:
+        VocabularyWorker.LOGGER.warning(f"Failed to define {len(failed)} words, re-run to retry them: {failed}")
+    prompt_name = "get_word_definitions_batch" if batched else "get_word_definition"
+    # Pronunciation audio is copied to the media store one sorted run at a time
+    count = checkpoint.compact(f"output/{filename}", title, metadata=generation_metadata(prompt_name),
+                               transform=localize_media)
+    VocabularyWorker.LOGGER.info(f"Wrote {count} definitions to output/{filename}")
+    return failed
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     # while True:
     #     topic = input("Enter a topic (leave empty to break): ")
     #     if not topic:
@@ -146,5 +267,15 @@ if __name__ == "__main__":
     #     thread1 = threading.Thread(target=generate, args=(topic,))
     #     thread1.start()
 
-    data = generate_from_file("oxford_3000_-_the_most_important_words_to_learn_in_english.json")
-    write_data_to_file(data, "oxford_3000_-_the_most_important_words_to_learn_in_english.json")
+    parser = argparse.ArgumentParser(description="Generate vocabulary definitions for a word list in input/")
+    parser.add_argument("filename", nargs="?",
+                        default="oxford_3000_-_the_most_important_words_to_learn_in_english.json")
+    parser.add_argument("--batched", action="store_true", help="define several words per completion")
+    parser.add_argument("--offline", action="store_true", help="submit the job through the Batch API")
+    parser.add_argument("--poll-interval", type=float, default=60, help="Batch API polling interval in seconds")
+    args = parser.parse_args()
+    if args.offline:
+        from batch_job import generate_with_batch_api
+        write_data_to_file(generate_with_batch_api(args.filename, poll_interval=args.poll_interval), args.filename)
+    else:
+        generate_to_file(args.filename, batched=args.batched)
@@ -0,0 +1,173 @@
+import datetime
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import UpdateMode
+
+from telemetry import TABLE_IO, stage
+
+LOGGER = logging.getLogger(__name__)
+
+# One row per topic key (the Cards partition), kept up to date by the card write handlers
+STATS_TABLE = "TopicStats"
+STATS_PARTITION = "topic"
+
+_table_created = False
+_table_lock = threading.Lock()
+
+
+def get_stats_table():
+    global _table_created
+    from clients import get_table_client, get_table_service
+    if not _table_created:
+        with _table_lock:
+            if not _table_created:
+                get_table_service().create_table_if_not_exists(STATS_TABLE)
+                _table_created = True
+    return get_table_client(STATS_TABLE)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def parts_of_speech(cards, sign: int = 1):
+    # Histogram delta for cards being added (sign=1) or removed (sign=-1)
+    counts = Counter()
+    for card in cards:
+        counts[card.get("partOfSpeech") or "unknown"] += sign
+    return counts
+
+
+def _apply(stats, count, histogram, stale):
+    merged = Counter(json.loads(stats.get("partsOfSpeech") or "{}"))
+    merged.update(histogram)
+    stats["cardCount"] = max(stats.get("cardCount", 0) + count, 0)
+    stats["partsOfSpeech"] = json.dumps({pos: n for pos, n in sorted(merged.items()) if n > 0}, ensure_ascii=False)
+    stats["lastModified"] = _now()
+    stats["stale"] = bool(stats.get("stale")) or stale
+    # Delta decks only list the current card ids when a card may have been deleted after their since
+    if count < 0 or "lastDeleted" not in stats:
+        stats["lastDeleted"] = stats["lastModified"]
+
+
+def update_topic_stats(table_client, topic_key, count: int = 0, histogram=None, stale: bool = False,
+                       max_attempts: int = 20):
+    # Read-modify-write of the topic's stats row with If-Match, retried when another writer got there
+    # first; the row is created on the topic's first card. stale marks a histogram that no longer matches
+    # the cards (a card was replaced or deleted without knowing its previous part of speech) until
+    # rebuild_topic_stats recounts it.
+    histogram = histogram or {}
+    for attempt in range(max_attempts):
+        try:
+            with stage(TABLE_IO, table=STATS_TABLE, operation="get_entity"):
+                current = table_client.get_entity(STATS_PARTITION, topic_key)
+        except ResourceNotFoundError:
+            # The topic may already have cards from before stats were kept, so a new row starts stale
+            stats = {"PartitionKey": STATS_PARTITION, "RowKey": topic_key}
+            _apply(stats, count, histogram, True)
+            try:
+                with stage(TABLE_IO, table=STATS_TABLE, operation="create_entity"):
+                    table_client.create_entity(entity=stats)
+                return stats
+            except ResourceExistsError:
+                continue
+        stats = {k: v for k, v in current.items() if k != "Timestamp"}
+        _apply(stats, count, histogram, stale)
+        try:
+            with stage(TABLE_IO, table=STATS_TABLE, operation="update_entity"):
+                table_client.update_entity(entity=stats, mode=UpdateMode.REPLACE, etag=current.metadata["etag"],
+                                           match_condition=MatchConditions.IfNotModified)
+            return stats
+        except (ResourceModifiedError, ResourceNotFoundError):
+            time.sleep(random.uniform(0, 0.05 * (attempt + 1)))
+    raise RuntimeError(f"Could not update stats of topic {topic_key} after {max_attempts} attempts")
+
+
+def record_card_changes(topic_key, count: int = 0, histogram=None, stale: bool = False):
+    # Called after a card write has succeeded; a failure here must not fail the write
+    try:
+        update_topic_stats(get_stats_table(), topic_key, count, histogram, stale)
+    except Exception as e:
+        LOGGER.warning(f"Failed to update stats of topic {topic_key}: {e}")
+
+
+def rebuild_topic_stats(cards_client, stats_client, topic_key, current=None):
+    # Recomputes a topic's stats from its cards, for stale rows (current) and topics created before stats
+    # were kept. The recount is only stored if no card write changed the row meanwhile.
+    stats = {"PartitionKey": STATS_PARTITION, "RowKey": topic_key, "cardCount": 0, "stale": False}
+    histogram = Counter()
+    last_modified = None
+    with stage(TABLE_IO, table=cards_client.table_name, operation="query_entities"):
+        for card in cards_client.query_entities(query_filter="PartitionKey eq @partition_key",
+                                                parameters={"partition_key": topic_key},
+                                                select=["partOfSpeech", "Timestamp"]):
+            stats["cardCount"] += 1
+            histogram[card.get("partOfSpeech") or "unknown"] += 1
+            timestamp = card.metadata.get("timestamp")
+            if timestamp is not None and (last_modified is None or timestamp > last_modified):
+                last_modified = timestamp
+    stats["partsOfSpeech"] = json.dumps(dict(sorted(histogram.items())), ensure_ascii=False)
+    stats["lastModified"] = last_modified.isoformat() if last_modified else _now()
+    # A recount cannot see deletions; without a previous row they may have happened at any time
+    stats["lastDeleted"] = current.get("lastDeleted") if current is not None and current.get("lastDeleted") else _now()
+    try:
+        if current is None:
+            with stage(TABLE_IO, table=STATS_TABLE, operation="create_entity"):
+                stats_client.create_entity(entity=stats)
+        else:
+            with stage(TABLE_IO, table=STATS_TABLE, operation="update_entity"):
+                stats_client.update_entity(entity=stats, mode=UpdateMode.REPLACE, etag=current.metadata["etag"],
+                                           match_condition=MatchConditions.IfNotModified)
+    except (ResourceExistsError, ResourceModifiedError, ResourceNotFoundError):
+        LOGGER.info(f"Stats of topic {topic_key} changed during the recount, it is left for the next read")
+    return stats
+
+
+def read_topic_stats(stats_client, topic_keys):
+    # Stats rows of the given topics in a single range query over the sorted keys
+    wanted = set(topic_keys)
+    if not wanted:
+        return {}
+    with stage(TABLE_IO, table=STATS_TABLE, operation="query_entities"):
+        rows = stats_client.query_entities(
+            query_filter="PartitionKey eq @partition_key and RowKey ge @first and RowKey le @last",
+            parameters={"partition_key": STATS_PARTITION, "first": min(wanted), "last": max(wanted)})
+        return {row["RowKey"]: row for row in rows if row["RowKey"] in wanted}
+
+
+def current_topic_stats(cards_client, stats_client, topic_keys):
+    # Stats rows of the given topics, recounting the stale and missing ones
+    stats = read_topic_stats(stats_client, topic_keys)
+    for topic_key in topic_keys:
+        current = stats.get(topic_key)
+        if current is None or current.get("stale"):
+            stats[topic_key] = rebuild_topic_stats(cards_client, stats_client, topic_key, current)
+    return stats
+
+
+def topic_aggregate(stats):
+    return {
+        "cardCount": stats.get("cardCount", 0),
+        "partsOfSpeech": json.loads(stats.get("partsOfSpeech") or "{}"),
+        "lastModified": stats.get("lastModified"),
+    }
+
+
+def module_aggregate(aggregates):
+    # Cards do not reference their module, so module totals are rolled up from the topic rows
+    histogram = Counter()
+    for aggregate in aggregates:
+        histogram.update(aggregate["partsOfSpeech"])
+    return {
+        "topicCount": len(aggregates),
+        "cardCount": sum(aggregate["cardCount"] for aggregate in aggregates),
+        "partsOfSpeech": dict(sorted(histogram.items())),
+        "lastModified": max((a["lastModified"] for a in aggregates if a["lastModified"]), default=None),
+    }
@@ -0,0 +1,129 @@
+import argparse
+import json
+import logging
+import time
+import uuid
+from itertools import groupby
+
+from azure.core.exceptions import HttpResponseError, ServiceRequestError
+from azure.data.tables import RequestTooLargeError, TableTransactionError
+
+from telemetry import TABLE_IO, VALIDATION, stage
+from vocard.model import Card, keyify
+
+LOGGER = logging.getLogger(__name__)
+
+# Entity group transactions accept at most 100 operations, all in the same partition
+MAX_TRANSACTION_SIZE = 100
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def normalize_generated_card(definition, topic):
+    # Generated definitions carry no topic, and the plain prompt names the example field "example sentence",
+    # which is not a valid Table property name
+    card = dict(definition)
+    if "example sentence" in card:
+        card.setdefault("exampleSentence", card.pop("example sentence"))
+    card["topic"] = topic
+    return card
+
+
+def _is_transient(error):
+    if isinstance(error, ServiceRequestError):
+        return True
+    return getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES
+
+
+def _submit_chunk(table_client, chunk, report, max_retries, operation="create"):
+    # chunk is a list of (index, entity) in a single partition; failing operations are dropped one by one
+    # and the rest of the chunk is resubmitted, transient failures are retried with exponential backoff
+    attempt = 0
+    pending = [chunk]
+    while pending:
+        items = pending.pop()
+        try:
+            with stage(TABLE_IO, operation="submit_transaction"):
+                table_client.submit_transaction([(operation, entity) for _, entity in items])
+        except RequestTooLargeError:
+            if len(items) == 1:
+                report[items[0][0]].update(status="failed", error="Entity is too large")
+            else:
+                middle = len(items) // 2
+                pending.extend([items[middle:], items[:middle]])
+        except TableTransactionError as e:
+            if _is_transient(e) and attempt < max_retries:
+                attempt += 1
+                time.sleep(2 ** attempt / 10)
+                pending.append(items)
+                continue
+            index = e.index if 0 <= e.index < len(items) else 0
+            report[items[index][0]].update(status="failed", error=e.message)
+            rest = items[:index] + items[index + 1:]
+            if rest:
+                pending.append(rest)
+        except (HttpResponseError, ServiceRequestError) as e:
+            if _is_transient(e) and attempt < max_retries:
+                attempt += 1
+                time.sleep(2 ** attempt / 10)
+                pending.append(items)
+                continue
+            for index, _ in items:
+                report[index].update(status="failed", error=str(e))
+        else:
+            for index, _ in items:
+                report[index]["status"] = "created"
+
+
+def bulk_import_cards(table_client, cards, max_retries: int = 3, upsert: bool = False):
+    # Validates every card, groups them by PartitionKey (the keyified topic) and writes each group with
+    # entity group transactions of up to MAX_TRANSACTION_SIZE operations.
+    # Cards get a random RowKey unless they carry a rowKey; with upsert, writing the same keyed cards again
+    # replaces them instead of failing, which makes retried imports idempotent.
+    # Returns one report entry per input card, in input order.
+    report = []
+    entities = []
+    with stage(VALIDATION, model="Card", operation="bulk_import_cards"):
+        invalid = dict(Card.validate_many(cards))
+    for index, card in enumerate(cards):
+        if index in invalid:
+            report.append({"index": index, "status": "invalid", "error": "; ".join(invalid[index])})
+            continue
+        entity = {k: v for k, v in card.items() if k != 'rowKey'}
+        entity.update(PartitionKey=keyify(card['topic']), RowKey=card.get('rowKey') or str(uuid.uuid4()))
+        report.append({"index": index, "status": "pending", "PartitionKey": entity["PartitionKey"],
+                       "RowKey": entity["RowKey"]})
+        entities.append((index, entity))
+    entities.sort(key=lambda item: item[1]["PartitionKey"])
+    for _, group in groupby(entities, key=lambda item: item[1]["PartitionKey"]):
+        group = list(group)
+        for start in range(0, len(group), MAX_TRANSACTION_SIZE):
+            _submit_chunk(table_client, group[start:start + MAX_TRANSACTION_SIZE], report, max_retries,
+                          "upsert" if upsert else "create")
+    return report
+
+
+def summarize(report):
+    summary = {"created": 0, "invalid": 0, "failed": 0}
+    for item in report:
+        summary[item["status"]] = summary.get(item["status"], 0) + 1
+    return summary
+
+
+if __name__ == "__main__":
+    # Import a file written by vocabulary_worker (generate_from_file / generate_to_file) into the Cards table
+    from clients import get_table_client
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Import generated vocabularies into the Cards table")
+    parser.add_argument("path", help="generated {title, vocabularies} JSON file")
+    parser.add_argument("--topic", help="topic of the imported cards, defaults to the file title")
+    args = parser.parse_args()
+    with open(args.path, "r", encoding='utf-8') as f:
+        data = json.load(f)
+    topic = args.topic or data["title"]
+    result = bulk_import_cards(get_table_client("Cards"),
+                               [normalize_generated_card(d, topic) for d in data["vocabularies"]])
+    LOGGER.info(f"Imported {args.path} into topic {keyify(topic)}: {summarize(result)}")
+    for item in result:
+        if item["status"] != "created":
+            LOGGER.warning(f"Card {item['index']} {item['status']}: {item.get('error')}")
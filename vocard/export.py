@@ -0,0 +1,238 @@
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+
+from singleflight import SingleFlight
+from telemetry import SERIALIZATION, TABLE_IO, stage
+from vocard.model import CARD_FIELDS
+from vocard.search import entity_timestamp
+
+LOGGER = logging.getLogger(__name__)
+
+# Bumped whenever the layout of a deck file changes, so clients can refuse decks they cannot read
+DECK_FORMAT_VERSION = 1
+# format -> (file extension, content type)
+DECK_FORMATS = {
+    "jsonl": ("jsonl.gz", "application/gzip"),
+    "sqlite": ("sqlite", "application/vnd.sqlite3"),
+}
+DECK_SCOPES = ("topic", "module")
+DECK_FIELDS = tuple(field for field in CARD_FIELDS if field != "Timestamp")
+# Cards written while an export runs can carry a Timestamp slightly before its start
+CLOCK_SKEW = datetime.timedelta(seconds=60)
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def deck_version(stats, topic_keys):
+    # Changes whenever a card of one of the topics is written, derived from the topic stats rows
+    digest = hashlib.sha1()
+    for topic_key in sorted(topic_keys):
+        row = stats.get(topic_key, {})
+        digest.update(f"{topic_key}/{row.get('cardCount')}/{row.get('lastModified')};".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def deck_name(scope, key, version, fmt, since=None):
+    # Decks are immutable: a name is only ever written once, with the cards of that version. Deltas are
+    # named by their quantized since, see quantize_since.
+    kind = "full" if since is None else f"since-{since.strftime('%Y%m%dT%H%M%SZ')}"
+    return f"{scope}/{key}/{version}/{kind}.{DECK_FORMATS[fmt][0]}"
+
+
+def quantize_since(since, interval: float = None):
+    # Floors since to DeckDeltaInterval seconds (default an hour), so that every device that synced within
+    # the same interval is served the same delta blob. The earlier since only makes the delta a superset;
+    # devices replace the cards it repeats by id.
+    if since is None:
+        return None
+    interval = interval or float(os.environ.get("DeckDeltaInterval", 3600))
+    return EPOCH + datetime.timedelta(seconds=(since - EPOCH).total_seconds() // interval * interval)
+
+
+def has_deletions(stats, topic_keys, since):
+    # Whether a card of the topics may have been deleted after since, from the lastDeleted of their stats
+    # rows (rows written before deletions were tracked have none). Without deletions a delta needs no list
+    # of current card ids, which saves a key scan of every partition.
+    for topic_key in topic_keys:
+        last_deleted = stats.get(topic_key, {}).get("lastDeleted")
+        if not last_deleted or parse_since(last_deleted) >= since:
+            return True
+    return False
+
+
+def parse_since(value):
+    if not value:
+        return None
+    try:
+        since = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError("since must be an ISO 8601 timestamp")
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    return since.astimezone(datetime.timezone.utc)
+
+
+def card_record(entity):
+    record = {"topicKey": entity["PartitionKey"], "id": entity["RowKey"]}
+    record.update((field, entity[field]) for field in DECK_FIELDS if entity.get(field) is not None)
+    timestamp = entity_timestamp(entity)
+    if timestamp is not None:
+        record["updatedAt"] = timestamp.isoformat()
+    return record
+
+
+def read_cards(table_client, topic_keys, since=None):
+    # Streams the cards of the topics, one partition query each; with since only the cards written after it
+    query_filter = "PartitionKey eq @partition_key"
+    if since is not None:
+        query_filter += " and Timestamp gt @since"
+    for topic_key in topic_keys:
+        with stage(TABLE_IO, table=table_client.table_name, operation="query_entities"):
+            entities = table_client.query_entities(query_filter=query_filter,
+                                                   parameters={"partition_key": topic_key, "since": since},
+                                                   select=["PartitionKey", "RowKey", *CARD_FIELDS])
+            for entity in entities:
+                yield entity
+
+
+def read_card_ids(table_client, topic_keys):
+    # Keys of every current card; delta decks carry them so that devices can drop deleted cards
+    ids = []
+    for topic_key in topic_keys:
+        with stage(TABLE_IO, table=table_client.table_name, operation="query_entities"):
+            ids.extend(f"{entity['PartitionKey']}/{entity['RowKey']}" for entity in table_client.query_entities(
+                query_filter="PartitionKey eq @partition_key", parameters={"partition_key": topic_key},
+                select=["PartitionKey", "RowKey"]))
+    return ids
+
+
+def _write_jsonl(path, header, records, ids):
+    # One JSON object per line: the header, the cards, then the current card ids of a delta deck
+    with gzip.open(path, "wt", encoding='utf-8', compresslevel=6) as f:
+        f.write(json.dumps(header, ensure_ascii=False, separators=(",", ":")) + "\n")
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        if ids is not None:
+            f.write(json.dumps({"ids": ids}, separators=(",", ":")) + "\n")
+
+
+def _write_sqlite(path, header, records, ids):
+    connection = sqlite3.connect(path)
+    try:
+        columns = ("topicKey", "id") + DECK_FIELDS + ("updatedAt",)
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute(f"CREATE TABLE cards ({', '.join(columns)}, PRIMARY KEY (topicKey, id))")
+        connection.executemany("INSERT INTO cards VALUES (" + ", ".join("?" * len(columns)) + ")",
+                               ([record.get(column) for column in columns] for record in records))
+        if ids is not None:
+            connection.execute("CREATE TABLE current_ids (id TEXT PRIMARY KEY)")
+            connection.executemany("INSERT INTO current_ids VALUES (?)", ((card_id,) for card_id in ids))
+        # Built after the inserts, which is faster than maintaining them row by row
+        connection.execute("CREATE INDEX cards_word ON cards (word COLLATE NOCASE)")
+        connection.execute("CREATE INDEX cards_updated_at ON cards (updatedAt)")
+        connection.executemany("INSERT INTO meta VALUES (?, ?)",
+                               [(key, json.dumps(value, ensure_ascii=False)) for key, value in header.items()])
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def write_deck(path, table_client, scope, key, topic_keys, version, fmt="jsonl", since=None, with_ids=True):
+    # Streams the cards into a deck file at path and returns its header. syncedAt is what the device passes
+    # as since for its next delta; it is taken before the scan (less the clock skew), so a card written
+    # while the export runs is in that delta even if this deck missed it. A delta lists the current card
+    # ids (hasIds) unless with_ids is False because no card was deleted since.
+    synced_at = datetime.datetime.now(datetime.timezone.utc) - CLOCK_SKEW
+    ids = read_card_ids(table_client, topic_keys) if since is not None and with_ids else None
+    header = {
+        "format": "vocard-deck",
+        "formatVersion": DECK_FORMAT_VERSION,
+        "scope": scope,
+        "key": key,
+        "topics": list(topic_keys),
+        "version": version,
+        "since": since.isoformat() if since is not None else None,
+        "hasIds": ids is not None,
+        "syncedAt": synced_at.isoformat(),
+        "generatedAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    records = (card_record(entity) for entity in read_cards(table_client, topic_keys, since))
+    with stage(SERIALIZATION, format=fmt):
+        if fmt == "sqlite":
+            _write_sqlite(path, header, records, ids)
+        else:
+            _write_jsonl(path, header, records, ids)
+    return header
+
+
+_flights = SingleFlight()
+
+
+def publish_deck(store, table_client, scope, key, topic_keys, version, fmt="jsonl", since=None, with_ids=True):
+    # Returns the URL of the deck, building and uploading it only if this version was never exported.
+    # since is expected to be quantized; with_ids must follow from version and since (see has_deletions).
+    name = deck_name(scope, key, version, fmt, since)
+
+    def build():
+        if store.exists(name):
+            return store.url(name)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "deck")
+            header = write_deck(path, table_client, scope, key, topic_keys, version, fmt, since, with_ids)
+            with open(path, "rb") as f:
+                store.put(name, f.read(), DECK_FORMATS[fmt][1])
+        LOGGER.info(f"Exported deck {name} synced at {header['syncedAt']}")
+        return store.url(name)
+
+    url, _ = _flights.do(name, build)
+    return url
+
+
+def prune_decks(store, max_age: datetime.timedelta = None):
+    # Deletes the decks of every version that was superseded more than max_age (DeckRetentionHours, default
+    # a day) ago, so that a device still downloading one has time to finish. The latest version of each topic or module is always kept, and a
+    # pruned deck that is asked for again is simply rebuilt. Returns the number of deleted blobs.
+    max_age = max_age or datetime.timedelta(hours=float(os.environ.get("DeckRetentionHours", 24)))
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - max_age
+    versions = {}
+    for name, last_modified in store.list():
+        if name.count("/") < 3:
+            continue
+        deck, version, _ = name.rsplit("/", 2)
+        blobs = versions.setdefault(deck, {}).setdefault(version, [])
+        blobs.append((name, last_modified))
+    deleted = 0
+    for deck_versions in versions.values():
+        # A version is superseded when the first blob of the next one is written
+        created = sorted((min(t for _, t in blobs), version) for version, blobs in deck_versions.items())
+        for (_, version), (superseded_at, _) in zip(created, created[1:]):
+            if superseded_at < cutoff:
+                for name, _ in deck_versions[version]:
+                    store.delete(name)
+                    deleted += 1
+    return deleted
+
+
+_deck_store = None
+_deck_store_lock = threading.Lock()
+
+
+def get_deck_store():
+    # Blob container DeckContainer (default "decks"), served from DeckBaseUrl (a CDN endpoint) when set and
+    # otherwise through read-only SAS URLs valid for DeckUrlTtl seconds (default an hour)
+    global _deck_store
+    if _deck_store is None:
+        with _deck_store_lock:
+            if _deck_store is None:
+                from clients import get_blob_service
+                from vocard.media import BlobMediaStore
+                _deck_store = BlobMediaStore(
+                    get_blob_service().get_container_client(os.environ.get("DeckContainer", "decks")),
+                    os.environ.get("DeckBaseUrl"), sas_ttl=float(os.environ.get("DeckUrlTtl", 3600)))
+    return _deck_store
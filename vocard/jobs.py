@@ -0,0 +1,164 @@
+import datetime
+import json
+import logging
+import random
+import time
+import uuid
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+from azure.data.tables import UpdateMode
+
+LOGGER = logging.getLogger(__name__)
+
+JOBS_TABLE = "Jobs"
+JOB_ITEMS_TABLE = "JobItems"
+JOB_PARTITION = "job"
+QUEUE_NAME = "generation-items"
+MAX_JOB_WORDS = 5000
+# extensions.queues.maxDequeueCount in host.json: the last delivery of a failing item records it as failed
+MAX_DEQUEUE_COUNT = 5
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def new_job(topic, words=None):
+    # Jobs created without words start with an expand item that asks the model for the topic's word list
+    return {
+        "PartitionKey": JOB_PARTITION,
+        "RowKey": uuid.uuid4().hex,
+        "topic": topic,
+        "status": "queued",
+        "total": len(words) if words else 0,
+        "completed": 0,
+        "failed": 0,
+        "cards": 0,
+        "createdAt": _now().isoformat(),
+    }
+
+
+def expand_item(job_id, topic):
+    return json.dumps({"jobId": job_id, "topic": topic})
+
+
+def word_items(job_id, topic, words):
+    # One queue message per word, so the work is spread over every instance the queue trigger scales to
+    return [json.dumps({"jobId": job_id, "topic": topic, "index": index, "word": word}, ensure_ascii=False)
+            for index, word in enumerate(words)]
+
+
+def card_row_key(job_id, index, sense):
+    # Deterministic, so that a redelivered work item overwrites its own cards instead of duplicating them
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"vocard:{job_id}:{index}:{sense}"))
+
+
+def update_job(table_client, job_id, change, max_attempts: int = 20):
+    # Read-modify-write of the job entity with If-Match, retried when another worker updated it first.
+    # change(job) mutates the entity in place; returns the updated job.
+    for attempt in range(max_attempts):
+        job = table_client.get_entity(JOB_PARTITION, job_id)
+        etag = job.metadata["etag"]
+        job = {k: v for k, v in job.items() if k != "Timestamp"}
+        change(job)
+        job["updatedAt"] = _now().isoformat()
+        try:
+            table_client.update_entity(entity=job, mode=UpdateMode.REPLACE, etag=etag,
+                                       match_condition=MatchConditions.IfNotModified)
+            return job
+        except ResourceModifiedError:
+            time.sleep(random.uniform(0, 0.05 * (attempt + 1)))
+    raise RuntimeError(f"Could not update job {job_id} after {max_attempts} attempts")
+
+
+def _finish_if_done(job):
+    if job["total"] and job["completed"] + job["failed"] >= job["total"]:
+        job["status"] = "completed" if not job["failed"] else "completed_with_errors"
+    elif job["status"] == "queued":
+        job["status"] = "running"
+
+
+def set_total(table_client, job_id, total):
+    def change(job):
+        job["total"] = total
+        if not total:
+            job["status"] = "completed"
+        else:
+            _finish_if_done(job)
+    return update_job(table_client, job_id, change)
+
+
+def fail_job(table_client, job_id, error):
+    # A job whose word list could not be generated has nothing left to run
+    def change(job):
+        job["status"] = "failed"
+        job["error"] = str(error)[:1024]
+    return update_job(table_client, job_id, change)
+
+
+def count_items(items_client, job_id):
+    # Exact counters of a job from its JobItems rows, one row per recorded item
+    counts = {"completed": 0, "failed": 0, "cards": 0}
+    for item in items_client.query_entities(query_filter="PartitionKey eq @job_id", parameters={"job_id": job_id},
+                                            select=["status", "cards"]):
+        counts[item["status"]] += 1
+        counts["cards"] += item.get("cards") or 0
+    return counts
+
+
+def record_item(jobs_client, items_client, job_id, index, word, cards=0, error=None):
+    # Fan-in: every work item is recorded once in JobItems, and only the first record of an item moves the
+    # job's counters, so redelivered queue messages are not counted twice. Returns False for duplicates.
+    # The item row is written with applied=False and flagged once the job update succeeded: when that update
+    # ran out of attempts, the redelivered message applies the stored item instead of skipping it.
+    row_key = f"{index:06d}"
+    item = {"PartitionKey": job_id, "RowKey": row_key, "word": word,
+            "status": "failed" if error else "completed", "cards": cards, "applied": False}
+    if error:
+        item["error"] = str(error)[:1024]
+    try:
+        items_client.create_entity(entity=item)
+    except ResourceExistsError:
+        item = items_client.get_entity(job_id, row_key)
+        # Rows written before the flag existed were applied with their insert
+        if item.get("applied", True):
+            LOGGER.info(f"Job {job_id} item {index} ({word}) was already recorded")
+            return False
+        LOGGER.info(f"Job {job_id} item {index} ({word}) was recorded but not applied, applying it now")
+
+    def change(job):
+        job[item["status"]] += 1
+        job["cards"] += item.get("cards") or 0
+        _finish_if_done(job)
+    job = update_job(jobs_client, job_id, change)
+    items_client.update_entity(entity={"PartitionKey": job_id, "RowKey": row_key, "applied": True},
+                               mode=UpdateMode.MERGE)
+    if job["status"] in ("completed", "completed_with_errors"):
+        # A crash between the job update and the flag can count an item twice; before a job is reported
+        # done its counters are recounted from JobItems. The count runs inside the If-Match update, so an
+        # item recorded meanwhile changes the etag and the recount is redone.
+        def reconcile(job):
+            job.update(count_items(items_client, job_id))
+            if job["status"] != "failed":
+                job["status"] = "running"
+                _finish_if_done(job)
+        update_job(jobs_client, job_id, reconcile)
+    return True
+
+
+def job_status(job):
+    done = job.get("completed", 0) + job.get("failed", 0)
+    return {
+        "jobId": job["RowKey"],
+        "topic": job.get("topic"),
+        "status": job.get("status"),
+        "total": job.get("total", 0),
+        "completed": job.get("completed", 0),
+        "failed": job.get("failed", 0),
+        "cards": job.get("cards", 0),
+        "progress": round(done / job["total"], 4) if job.get("total") else 0.0,
+        "createdAt": job.get("createdAt"),
+        "updatedAt": job.get("updatedAt"),
+        "error": job.get("error"),
+    }
@@ -0,0 +1,253 @@
+import datetime
+import hashlib
+import logging
+import os
+import posixpath
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import LRUCache
+from singleflight import SingleFlight
+
+LOGGER = logging.getLogger(__name__)
+
+# Card fields holding pronunciation audio URLs
+AUDIO_FIELDS = ("pronUk", "pronUs")
+AUDIO_EXTENSIONS = {"audio/mpeg": ".mp3", "audio/mp3": ".mp3", "audio/ogg": ".ogg", "audio/wav": ".wav",
+                    "audio/x-wav": ".wav", "audio/mp4": ".m4a", "audio/aac": ".aac"}
+# Pronunciation clips are a few kilobytes; anything much larger is not one
+MAX_MEDIA_BYTES = 2 * 1024 * 1024
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Blobs are named by their content hash, so they never change once written
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+USER_AGENT = "Mozilla/5.0 (compatible; vocard-media/1.0)"
+
+
+class MediaError(Exception):
+    def __init__(self, message, transient: bool = False):
+        super().__init__(message)
+        self.transient = transient
+
+
+def fetch_audio(url, timeout: float = 10.0, max_bytes: int = MAX_MEDIA_BYTES):
+    # Downloads url and checks that it is an audio file; returns (data, content_type) or raises MediaError
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT, "Accept": "audio/*"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            content_type = (response.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+            data = response.read(max_bytes + 1)
+    except urllib.error.HTTPError as e:
+        raise MediaError(f"HTTP {e.code}", transient=e.code in TRANSIENT_STATUS_CODES)
+    except (urllib.error.URLError, OSError) as e:
+        raise MediaError(str(getattr(e, "reason", e)), transient=True)
+    if not content_type.startswith("audio/") and content_type != "application/octet-stream":
+        raise MediaError(f"Unexpected content type {content_type or 'none'}")
+    if not data:
+        raise MediaError("Empty response")
+    if len(data) > max_bytes:
+        raise MediaError(f"Larger than {max_bytes} bytes")
+    return data, content_type
+
+
+def media_name(data, url, content_type):
+    extension = posixpath.splitext(urllib.parse.urlparse(url).path)[1].lower()
+    if extension not in AUDIO_EXTENSIONS.values():
+        extension = AUDIO_EXTENSIONS.get(content_type, ".mp3")
+    return f"audio/{hashlib.sha256(data).hexdigest()}{extension}"
+
+
+class BlobMediaStore:
+    # Media files in a private blob container. URLs point at public_base_url (a CDN endpoint with access to
+    # the container) when one is given, otherwise they carry a read-only SAS token valid for sas_ttl seconds.
+    def __init__(self, container_client, public_base_url: str = None, sas_ttl: float = None):
+        if not public_base_url:
+            if not sas_ttl:
+                raise ValueError("Blobs of a private container need a public base URL or a SAS lifetime")
+            if not getattr(container_client.credential, "account_key", None):
+                raise ValueError("SAS URLs need a storage account key in the connection string")
+        self.container_client = container_client
+        self.public_base_url = public_base_url.rstrip("/") if public_base_url else None
+        self.sas_ttl = sas_ttl
+
+    def exists(self, name):
+        return self.container_client.get_blob_client(name).exists()
+
+    def put(self, name, data, content_type):
+        from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+        from azure.storage.blob import ContentSettings
+        settings = ContentSettings(content_type=content_type, cache_control=CACHE_CONTROL)
+        blob_client = self.container_client.get_blob_client(name)
+        try:
+            blob_client.upload_blob(data, overwrite=True, content_settings=settings)
+        except ResourceNotFoundError:
+            try:
+                self.container_client.create_container()
+            except ResourceExistsError:
+                pass
+            blob_client.upload_blob(data, overwrite=True, content_settings=settings)
+
+    def url(self, name):
+        if self.public_base_url:
+            return f"{self.public_base_url}/{name}"
+        from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+        expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.sas_ttl)
+        token = generate_blob_sas(self.container_client.account_name, self.container_client.container_name, name,
+                                  account_key=self.container_client.credential.account_key,
+                                  permission=BlobSasPermissions(read=True), expiry=expiry)
+        return f"{self.container_client.get_blob_client(name).url}?{token}"
+
+    def owns(self, url):
+        # URLs that already point at this store are left alone
+        return url.startswith(self.public_base_url or self.container_client.url)
+
+    def list(self):
+        # (name, last modified) of every blob; nothing when the container was never created
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            for blob in self.container_client.list_blobs():
+                yield blob.name, blob.last_modified
+        except ResourceNotFoundError:
+            return
+
+    def delete(self, name):
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            self.container_client.delete_blob(name)
+        except ResourceNotFoundError:
+            pass
+
+
+class MediaPipeline:
+    # Replaces the external pronunciation URLs of cards with copies in a media store. Distinct URLs are
+    # fetched once, at most concurrency at a time; files are stored under their content hash, so the same
+    # clip behind several URLs is stored once. URLs that do not resolve to audio are removed from the cards.
+    # The last max_resolved results are remembered so that later calls do not fetch those URLs again.
+    def __init__(self, store, fetch=fetch_audio, concurrency: int = 8, retries: int = 2, backoff: float = 0.5,
+                 max_resolved: int = 10000):
+        self.store = store
+        self.fetch = fetch
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = Counter()
+        # Values are 1-tuples, since None is a result (the URL is dropped) and also LRUCache's miss
+        self._resolved = LRUCache(max_size=max_resolved)
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+
+    def _count(self, name, amount: int = 1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _fetch(self, url):
+        for attempt in range(self.retries + 1):
+            try:
+                return self.fetch(url)
+            except MediaError as e:
+                if not e.transient or attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _resolve(self, url):
+        # Returns (store URL, cacheable): None for a URL that is not a valid audio file, and the original URL,
+        # not to be cached, when it could not be fetched or stored for now
+        try:
+            data, content_type = self._fetch(url)
+        except MediaError as e:
+            if e.transient:
+                # Keep the URL; a later call retries it
+                LOGGER.warning(f"Could not fetch pronunciation {url}, keeping it: {e}")
+                self._count("fetch_errors")
+                return url, False
+            LOGGER.warning(f"Dropping pronunciation {url}: {e}")
+            self._count("invalid")
+            return None, True
+        name = media_name(data, url, content_type)
+        self._count("fetched")
+        self._count("bytes", len(data))
+        try:
+            if self.store.exists(name):
+                self._count("deduplicated")
+            else:
+                self.store.put(name, data, content_type)
+                self._count("stored")
+        except Exception as e:
+            # Keep the original URL; the next call retries the upload
+            LOGGER.warning(f"Failed to store {url} as {name}: {e}")
+            self._count("store_errors")
+            return url, False
+        return self.store.url(name), True
+
+    def localize(self, cards):
+        # Rewrites the audio fields of cards in place and returns them
+        with self._lock:
+            pending = {card[field] for card in cards for field in AUDIO_FIELDS
+                       if isinstance(card.get(field), str) and card[field].startswith(("http://", "https://"))
+                       and not self.store.owns(card[field]) and self._resolved.get(card[field]) is None}
+            resolved = {}
+        if pending:
+            def resolve(url):
+                # Concurrent calls (several job items at once) share the download of a URL they both need
+                return self._flights.do(url, lambda: self._resolve(url))[0]
+
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(pending))) as executor:
+                results = dict(zip(pending, executor.map(resolve, pending)))
+            resolved = {url: result for url, (result, _) in results.items()}
+            for url, (result, cacheable) in results.items():
+                if cacheable:
+                    self._resolved.set(url, (result,))
+        with self._lock:
+            for card in cards:
+                for field in AUDIO_FIELDS:
+                    url = card.get(field)
+                    if not isinstance(url, str):
+                        continue
+                    cached = self._resolved.get(url)
+                    result = resolved[url] if url in resolved else cached[0] if cached is not None else url
+                    if result is None:
+                        del card[field]
+                    else:
+                        card[field] = result
+        return cards
+
+
+_media_pipeline = None
+_media_pipeline_lock = threading.Lock()
+
+
+def get_media_pipeline():
+    # Enabled by setting MediaContainer; MediaBaseUrl, the CDN endpoint in front of the container, is then
+    # required because the URLs are stored in the cards and SAS URLs would expire. MediaFetchConcurrency
+    # bounds the parallel downloads and MediaResolvedCacheSize the number of remembered URLs.
+    global _media_pipeline
+    container = os.environ.get("MediaContainer")
+    if not container:
+        return None
+    if not os.environ.get("MediaBaseUrl"):
+        raise ValueError("MediaBaseUrl must be set when MediaContainer is: the media container is private")
+    if _media_pipeline is None:
+        with _media_pipeline_lock:
+            if _media_pipeline is None:
+                from clients import get_blob_service
+                store = BlobMediaStore(get_blob_service().get_container_client(container),
+                                       os.environ.get("MediaBaseUrl"))
+                _media_pipeline = MediaPipeline(store, concurrency=int(os.environ.get("MediaFetchConcurrency", 8)),
+                                                max_resolved=int(os.environ.get("MediaResolvedCacheSize", 10000)))
+    return _media_pipeline
+
+
+def localize_media(cards):
+    # Runs the configured pipeline over cards, if any; a failure leaves the original URLs in place
+    pipeline = get_media_pipeline()
+    if pipeline is None or not cards:
+        return cards
+    try:
+        return pipeline.localize(cards)
+    except Exception as e:
+        LOGGER.warning(f"Media prefetch failed: {e}")
+        return cards
@@ -1,79 +1,117 @@
+import re
+from dataclasses import MISSING, dataclass, field, fields
+from typing import Optional
+
+
+def keyify(s):
+    # Convert to lowercase
+    s = s.lower()
+    # Replace spaces with underscores
+    s = s.replace(' ', '_')
+    # Remove all characters that are not lowercase letters or underscores
+    s = re.sub(r'[^a-z_]', '', s)
+    return s
+
+
+class ValidationError(ValueError):
+    # Carries every problem found in a record; str() joins them so existing "Bad Request: ..." messages still read well
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(errors))
+
+
+def _compile_validator(cls):
+    # Generates a straight-line validator from the dataclass fields: fields without a default are required,
+    # every declared field (plus the class's EXTRA_FIELDS) must be a string when present.
+    # Valid records take a single boolean expression; only invalid ones go through the slow path that
+    # collects every error instead of stopping at the first one.
+    required = [f.name for f in fields(cls) if f.name != "extra" and f.default is MISSING]
+    checked = [f.name for f in fields(cls) if f.name != "extra"] + list(cls.EXTRA_FIELDS)
+    fast_checks = ["type(data) is dict"]
+    if required:
+        fast_checks.append("(partial or (" + " and ".join(f"{name!r} in data" for name in required) + "))")
+    fast_checks += [f"type(data.get({name!r}, '')) is str" for name in checked]
+    lines = [
+        "def errors(data, partial=False):",
+        "    if " + " and ".join(fast_checks) + ":",
+        "        return NO_ERRORS",
+        "    if not isinstance(data, dict):",
+        f"        return [{cls.__name__ + ' must be a JSON object'!r}]",
+        "    found = []",
+        "    if not partial and not REQUIRED <= data.keys():",
+        "        found.append(f'Missing required keys: {REQUIRED - set(data.keys())}')",
+    ]
+    for name in checked:
+        lines.append(f"    if {name!r} in data and not isinstance(data[{name!r}], str):")
+        lines.append(f"        found.append({name + ' must be a string'!r})")
+    lines.append("    return found")
+    namespace = {"REQUIRED": set(required), "NO_ERRORS": ()}
+    exec("\n".join(lines), namespace)
+    return namespace["errors"]
+
+
+def schema(cls):
+    # Turns an annotated class into a __slots__ dataclass with compiled validate/errors/validate_many;
+    # unknown keys given to from_dict are kept in the extra dict
+    cls = dataclass(slots=True)(cls)
+    errors = _compile_validator(cls)
+    known = frozenset(f.name for f in fields(cls) if f.name != "extra")
+
+    def validate(data, partial: bool = False):
+        # partial validates only the fields present, for merge (PATCH) updates
+        found = errors(data, partial)
+        if found:
+            raise ValidationError(found)
+
+    def validate_many(records, partial: bool = False):
+        # Validates a whole batch in one pass; returns [(index, errors)] for the invalid records only
+        return [(index, found) for index, record in enumerate(records) if (found := errors(record, partial))]
+
+    def from_dict(data):
+        return cls(**{k: v for k, v in data.items() if k in known},
+                   extra={k: v for k, v in data.items() if k not in known})
+
+    cls.errors = staticmethod(errors)
+    cls.validate = staticmethod(validate)
+    cls.validate_many = staticmethod(validate_many)
+    cls.from_dict = staticmethod(from_dict)
+    return cls
+
+
+@schema
 class Module:
-    def __init__(self, title: str, description: str = None, **kwargs):
-        self.title = title
-        self.description = description
-        self.__dict__.update(kwargs)
-
-    @staticmethod
-    def validate(data):
-        required_keys = {'title'}
-        if not required_keys.issubset(data.keys()):
-            raise ValueError(f"Missing required keys: {required_keys - set(data.keys())}")
-        if not isinstance(data['title'], str):
-            raise ValueError(f"title must be a string")
-        if 'description' in data and not isinstance(data['description'], str):
-            raise ValueError(f"description must be a string")
+    EXTRA_FIELDS = ()
+
+    title: str
+    description: Optional[str] = None
+    extra: dict = field(default_factory=dict)
 
 
+@schema
 class Topic:
-    def __init__(self, module: str, title: str, description: str = None, **kwargs):
-        self.module = module
-        self.title = title
-        self.description = description
-        self.__dict__.update(kwargs)
-
-    @staticmethod
-    def validate(data):
-        required_keys = {'module', 'title'}
-        if not required_keys.issubset(data.keys()):
-            raise ValueError(f"Missing required keys: {required_keys - set(data.keys())}")
-        if not isinstance(data['module'], str):
-            raise ValueError(f"module must be a string")
-        if not isinstance(data['title'], str):
-            raise ValueError(f"title must be a string")
-        if 'description' in data and not isinstance(data['description'], str):
-            raise ValueError(f"description must be a string")
+    EXTRA_FIELDS = ()
 
+    module: str
+    title: str
+    description: Optional[str] = None
+    extra: dict = field(default_factory=dict)
 
+
+@schema
 class Card:
-    def __init__(self, topic: str, word: str, partOfSpeech: str, definition: str, ipaUk: str = None, ipaUs: str = None,
-                 pronUk: str = None, pronUs: str = None, meaningVi: str = None, exampleSentence: str = None, **kwargs):
-        self.topic = topic
-        self.word = word
-        self.partOfSpeech = partOfSpeech
-        self.definition = definition
-        self.ipaUk = ipaUk
-        self.ipaUs = ipaUs
-        self.pronUk = pronUk
-        self.pronUs = pronUs
-        self.meaningVi = meaningVi
-        self.exampleSentence = exampleSentence
-        self.__dict__.update(kwargs)
-
-    @staticmethod
-    def validate(data):
-        required_keys = {'topic', 'word', 'partOfSpeech', 'definition'}
-        if not required_keys.issubset(data.keys()):
-            raise ValueError(f"Missing required keys: {required_keys - set(data.keys())}")
-        if not isinstance(data['word'], str):
-            raise ValueError(f"word must be a string")
-        if not isinstance(data['partOfSpeech'], str):
-            raise ValueError(f"partOfSpeech must be a string")
-        if not isinstance(data['definition'], str):
-            raise ValueError(f"definition must be a string")
-        if 'partitionKey' in data and not isinstance(data['partitionKey'], str):
-            raise ValueError(f"partitionKey must be a string")
-        if 'rowKey' in data and not isinstance(data['rowKey'], str):
-            raise ValueError(f"rowKey must be a string")
-        if 'ipaUk' in data and not isinstance(data['ipaUk'], str):
-            raise ValueError(f"ipaUk must be a string")
-        if 'ipaUs' in data and not isinstance(data['ipaUs'], str):
-            raise ValueError(f"ipaUs must be a string")
-        if 'pronUk' in data and not isinstance(data['pronUk'], str):
-            raise ValueError(f"pronUk must be a string")
-        if 'pronUs' in data and not isinstance(data['pronUs'], str):
-            raise ValueError(f"pronUs must be a string")
-        if 'meaningVi' in data and not isinstance(data['meaningVi'], str):
-            raise ValueError(f"meaningVi must be a string")
-        if 'exampleSentence' in data and not isinstance(data['exampleSentence'], str):
-            raise ValueError(f"exampleSentence must be a string")
+    EXTRA_FIELDS = ("partitionKey", "rowKey")
+
+    topic: str
+    word: str
+    partOfSpeech: str
+    definition: str
+    ipaUk: Optional[str] = None
+    ipaUs: Optional[str] = None
+    pronUk: Optional[str] = None
+    pronUs: Optional[str] = None
+    meaningVi: Optional[str] = None
+    exampleSentence: Optional[str] = None
+    extra: dict = field(default_factory=dict)
+
+
+CARD_FIELDS = tuple(f.name for f in fields(Card) if f.name != "extra") + ("Timestamp",)
@@ -0,0 +1,49 @@
+import base64
+import binascii
+import json
+
+# Table Storage returns at most 1000 entities per page
+MAX_PAGE_SIZE = 1000
+KEY_FIELDS = ("PartitionKey", "RowKey")
+
+
+def encode_continuation_token(token):
+    # Opaque, URL-safe form of the {"PartitionKey", "RowKey"} continuation returned by the Table service
+    if not token:
+        return None
+    payload = json.dumps([token.get("PartitionKey"), token.get("RowKey")], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip("=")
+
+
+def decode_continuation_token(value):
+    if not value:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        partition_key, row_key = json.loads(payload)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise ValueError("Invalid continuation token")
+    return {"PartitionKey": partition_key, "RowKey": row_key}
+
+
+def parse_page_size(value, default: int = 10):
+    if value is None:
+        return default
+    try:
+        page_size = int(value)
+    except ValueError:
+        raise ValueError("page size must be an integer")
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f"page size must be between 1 and {MAX_PAGE_SIZE}")
+    return page_size
+
+
+def parse_select(value, allowed):
+    # Comma separated projection; the entity keys are always returned so that items stay addressable
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = set(fields) - set(allowed) - set(KEY_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown select fields: {unknown}")
+    return list(KEY_FIELDS) + [field for field in fields if field not in KEY_FIELDS]
@@ -0,0 +1,349 @@
+import bisect
+import datetime
+import gzip
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+LOGGER = logging.getLogger(__name__)
+
+# Indexed fields and how much a match in each contributes to a card's score
+FIELD_WEIGHTS = {"word": 4.0, "meaningVi": 2.0, "definition": 1.0, "exampleSentence": 0.5}
+# Fields kept per card so that results can be returned without reading the table
+STORED_FIELDS = ("PartitionKey", "RowKey", "topic", "word", "partOfSpeech", "definition", "meaningVi", "exampleSentence")
+# A prefix match scores this fraction of an exact match
+PREFIX_FACTOR = 0.5
+# Upper bound on the terms a prefix expands to, so one-letter queries stay cheap
+MAX_PREFIX_TERMS = 64
+SNAPSHOT_VERSION = 1
+TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def fold(text):
+    # Lowercase and strip diacritics, so "Quả táo" and "qua tao" match; đ has no decomposition of its own
+    text = unicodedata.normalize("NFD", (text or "").lower().replace("đ", "d"))
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return TOKEN.findall(fold(text))
+
+
+def card_terms(card):
+    # term -> score of the card for that term; a term found in several fields takes the best weight
+    terms = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        value = card.get(field)
+        if not isinstance(value, str):
+            continue
+        for term in tokenize(value):
+            if terms.get(term, 0) < weight:
+                terms[term] = weight
+    return terms
+
+
+class SearchIndex:
+    # In-memory inverted index over cards with prefix lookup on a sorted term list (bisect) and word
+    # suggestions for autocomplete. Cards are addressed by (PartitionKey, RowKey); add() replaces a card
+    # that is already indexed. Thread-safe.
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs = {}
+        self._ids = {}
+        self._next_id = 0
+        self._postings = {}
+        self._terms = []
+        self._words = {}
+        self._word_list = []
+        self.synced_at = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _add_term(self, term, doc_id, score):
+        postings = self._postings.get(term)
+        if postings is None:
+            postings = self._postings[term] = {}
+            bisect.insort(self._terms, term)
+        postings[doc_id] = score
+
+    def _remove_term(self, term, doc_id):
+        postings = self._postings[term]
+        del postings[doc_id]
+        if not postings:
+            del self._postings[term]
+            del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def _add_word(self, word):
+        key = fold(word).strip()
+        entry = self._words.get(key)
+        if entry is None:
+            self._words[key] = [word, 1]
+            bisect.insort(self._word_list, key)
+        else:
+            entry[1] += 1
+
+    def _remove_word(self, word):
+        key = fold(word).strip()
+        entry = self._words[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._words[key]
+            del self._word_list[bisect.bisect_left(self._word_list, key)]
+
+    def add(self, card):
+        key = (card["PartitionKey"], card["RowKey"])
+        document = {field: card[field] for field in STORED_FIELDS if card.get(field) is not None}
+        terms = card_terms(card)
+        with self._lock:
+            self.remove(*key)
+            doc_id = self._next_id
+            self._next_id += 1
+            self._docs[doc_id] = (document, tuple(terms))
+            self._ids[key] = doc_id
+            for term, score in terms.items():
+                self._add_term(term, doc_id, score)
+            if document.get("word"):
+                self._add_word(document["word"])
+
+    def remove(self, partition_key, row_key):
+        with self._lock:
+            doc_id = self._ids.pop((partition_key, row_key), None)
+            if doc_id is None:
+                return False
+            document, terms = self._docs.pop(doc_id)
+            for term in terms:
+                self._remove_term(term, doc_id)
+            if document.get("word"):
+                self._remove_word(document["word"])
+            return True
+
+    def document(self, partition_key, row_key):
+        with self._lock:
+            doc_id = self._ids.get((partition_key, row_key))
+            return dict(self._docs[doc_id][0]) if doc_id is not None else None
+
+    def merge(self, partition_key, row_key, fields):
+        # Applies a partial (PATCH) update on top of the indexed version of the card
+        with self._lock:
+            document = self.document(partition_key, row_key) or {}
+            self.add(dict(document, **fields, PartitionKey=partition_key, RowKey=row_key))
+
+    def _prefix_terms(self, prefix):
+        start = bisect.bisect_left(self._terms, prefix)
+        terms = []
+        for term in self._terms[start:start + MAX_PREFIX_TERMS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def _matches(self, token, prefix):
+        # doc id -> score for one query token
+        matches = dict(self._postings.get(token, {}))
+        if prefix:
+            for term in self._prefix_terms(token):
+                if term == token:
+                    continue
+                for doc_id, score in self._postings[term].items():
+                    if matches.get(doc_id, 0) < score * PREFIX_FACTOR:
+                        matches[doc_id] = score * PREFIX_FACTOR
+        return matches
+
+    def search(self, query, limit: int = 20, topic_key: str = None):
+        # Every query token must match; the last one also matches as a prefix, for search-as-you-type.
+        # Returns the stored fields of the best cards with their score.
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            scores = None
+            for i, token in enumerate(tokens):
+                matches = self._matches(token, prefix=i == len(tokens) - 1)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {doc_id: score + matches[doc_id] for doc_id, score in scores.items()
+                              if doc_id in matches}
+                if not scores:
+                    return []
+            if topic_key is not None:
+                scores = {doc_id: score for doc_id, score in scores.items()
+                          if self._docs[doc_id][0]["PartitionKey"] == topic_key}
+            best = heapq.nsmallest(limit, scores.items(),
+                                   key=lambda item: (-item[1], self._docs[item[0]][0].get("word", "")))
+            return [dict(self._docs[doc_id][0], score=score) for doc_id, score in best]
+
+    def suggest(self, prefix, limit: int = 10):
+        # Distinct words starting with prefix (diacritics and case ignored), in alphabetical order
+        key = fold(prefix).strip()
+        if not key:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(self._word_list, key)
+            words = []
+            for folded in self._word_list[start:start + limit]:
+                if not folded.startswith(key):
+                    break
+                words.append(self._words[folded][0])
+            return words
+
+    def refresh(self, table_client):
+        # Picks up cards written since the last sync, including writes made by other instances; deletions
+        # made elsewhere are only seen when the index is rebuilt
+        if self.synced_at is None:
+            return 0
+        count = 0
+        synced_at = self.synced_at
+        for entity in table_client.query_entities(query_filter="Timestamp gt @since",
+                                                  parameters={"since": self.synced_at}, select=list(STORED_FIELDS)):
+            self.add(entity)
+            timestamp = entity_timestamp(entity)
+            if timestamp is not None and timestamp > synced_at:
+                synced_at = timestamp
+            count += 1
+        self.synced_at = synced_at
+        return count
+
+    def to_snapshot(self):
+        # gzip'd JSON with the documents and the postings (doc ids renumbered densely), so that loading
+        # needs no tokenizing
+        with self._lock:
+            numbering = {doc_id: i for i, doc_id in enumerate(self._docs)}
+            snapshot = {
+                "version": SNAPSHOT_VERSION,
+                "syncedAt": self.synced_at.isoformat() if self.synced_at else None,
+                "fields": STORED_FIELDS,
+                "docs": [[document.get(field) for field in STORED_FIELDS] for document, _ in self._docs.values()],
+                "postings": {term: [[numbering[doc_id], score] for doc_id, score in postings.items()]
+                             for term, postings in self._postings.items()},
+            }
+        return gzip.compress(json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode('utf-8'))
+
+    @staticmethod
+    def from_snapshot(data):
+        snapshot = json.loads(gzip.decompress(data))
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported search snapshot version {snapshot.get('version')}")
+        index = SearchIndex()
+        fields = snapshot["fields"]
+        terms = [[] for _ in snapshot["docs"]]
+        for term, postings in snapshot["postings"].items():
+            index._postings[term] = dict(postings)
+            for doc_id, _ in postings:
+                terms[doc_id].append(term)
+        for doc_id, values in enumerate(snapshot["docs"]):
+            document = {field: value for field, value in zip(fields, values) if value is not None}
+            index._docs[doc_id] = (document, tuple(terms[doc_id]))
+            index._ids[(document["PartitionKey"], document["RowKey"])] = doc_id
+            if document.get("word"):
+                key = fold(document["word"]).strip()
+                entry = index._words.setdefault(key, [document["word"], 0])
+                entry[1] += 1
+        index._next_id = len(snapshot["docs"])
+        index._terms = sorted(index._postings)
+        index._word_list = sorted(index._words)
+        if snapshot.get("syncedAt"):
+            index.synced_at = datetime.datetime.fromisoformat(snapshot["syncedAt"])
+        return index
+
+
+def entity_timestamp(entity):
+    metadata = getattr(entity, "metadata", None) or {}
+    return metadata.get("timestamp") or entity.get("Timestamp")
+
+
+def build_search_index(table_client):
+    # Full scan of the Cards table. Cards written while it runs are picked up by the next refresh, which
+    # starts a little before the scan did to allow for clock skew against the storage service.
+    started = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=60)
+    index = SearchIndex()
+    for entity in table_client.list_entities(select=list(STORED_FIELDS)):
+        index.add(entity)
+    index.synced_at = started
+    return index
+
+
+def _snapshot_blob():
+    from clients import get_blob_service
+    return get_blob_service().get_blob_client(os.environ.get("SearchSnapshotContainer", "search"),
+                                              os.environ.get("SearchSnapshotBlob", "cards.json.gz"))
+
+
+def save_search_index(index):
+    from azure.core.exceptions import ResourceNotFoundError
+    blob = _snapshot_blob()
+    data = index.to_snapshot()
+    try:
+        blob.upload_blob(data, overwrite=True)
+    except ResourceNotFoundError:
+        blob.get_container_client().create_container()
+        blob.upload_blob(data, overwrite=True)
+    return len(data)
+
+
+def load_search_index(table_client):
+    # Cold start: the blob snapshot plus the cards written since it was taken; without a snapshot the index
+    # is built from the table and saved
+    from azure.core.exceptions import ResourceNotFoundError
+    start = time.perf_counter()
+    try:
+        index = SearchIndex.from_snapshot(_snapshot_blob().download_blob().readall())
+    except ResourceNotFoundError:
+        index = build_search_index(table_client)
+        save_search_index(index)
+    index.refresh(table_client)
+    LOGGER.info(f"Loaded search index of {len(index)} cards in {time.perf_counter() - start:.3f}s")
+    return index
+
+
+_search_index = None
+_search_index_refreshed = 0.0
+_search_index_refreshing = False
+_search_index_lock = threading.Lock()
+
+
+def _refresh_search_index(index, table_client):
+    global _search_index_refreshing
+    try:
+        index.refresh(table_client)
+    except Exception as e:
+        LOGGER.warning(f"Search index refresh failed: {e}")
+    finally:
+        with _search_index_lock:
+            _search_index_refreshing = False
+
+
+def get_search_index(table_client):
+    # Process-level index, loaded on first use. At most every SearchRefreshInterval seconds a background
+    # thread picks up cards written by other instances; the Timestamp query behind it scans the table, so
+    # searches keep being served from the current index instead of waiting for it.
+    global _search_index, _search_index_refreshed, _search_index_refreshing
+    interval = float(os.environ.get("SearchRefreshInterval", 60))
+    with _search_index_lock:
+        if _search_index is None:
+            _search_index = load_search_index(table_client)
+            _search_index_refreshed = time.monotonic()
+        elif not _search_index_refreshing and time.monotonic() - _search_index_refreshed >= interval:
+            _search_index_refreshed = time.monotonic()
+            _search_index_refreshing = True
+            threading.Thread(target=_refresh_search_index, args=(_search_index, table_client), daemon=True,
+                             name="search-index-refresh").start()
+        return _search_index
+
+
+def peek_search_index():
+    # The index if this instance has loaded it; card writes update it in place but never trigger a load
+    return _search_index
+
+
+def replace_search_index(index):
+    global _search_index, _search_index_refreshed
+    with _search_index_lock:
+        _search_index = index
+        _search_index_refreshed = time.monotonic()